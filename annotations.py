@@ -0,0 +1,160 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Annotation tables parsed from the UniProt text columns at ingest:
+# table name -> (UniProt column, topic prefix of the comment blocks)
+annotation_columns = {
+    "mutagenesis": ("Mutagenesis", "MUTAGEN"),
+    "function": ("Function [CC]", "FUNCTION"),
+    "disease": ("Involvement in disease", "DISEASE"),
+    "tissue": ("Tissue specificity", "TISSUE SPECIFICITY"),
+}
+
+# Columns of the annotation tables, "row" is the row of the entry in the UniProt table.
+# evidence holds the ECO codes, pubmed and mim the PubMed and MIM IDs cited by the item.
+_references = [("evidence", pa.list_(pa.string())), ("pubmed", pa.list_(pa.string()))]
+annotation_schemas = {
+    "mutagenesis": pa.schema([("row", pa.int64()), ("start", pa.int64()), ("end", pa.int64()),
+                              ("note", pa.string())] + _references),
+    "function": pa.schema([("row", pa.int64()), ("text", pa.string())] + _references),
+    "disease": pa.schema([("row", pa.int64()), ("name", pa.string()), ("acronym", pa.string()),
+                          ("mim", pa.list_(pa.string())), ("text", pa.string()), ("note", pa.string())]
+                         + _references),
+    "tissue": pa.schema([("row", pa.int64()), ("text", pa.string())] + _references),
+}
+
+_evidence_block = re.compile(r"\{([^{}]*)\}")
+_pubmed_reference = re.compile(r"\s*\((?:PubMed:\d+(?:,\s*)?)+\)")
+_disease_heading = re.compile(r"^(?P<name>[^\[]*?)\s*(?:\((?P<acronym>[^()]+)\))?\s*\[MIM:(?P<mim>\d+)\]:\s*")
+
+def unique(values):
+    return list(dict.fromkeys(values))
+
+def references(text):
+    """
+    (ECO codes, PubMed IDs) cited in a piece of annotation text, in order of appearance
+    """
+    return unique(re.findall(r"ECO:\d+", text)), unique(re.findall(r"PubMed:(\d+)", text))
+
+def clean_text(text):
+    """
+    Annotation text without its evidence blocks, inline PubMed references and surrounding punctuation
+    """
+    text = _pubmed_reference.sub("", _evidence_block.sub("", text))
+    return re.sub(r"\s+", " ", text).strip().strip(".;").strip()
+
+def topic_blocks(value, topic):
+    """
+    Split a UniProt comment column into its "TOPIC: ..." blocks (an entry can have several)
+    """
+    if pd.isna(value):
+        return []
+    blocks = re.split(r"(?:^|;?\s+)" + re.escape(topic) + r":?\s", str(value))
+    return [block.strip() for block in blocks if block.strip()]
+
+def parse_mutagenesis(value, topic="MUTAGEN"):
+    """
+    One dictionary per MUTAGEN feature: start and end positions (1-based, inclusive), note,
+    evidence codes and PubMed IDs
+    """
+    mutations = []
+    for block in topic_blocks(value, topic):
+        position = re.match(r"(\d+)(?:\.\.(\d+))?;", block)
+        note = re.search(r'/note="([^"]*)"', block)
+        if not position or not note:
+            continue
+        evidence = re.search(r'/evidence="([^"]*)"', block)
+        eco, pubmed = references(evidence.group(1) if evidence else "")
+        start = int(position.group(1))
+        mutations.append({"start": start, "end": int(position.group(2) or start), "note": note.group(1),
+                          "evidence": eco, "pubmed": pubmed})
+    return mutations
+
+def parse_statements(value, topic):
+    """
+    One dictionary per statement of a comment column (the text backed by one evidence block),
+    with the cleaned text, evidence codes and PubMed IDs
+    """
+    statements = []
+    for block in topic_blocks(value, topic):
+        start = 0
+        for match in list(_evidence_block.finditer(block)) + [None]:
+            end = match.end() if match else len(block)
+            segment = block[start:end]
+            start = end
+            text = clean_text(segment)
+            if not text:
+                continue
+            eco, pubmed = references(segment)
+            statements.append({"text": text, "evidence": eco, "pubmed": pubmed})
+    return statements
+
+def parse_diseases(value, topic="DISEASE"):
+    """
+    One dictionary per DISEASE block: name, acronym and MIM IDs of the disease (missing for
+    notes not tied to a disease), description, note, evidence codes and PubMed IDs
+    """
+    diseases = []
+    for block in topic_blocks(value, topic):
+        heading = _disease_heading.match(block)
+        body = block[heading.end():] if heading else block
+        text, _, note = body.partition("Note=")
+        eco, pubmed = references(block)
+        diseases.append({"name": heading.group("name") if heading else None,
+                         "acronym": heading.group("acronym") if heading else None,
+                         "mim": unique(re.findall(r"MIM:(\d+)", block)),
+                         "text": clean_text(text) or None,
+                         "note": clean_text(note) or None,
+                         "evidence": eco, "pubmed": pubmed})
+    return diseases
+
+# Parser of each annotation table: function(value, topic) -> list of dictionaries
+_parsers = {
+    "mutagenesis": parse_mutagenesis,
+    "function": parse_statements,
+    "disease": parse_diseases,
+    "tissue": parse_statements,
+}
+
+def annotation_frame(name, df_uniprot, first_row=0):
+    """
+    Parse the column of an annotation table into a DataFrame (one row per item).
+
+    Parameters:
+    - name: key of the table in annotation_columns
+    - df_uniprot: UniProt table (or chunk of it) holding the column
+    - first_row: row of the first entry of df_uniprot in the whole table
+    """
+    column, topic = annotation_columns[name]
+    records = []
+    for row, value in enumerate(df_uniprot[column], start=first_row):
+        if pd.isna(value):
+            continue
+        for item in _parsers[name](value, topic):
+            item["row"] = row
+            records.append(item)
+    return pd.DataFrame(records, columns=annotation_schemas[name].names)
+
+class AnnotationTable:
+    """
+    Annotation table sorted by UniProt row, with the lookup of the items of an entry
+    """
+
+    def __init__(self, frame):
+        self.frame = frame.sort_values("row", kind="stable").reset_index(drop=True)
+        self.rows = self.frame["row"].to_numpy(dtype=np.int64)
+
+    def for_row(self, row):
+        """
+        Items of the UniProt row, as a DataFrame
+        """
+        start, stop = np.searchsorted(self.rows, [row, row + 1])
+        return self.frame.iloc[start:stop]
+
+def get_annotation_table(dataset, name):
+    """
+    Return an annotation table of a dataset (see annotation_columns), read on first use
+    """
+    return dataset.derived(("annotations", name), lambda dataset: AnnotationTable(dataset.table(name)))
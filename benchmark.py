@@ -0,0 +1,303 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from data_store import tables, read_table, parse_table, compact_frame
+from dataset import Dataset
+from import_CSV import (filter_results_uniprot, get_values_for_rows_uniprot, refine_results_uniprot,
+                        get_facet_counts_uniprot, facet_fields_uniprot)
+from query_cache import query_cache
+from sequence_matrix import PAD
+from similarity_search import score_all
+from text_index import TextIndex, text_fields
+from descriptors import Descriptors, residue_counts
+from hydropathy import HydropathyProfiles
+from neighbours import KmerSets, compute_neighbours
+from features import feature_frame
+
+# Query used by the benchmarks: the second transmembrane helix of human GPER
+BENCHMARK_QUERY = "LFLSCLYTIFLFPIGFVGN"
+
+def random_codes(n_sequences, length=400, seed=0):
+    """
+    Padded matrix of random residue codes (20 standard amino acids), lengths between length/2 and length
+    """
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, 20, size=(n_sequences, length), dtype=np.int8)
+    lengths = rng.integers(length // 2, length + 1, size=n_sequences)
+    codes[np.arange(length)[None, :] >= lengths[:, None]] = PAD
+    return codes
+
+def bench_similarity(sizes=(10000, 100000), methods=("ungapped", "smith-waterman"), processes=None):
+    """
+    Time score_all against random sequence sets of the given sizes
+    """
+    for size in sizes:
+        codes = random_codes(size)
+        for method in methods:
+            start = time.perf_counter()
+            score_all(BENCHMARK_QUERY, codes, method=method, processes=processes)
+            elapsed = time.perf_counter() - start
+            print(f"similarity {method:>14} | {size:>7} sequences | {elapsed:8.3f} s | {size / elapsed:10.0f} seq/s")
+
+def resampled_uniprot(n_rows, columns, seed=0):
+    """
+    UniProt-like table of n_rows rows drawn from uniprot.csv, with unique Entry values
+    """
+    df = read_table("uniprot", columns=columns)
+    df = df.sample(n=n_rows, replace=True, random_state=seed).reset_index(drop=True)
+    if "Entry" in df.columns:
+        df["Entry"] = df["Entry"] + "-" + df.index.astype(str)
+    return df
+
+def legacy_filter_uniprot(df_uniprot, dic):
+    """
+    Categorical and range filters as computed before the bitmap indexes (one scan per value)
+    """
+    request = pd.Series([True] * len(df_uniprot))
+    for field in dic.keys():
+        if isinstance(dic[field], tuple):
+            request &= (df_uniprot[field] >= dic[field][0]) & (df_uniprot[field] <= dic[field][1])
+        else:
+            request_or = pd.Series([False] * len(df_uniprot))
+            if len(dic[field]) != 0:
+                for value in dic[field]:
+                    request_or |= (df_uniprot[field] == value)
+                request &= request_or
+    return df_uniprot.loc[request].index.tolist()
+
+def bench_filters(sizes=(10000, 100000), repeat=20):
+    """
+    Compare the bitmap filter path of filter_results_uniprot with the previous column scans
+    """
+    columns = ["Entry", "Entry Name", "Organism", "Protein names", "Length", "Transmembrane", "Glycosylation"]
+    for size in sizes:
+        df = resampled_uniprot(size, columns)
+        organisms = df["Organism"].value_counts().index.tolist()
+        dic = {
+            "Entry": [],
+            "Entry Name": df["Entry Name"].drop_duplicates().head(20).tolist(),
+            "Organism": organisms[:5],
+            "Protein names": [],
+            "Length": (300, 450),
+        }
+        dataset = Dataset.from_frames(uniprot=df)
+
+        start = time.perf_counter()
+        expected = filter_results_uniprot(dic, dataset=dataset)
+        build = time.perf_counter() - start
+
+        # Without the query cache, every repetition runs the filters
+        start = time.perf_counter()
+        for _ in range(repeat):
+            filter_results_uniprot.__wrapped__(dic, dataset=dataset)
+        bitmap = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = legacy_filter_uniprot(df, dic)
+        legacy = (time.perf_counter() - start) / repeat
+
+        assert result == expected
+        print(f"filters | {size:>7} rows | first call {build * 1000:8.2f} ms | "
+              f"bitmaps {bitmap * 1000:8.2f} ms | column scans {legacy * 1000:8.2f} ms | x{legacy / bitmap:.1f}")
+
+def bench_query_cache(sizes=(10000, 100000), repeat=200):
+    """
+    Time a rerun of the main page queries (same filters) answered by the query cache
+    """
+    columns = ["Entry", "Entry Name", "Organism", "Protein names", "Length", "Transmembrane", "Glycosylation"]
+    for size in sizes:
+        df = resampled_uniprot(size, columns)
+        dic = {
+            "Entry": [],
+            "Organism": df["Organism"].value_counts().index[:5].tolist(),
+            "Length": (300, 450),
+        }
+        dataset = Dataset.from_frames(uniprot=df)
+
+        start = time.perf_counter()
+        rows = filter_results_uniprot(dic, dataset=dataset)
+        get_values_for_rows_uniprot(rows, columns, dataset=dataset)
+        miss = time.perf_counter() - start
+
+        hits_before = query_cache.hits
+        start = time.perf_counter()
+        for _ in range(repeat):
+            rows = filter_results_uniprot(dic, dataset=dataset)
+            get_values_for_rows_uniprot(rows, columns, dataset=dataset)
+        hit = (time.perf_counter() - start) / repeat
+
+        assert query_cache.hits - hits_before == 2 * repeat
+        print(f"query cache | {size:>7} rows | miss {miss * 1000:8.2f} ms | "
+              f"hit {hit * 1e6:8.1f} us | {query_cache.stats()['bytes'] / 1e6:.1f} MB cached")
+
+def bench_refinement(sizes=(10000, 100000), repeat=20):
+    """
+    Time a session narrowing its filters step by step, refined from the previous result
+    or evaluated over the whole table
+    """
+    columns = ["Entry", "Entry Name", "Organism", "Protein names", "Length", "Transmembrane", "Glycosylation"]
+    for size in sizes:
+        df = resampled_uniprot(size, columns)
+        organisms = df["Organism"].value_counts().index.tolist()
+        steps = [
+            {"Organism": organisms[:5]},
+            {"Organism": organisms[:5], "Length": (200, 600)},
+            {"Organism": organisms[:5], "Length": (300, 450)},
+            {"Organism": organisms[:2], "Length": (300, 450)},
+            {"Organism": organisms[:2], "Length": (300, 450), "Entry Name": df["Entry Name"].head(50).tolist()},
+        ]
+        dataset = Dataset.from_frames(uniprot=df, features=feature_frame(df))
+        for dic in steps:
+            filter_results_uniprot.__wrapped__(dic, dataset=dataset)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            full = [filter_results_uniprot.__wrapped__(dic, dataset=dataset) for dic in steps[1:]]
+        scratch = (time.perf_counter() - start) / repeat / (len(steps) - 1)
+
+        elapsed = 0.0
+        for _ in range(repeat):
+            session = {}
+            refine_results_uniprot(steps[0], session, dataset=dataset)
+            start = time.perf_counter()
+            refined = [refine_results_uniprot(dic, session, dataset=dataset) for dic in steps[1:]]
+            elapsed += time.perf_counter() - start
+        refine = elapsed / repeat / (len(steps) - 1)
+
+        assert refined == full
+        check_feature_refinement(dataset)
+        print(f"refinement | {size:>7} rows | from scratch {scratch * 1000:8.2f} ms/step | "
+              f"refined {refine * 1000:8.2f} ms/step | x{scratch / refine:.1f}")
+
+def check_feature_refinement(dataset):
+    """
+    Changing or clearing the "Feature" filter of a session must not keep the previous rows
+    """
+    session = {}
+    for dic in [{"Feature": {"types": ["CARBOHYD"]}}, {"Feature": {"types": ["TRANSMEM"]}}, {"Feature": {}}]:
+        refined = refine_results_uniprot(dic, session, dataset=dataset)
+        assert refined == filter_results_uniprot.__wrapped__(dic, dataset=dataset)
+
+def bench_facets(sizes=(10000, 100000), repeat=10):
+    """
+    Time the facet counts of the sidebar multiselects for a typical filter state
+    """
+    columns = facet_fields_uniprot + ["Length"]
+    for size in sizes:
+        df = resampled_uniprot(size, columns)
+        dic = {
+            "Organism": df["Organism"].value_counts().index[:3].tolist(),
+            "Gene Names": [],
+            "Length": (300, 450),
+        }
+        dataset = Dataset.from_frames(uniprot=df)
+
+        start = time.perf_counter()
+        get_facet_counts_uniprot.__wrapped__(dic, dataset=dataset)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            counts = get_facet_counts_uniprot.__wrapped__(dic, dataset=dataset)
+        elapsed = (time.perf_counter() - start) / repeat
+
+        values = sum(len(field_counts) for field_counts in counts.values())
+        print(f"facets | {size:>7} rows | first call {build * 1000:8.2f} ms | "
+              f"counts {elapsed * 1000:8.2f} ms | {values} values with rows")
+
+def bench_memory(sizes=(10000, 50000)):
+    """
+    Resident size of the whole UniProt table with object columns and in compact form
+    """
+    # Parsed from the export with object columns (works before python data_store.py)
+    raw = parse_table("uniprot", tables["uniprot"][0])
+    for size in sizes:
+        df = raw.sample(n=size, replace=True, random_state=0).reset_index(drop=True)
+        start = time.perf_counter()
+        compact = compact_frame(pa.Table.from_pandas(df, preserve_index=False))
+        elapsed = time.perf_counter() - start
+        before = df.memory_usage(deep=True).sum()
+        after = compact.memory_usage(deep=True).sum()
+        print(f"memory | {size:>7} rows | object columns {before / 1e6:8.1f} MB | "
+              f"compact {after / 1e6:8.1f} MB | x{before / after:.1f} | conversion {elapsed:.2f} s")
+
+def bench_text(sizes=(10000, 100000), repeat=20):
+    """
+    Time the construction of the full-text index and the ranked queries on it
+    """
+    columns = list(text_fields["uniprot"].values())
+    queries = ["apoptosis", 'disease:"immunologic disease"', "estrogen receptor signaling"]
+    for size in sizes:
+        df = resampled_uniprot(size, columns)
+        start = time.perf_counter()
+        index = TextIndex.build({field: df[column] for field, column in text_fields["uniprot"].items()})
+        build = time.perf_counter() - start
+        for query in queries:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                rows, _ = index.search(query)
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f"text | {size:>7} rows | build {build:6.2f} s | {query!r:32} {elapsed * 1000:8.2f} ms | "
+                  f"{len(rows)} rows")
+
+def bench_descriptors(sizes=(10000, 100000)):
+    """
+    Time the physicochemical descriptors of random sequence sets (counts and all descriptors)
+    """
+    for size in sizes:
+        codes = random_codes(size)
+        start = time.perf_counter()
+        counts = residue_counts(codes)
+        counted = time.perf_counter() - start
+        Descriptors(counts)
+        elapsed = time.perf_counter() - start
+        print(f"descriptors | {size:>7} sequences | counts {counted:6.3f} s | total {elapsed:6.3f} s | "
+              f"{size / elapsed:10.0f} seq/s")
+
+def bench_hydropathy(sizes=(10000, 100000)):
+    """
+    Time the hydropathy profiles and transmembrane segments of random sequence sets
+    """
+    for size in sizes:
+        codes = random_codes(size)
+        lengths = (codes != PAD).sum(axis=1)
+        start = time.perf_counter()
+        profiles = HydropathyProfiles.build(np.arange(size).astype(str), codes, lengths)
+        elapsed = time.perf_counter() - start
+        print(f"hydropathy | {size:>7} sequences | {elapsed:6.3f} s | {size / elapsed:10.0f} seq/s | "
+              f"profiles {profiles.profiles.nbytes / 1e6:8.1f} MB")
+
+def bench_neighbours(sizes=(2000, 10000), processes=None):
+    """
+    Time the all-vs-all k-mer Jaccard neighbour lists of random sequence sets
+    """
+    for size in sizes:
+        codes = random_codes(size)
+        start = time.perf_counter()
+        kmer_sets = KmerSets(codes)
+        indexed = time.perf_counter() - start
+        compute_neighbours(kmer_sets, np.arange(size), processes=processes)
+        elapsed = time.perf_counter() - start
+        print(f"neighbours | {size:>7} sequences | k-mer sets {indexed:6.3f} s | total {elapsed:7.2f} s | "
+              f"{size / elapsed:8.0f} rows/s")
+
+benchmarks = {
+    "similarity": bench_similarity,
+    "filters": bench_filters,
+    "query_cache": bench_query_cache,
+    "refinement": bench_refinement,
+    "facets": bench_facets,
+    "memory": bench_memory,
+    "text": bench_text,
+    "descriptors": bench_descriptors,
+    "hydropathy": bench_hydropathy,
+    "neighbours": bench_neighbours,
+}
+
+if __name__ == "__main__":
+    # python benchmark.py [name ...]
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+# Values found in more rows than this fraction keep a packed bitmap, rarer ones a list of rows
+DENSE_FRACTION = 1 / 32
+
+def all_rows(n_rows):
+    """
+    Packed bitmap with every row set
+    """
+    return np.packbits(np.ones(n_rows, dtype=bool))
+
+def pack_mask(mask):
+    """
+    Packed bitmap of a boolean array (or Series) over the rows
+    """
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+def bitmap_rows(bitmap, n_rows):
+    """
+    Row numbers set in a packed bitmap
+    """
+    return np.flatnonzero(np.unpackbits(bitmap, count=n_rows))
+
+class BitmapIndex:
+    """
+    Index of one column: value -> rows holding exactly that value.
+    Frequent values are stored as packed bitmaps (one bit per row), rare values as
+    arrays of row numbers, so high-cardinality columns such as Entry stay small.
+    """
+
+    def __init__(self, values):
+        self.n_rows = len(values)
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        # Value number of each row (-1 for missing values), for the facet counts
+        self.codes = codes
+        self.values = list(uniques)
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+        self.bitmaps = {}
+        self.postings = {}
+        for code, value in enumerate(uniques):
+            rows = order[boundaries[code]:boundaries[code + 1]]
+            if len(rows) > DENSE_FRACTION * self.n_rows:
+                self.bitmaps[value] = pack_mask(codes == code)
+            else:
+                self.postings[value] = rows
+
+    def bitmap(self, values):
+        """
+        Packed bitmap of the rows equal to any of the values
+        """
+        result = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in self.bitmaps:
+                np.bitwise_or(result, self.bitmaps[value], out=result)
+            elif value in self.postings:
+                rows = self.postings[value]
+                np.bitwise_or.at(result, rows >> 3, (128 >> (rows & 7)).astype(np.uint8))
+        return result
+
+    def contains(self, values, rows):
+        """
+        Boolean array telling which of the rows hold any of the values
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.zeros(len(rows), dtype=bool)
+        rare = []
+        for value in values:
+            if value in self.bitmaps:
+                result |= bitmap_contains(self.bitmaps[value], rows)
+            elif value in self.postings:
+                rare.append(self.postings[value])
+        if rare:
+            # Rows of the rare values merged and sorted, then one binary search per row
+            postings = np.sort(np.concatenate(rare))
+            positions = np.minimum(np.searchsorted(postings, rows), len(postings) - 1)
+            result |= postings[positions] == rows
+        return result
+
+    def counts(self, rows):
+        """
+        Return a dictionary value -> number of the given rows holding it (values found in none are left out)
+        """
+        codes = self.codes[np.asarray(rows, dtype=np.int64)]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.values))
+        found = np.flatnonzero(counts)
+        return dict(zip([self.values[i] for i in found], counts[found].tolist()))
+
+def get_bitmap_index(dataset, table, column):
+    """
+    Return the bitmap index of a column of a dataset table, built on first use
+    """
+    return dataset.derived(("bitmap_index", table, column),
+                           lambda dataset: BitmapIndex(dataset.table(table, [column])[column]))
+
+def bitmap_contains(bitmap, rows):
+    """
+    Boolean array telling which of the rows are set in a packed bitmap
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    return ((bitmap[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+class RowSelection:
+    """
+    Rows kept by a sequence of filters. Over the whole table they are a packed bitmap
+    combined with the bitmap of each filter; when refining a previous result (candidates),
+    they are the surviving row numbers and each filter only tests those rows.
+    """
+
+    def __init__(self, n_rows, candidates=None):
+        self.n_rows = n_rows
+        if candidates is None:
+            self.bitmap = all_rows(n_rows)
+            self.candidates = None
+        else:
+            self.bitmap = None
+            self.candidates = np.asarray(candidates, dtype=np.int64)
+
+    def keep_mask(self, mask):
+        """
+        Keep the rows where a boolean array over the whole table is True
+        """
+        if self.candidates is None:
+            self.bitmap &= pack_mask(mask)
+        else:
+            self.candidates = self.candidates[np.asarray(mask, dtype=bool)[self.candidates]]
+
+    def keep_bitmap(self, bitmap):
+        """
+        Keep the rows set in a packed bitmap over the whole table
+        """
+        if self.candidates is None:
+            self.bitmap &= bitmap
+        else:
+            self.candidates = self.candidates[bitmap_contains(bitmap, self.candidates)]
+
+    def keep_values(self, index, values):
+        """
+        Keep the rows holding any of the values, according to a BitmapIndex
+        """
+        if self.candidates is None:
+            self.bitmap &= index.bitmap(values)
+        else:
+            self.candidates = self.candidates[index.contains(values, self.candidates)]
+
+    def keep_where(self, column, condition):
+        """
+        Keep the rows where condition(values) is True, evaluated on the values of a column
+        (a Series or array over the whole table) for the rows still selected only
+        """
+        values = np.asarray(column)
+        if self.candidates is None:
+            self.bitmap &= pack_mask(condition(values))
+        else:
+            self.candidates = self.candidates[np.asarray(condition(values[self.candidates]), dtype=bool)]
+
+    def keep_among(self, test):
+        """
+        Keep the rows for which test(rows) is True, test being called on the row numbers still selected
+        """
+        rows = self.rows()
+        kept = rows[np.asarray(test(rows), dtype=bool)]
+        if self.candidates is None:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[kept] = True
+            self.bitmap = pack_mask(mask)
+        else:
+            self.candidates = kept
+
+    def rows(self):
+        """
+        Row numbers kept, in increasing order
+        """
+        if self.candidates is None:
+            return bitmap_rows(self.bitmap, self.n_rows)
+        return self.candidates
@@ -0,0 +1,139 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from annotations import clean_text
+from features import split_features
+
+# UniProt columns whose evidence cites PubMed: comments ([CC] and "TOPIC: ..." columns)
+# and features ("KEYWORD position; /note=...; /evidence=..." columns)
+citation_columns = [
+    "PubMed ID",
+    # Comments
+    "Function [CC]", "Catalytic activity", "Cofactor", "Activity regulation", "Kinetics", "Pathway",
+    "Subunit structure", "Subcellular location [CC]", "Tissue specificity", "Developmental stage",
+    "Induction", "Domain [CC]", "Post-translational modification", "Involvement in disease",
+    "Disruption phenotype", "Polymorphism", "Miscellaneous [CC]", "Caution", "Sequence caution",
+    "RNA Editing", "Mass spectrometry", "Alternative products (isoforms)",
+    # Features
+    "Mutagenesis", "Natural variant", "Alternative sequence", "Sequence conflict", "Site", "Active site",
+    "Binding site", "Transmembrane", "Topological domain", "Intramembrane", "Region", "Motif",
+    "Compositional bias", "Chain", "Modified residue", "Glycosylation", "Disulfide bond", "Cross-link",
+    "Lipidation",
+]
+
+# One row per citation of a PubMed ID: UniProt row, column, ECO code of the evidence (missing
+# for the "PubMed ID" column and inline references) and the annotation citing it
+citation_schema = pa.schema([("pubmed", pa.int64()), ("row", pa.int64()), ("field", pa.string()),
+                             ("evidence", pa.string()), ("context", pa.string())])
+
+# Characters of annotation text kept as context
+CONTEXT_LENGTH = 200
+
+_cited = re.compile(r"(?:(ECO:\d+)\|)?PubMed:(\d+)")
+
+def shorten(text):
+    return text if len(text) <= CONTEXT_LENGTH else text[:CONTEXT_LENGTH - 1].rstrip() + "…"
+
+def annotation_items(text):
+    """
+    Split an annotation column into (context, citing text) items: the features of a feature
+    column ("MUTAGEN 474: E->A...") or the statements of a comment column (the text backed
+    by one evidence block)
+    """
+    if '/evidence="' in text:
+        items = []
+        for feature in split_features(text):
+            heading = feature.split(";", 1)[0].strip()
+            note = re.search(r'/note="([^"]*)"', feature)
+            items.append((f"{heading}: {note.group(1)}" if note else heading, feature))
+        return items
+
+    items = []
+    start = 0
+    for match in list(re.finditer(r"\{[^{}]*\}", text)) + [None]:
+        end = match.end() if match else len(text)
+        segment = text[start:end]
+        start = end
+        if "PubMed:" in segment:
+            # Without the "TOPIC: " prefix of the first statement
+            items.append((re.sub(r"^[A-Z][A-Z ]+:\s", "", clean_text(segment)), segment))
+    return items
+
+def citation_frame(df_uniprot, first_row=0):
+    """
+    Extract the PubMed citations of the columns of citation_columns found in df_uniprot,
+    as a DataFrame of citation_schema (one row per citation).
+
+    Parameters:
+    - df_uniprot: UniProt table (or chunk of it)
+    - first_row: row of the first entry of df_uniprot in the whole table
+    """
+    records = []
+    for column in citation_columns:
+        if column not in df_uniprot.columns:
+            continue
+        for row, value in enumerate(df_uniprot[column], start=first_row):
+            if pd.isna(value) or (column != "PubMed ID" and "PubMed" not in str(value)):
+                continue
+            if column == "PubMed ID":
+                # List of IDs separated by ";"
+                for pubmed in dict.fromkeys(re.findall(r"\d+", str(value))):
+                    records.append((int(pubmed), row, column, None, None))
+                continue
+            seen = set()
+            for context, text in annotation_items(str(value)):
+                for evidence, pubmed in _cited.findall(text):
+                    if (pubmed, evidence, context) not in seen:
+                        seen.add((pubmed, evidence, context))
+                        records.append((int(pubmed), row, column, evidence or None, shorten(context)))
+    return pd.DataFrame(records, columns=citation_schema.names)
+
+class PubMedIndex:
+    """
+    Reverse index from PubMed ID to the citations of the UniProt entries (see citation_frame),
+    with the number of distinct PubMed IDs cited by every entry
+    """
+
+    def __init__(self, citations, n_rows):
+        self.citations = citations.sort_values(["pubmed", "row"], kind="stable").reset_index(drop=True)
+        pubmeds = self.citations["pubmed"].to_numpy(dtype=np.int64)
+        # PubMed ID -> (start, stop) of its citations
+        ids, starts, counts = np.unique(pubmeds, return_index=True, return_counts=True)
+        self.slices = {pubmed: (start, start + count) for pubmed, start, count
+                       in zip(ids.tolist(), starts.tolist(), counts.tolist())}
+        rows = self.citations["row"].to_numpy(dtype=np.int64)
+        pairs = np.unique(np.stack([rows, pubmeds]), axis=1)
+        self.counts = np.bincount(pairs[0], minlength=n_rows)
+        # Citations sorted by row, for the citations of an entry
+        self.row_order = np.argsort(rows, kind="stable")
+        self.sorted_rows = rows[self.row_order]
+
+    def cited_by(self, pubmed):
+        """
+        Citations of a PubMed ID (row, field, evidence, context), as a DataFrame
+        """
+        start, stop = self.slices.get(int(pubmed), (0, 0))
+        return self.citations.iloc[start:stop]
+
+    def cited_in(self, row):
+        """
+        Citations made by a UniProt row, as a DataFrame
+        """
+        start, stop = np.searchsorted(self.sorted_rows, [row, row + 1])
+        return self.citations.iloc[self.row_order[start:stop]]
+
+    def rows(self, pubmed):
+        """
+        Sorted UniProt rows citing a PubMed ID
+        """
+        return np.unique(self.cited_by(pubmed)["row"].to_numpy(dtype=np.int64))
+
+def build_pubmed_index(dataset):
+    return PubMedIndex(dataset.table("citations"), len(dataset.table("uniprot", [])))
+
+def get_pubmed_index(dataset):
+    """
+    Return the PubMed reverse index of a dataset, read on first use
+    """
+    return dataset.derived("pubmed_index", build_pubmed_index)
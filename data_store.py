@@ -0,0 +1,357 @@
+import json
+import os
+import sys
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from drug_numeric import parse_numeric_columns, numeric_ranges_drugbank
+from presence_flags import presence_flag_columns, presence_columns
+from functools import partial
+from annotations import annotation_columns, annotation_schemas, annotation_frame
+from citations import citation_columns, citation_schema, citation_frame
+from features import feature_columns, feature_schema, feature_frame
+
+# Exports used by the app: table name -> (CSV export, columnar copy)
+tables = {
+    "uniprot": ("uniprot.csv", "uniprot.parquet"),
+    "drugbank": ("drugbank.csv", "drugbank.parquet"),
+    "chembl": ("chembl_ref.csv", "chembl_ref.parquet"),
+}
+
+# Tables parsed from the text columns of an export at ingest and stored next to it:
+# name -> (source table, columnar copy). See annotations, citations and features for their columns.
+parsed_tables = {name: ("uniprot", f"uniprot_{name}.parquet") for name in annotation_columns}
+parsed_tables["citations"] = ("uniprot", "uniprot_citations.parquet")
+parsed_tables["features"] = ("uniprot", "uniprot_features.parquet")
+
+# How the parsed tables are built: name -> (columns of the source table used, Arrow schema,
+# function(DataFrame, first_row) -> DataFrame). Columns missing from an export are skipped.
+parsers = {name: ([column], annotation_schemas[name], partial(annotation_frame, name))
+           for name, (column, _) in annotation_columns.items()}
+parsers["citations"] = (citation_columns, citation_schema, citation_frame)
+parsers["features"] = (feature_columns, feature_schema, feature_frame)
+
+# JSON documents used by the app: name -> path (optional, built by scrapping/chembling.py)
+documents = {
+    "gper_compounds": "gper_compounds.json",
+}
+
+# Columns parsed from the export and stored with it: table name -> function(DataFrame) -> new columns
+derived_columns = {
+    "uniprot": presence_flag_columns,
+    "drugbank": parse_numeric_columns,
+}
+
+# Export columns each derived column is computed from: table name -> {derived column: [columns]}
+derived_sources = {
+    "uniprot": {flag: [column] for flag, column in presence_columns.items()},
+    "drugbank": {column: [field] for field, columns in numeric_ranges_drugbank.items() for column in columns},
+}
+
+# Export columns kept in the Parquet copy of a table (all columns for tables not listed).
+# The list is stored in the Parquet metadata: a copy made with another list is not fresh.
+ingest_columns = {}
+
+# Numeric columns of the exports, every other column is read as text.
+# Explicit dtypes keep the same schema across chunks (a chunk where a text column
+# is empty would otherwise be read as float).
+column_dtypes = {
+    "uniprot": {
+        "Organism (ID)": "int64",
+        "Length": "int64",
+        "Mass": "int64",
+        "Sequence version": "int64",
+        "Entry version": "int64",
+        "Annotation": "float64",
+    },
+    "drugbank": {},
+    "chembl": {
+        "protein_classification": object,
+        "activity_count": "int64",
+        "min_activity_nM": "float64",
+        "max_activity_nM": "float64",
+        "median_activity_nM": "float64",
+        "known_drug_mechanisms": "int64",
+        "total_known_drugs": "int64",
+    },
+}
+
+# Text columns with at most this many distinct values per non-missing value are loaded
+# as categoricals (Organism, Reviewed, Protein existence, most cross-references...)
+CATEGORY_FRACTION = 0.5
+
+# Other text columns (Entry, Sequence, long comments, mostly empty cross-references) are
+# loaded as Arrow string arrays: characters stored contiguously, missing values cost one
+# offset and one validity bit, and NaN is kept for missing values as with object columns
+TEXT_DTYPE = pd.StringDtype("pyarrow_numpy")
+
+# Rows parsed at once by the streaming ingest, peak memory grows with it
+CHUNK_ROWS = 20000
+
+def export_format(path):
+    """
+    Separator of an export, from its extension: UniProt .tsv/.tab exports, otherwise CSV.
+    Compressed exports (.gz...) are decompressed on the fly by pandas.
+    """
+    stem = path
+    for extension in (".gz", ".bz2", ".xz", ".zip", ".zst"):
+        if stem.endswith(extension):
+            stem = stem[:-len(extension)]
+    return "\t" if stem.endswith((".tsv", ".tab")) else ","
+
+def export_dtypes(name, header):
+    """
+    dtype of every column of an export header (see column_dtypes)
+    """
+    numeric = column_dtypes.get(name, {})
+    return {column: numeric.get(column, object) for column in header}
+
+def read_export(name, path, columns=None, chunksize=None):
+    """
+    Parse an export with the explicit dtypes of the table.
+
+    Parameters:
+    - name: key of the table in tables
+    - path: CSV or TSV export, possibly compressed
+    - columns: list of columns to read (all columns if None)
+    - chunksize: number of rows per chunk, the whole export as one DataFrame if None
+    """
+    sep = export_format(path)
+    header = pd.read_csv(path, sep=sep, nrows=0).columns.tolist()
+    usecols = header if columns is None else [column for column in header if column in set(columns)]
+    return pd.read_csv(path, sep=sep, usecols=usecols, dtype=export_dtypes(name, usecols),
+                       chunksize=chunksize)
+
+def add_derived_columns(name, df):
+    """
+    Add the derived columns of the table to a parsed export (or to a chunk of it)
+    """
+    if name in derived_columns:
+        df = pd.concat([df, derived_columns[name](df)], axis=1)
+    return df
+
+def parse_table(name, csv_path):
+    """
+    Parse a CSV export and add the derived columns of the table
+    """
+    return add_derived_columns(name, read_export(name, csv_path))
+
+def arrow_schema(df):
+    """
+    Arrow schema of a chunk, with text for object columns even when a chunk holds no value
+    """
+    fields = []
+    for column, dtype in df.dtypes.items():
+        if dtype == object:
+            fields.append(pa.field(column, pa.string()))
+        else:
+            fields.append(pa.field(column, pa.from_numpy_dtype(dtype)))
+    return pa.schema(fields)
+
+def ingest_table(name, source=None, columns=None, chunksize=CHUNK_ROWS, report=None):
+    """
+    Convert the export of a table into its Parquet file, chunk by chunk: each chunk is parsed
+    with explicit dtypes, gets its derived columns and is written as a row group, so that
+    memory stays bounded by the chunk size whatever the size of the export.
+    The parsed tables of the export (see parsed_tables) are written along the way.
+
+    Parameters:
+    - name: key of the table in tables
+    - source: export to read (CSV or TSV, possibly gzip-compressed), the CSV of tables if None
+    - columns: list of export columns to keep (those of ingest_columns if None)
+    - chunksize: number of rows per chunk
+    - report: function(rows, seconds) called after each chunk with the totals so far
+
+    Returns (path of the Parquet file, number of rows, seconds).
+    """
+    csv_path, parquet_path = tables[name]
+    source = source or csv_path
+    if columns is None:
+        columns = ingest_columns.get(name)
+    # Write next to the final file and rename at the end, readers never see a partial table
+    partial_path = parquet_path + ".partial"
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    # Parsed table -> writer, for the parsed tables whose column is in the export
+    parsed_writers = {}
+    try:
+        for chunk in read_export(name, source, columns=columns, chunksize=chunksize):
+            chunk = add_derived_columns(name, chunk.reset_index(drop=True))
+            if writer is None:
+                schema = arrow_schema(chunk).with_metadata({"columns": json.dumps(columns)})
+                writer = pq.ParquetWriter(partial_path, schema)
+                for parsed, (table, path) in parsed_tables.items():
+                    if table == name and set(parsers[parsed][0]) & set(chunk.columns):
+                        parsed_writers[parsed] = pq.ParquetWriter(path + ".partial", parsers[parsed][1])
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            for parsed, parsed_writer in parsed_writers.items():
+                _, schema_parsed, parse = parsers[parsed]
+                parsed_writer.write_table(pa.Table.from_pandas(parse(chunk, first_row=rows), schema=schema_parsed,
+                                                               preserve_index=False))
+            rows += len(chunk)
+            if report is not None:
+                report(rows, time.perf_counter() - start)
+    finally:
+        for parsed_writer in [writer] + list(parsed_writers.values()):
+            if parsed_writer is not None:
+                parsed_writer.close()
+    if writer is None:
+        raise ValueError(f"{source} has no rows")
+    os.replace(partial_path, parquet_path)
+    # After the table, so that the parsed tables are not older than it
+    for parsed in parsed_writers:
+        path = parsed_tables[parsed][1]
+        os.replace(path + ".partial", path)
+    return parquet_path, rows, time.perf_counter() - start
+
+def ingest_all():
+    """
+    Convert every CSV export listed in tables
+    """
+    return [ingest_table(name) for name in tables]
+
+def parquet_is_fresh(name):
+    """
+    True if the Parquet copy of a table exists, is not older than its CSV export and holds the
+    columns of ingest_columns (for a parsed table: not older than the export and the Parquet copy
+    of its source table)
+    """
+    if name in parsed_tables:
+        source, parquet_path = parsed_tables[name]
+        return os.path.exists(parquet_path) and all(
+            not os.path.exists(path) or os.path.getmtime(path) <= os.path.getmtime(parquet_path)
+            for path in tables[source])
+    csv_path, parquet_path = tables[name]
+    if not os.path.exists(parquet_path):
+        return False
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(parquet_path):
+        return False
+    # Copies written before the list was stored hold every column
+    metadata = pq.read_schema(parquet_path).metadata or {}
+    return json.loads(metadata.get(b"columns", b"null")) == ingest_columns.get(name)
+
+def source_stamp():
+    """
+    (path, modification time, size) of every export and columnar copy of tables and of the
+    documents, changes whenever one of the files is rewritten
+    """
+    stamp = []
+    for paths in list(tables.values()) + list(parsed_tables.values()) + [tuple(documents.values())]:
+        for path in paths:
+            if os.path.exists(path):
+                status = os.stat(path)
+                stamp.append((path, status.st_mtime_ns, status.st_size))
+    return tuple(stamp)
+
+def compact_frame(table):
+    """
+    Convert an Arrow table into a DataFrame with compact text columns: low-cardinality columns
+    as categoricals (dictionary-encoded in Arrow), the others as Arrow string arrays
+    """
+    for i, column in enumerate(table.columns):
+        if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+            continue
+        present = len(column) - column.null_count
+        if present and pc.count_distinct(column).as_py() <= CATEGORY_FRACTION * present:
+            table = table.set_column(i, table.field(i).name, column.dictionary_encode())
+    return table.to_pandas(types_mapper=lambda dtype: TEXT_DTYPE if dtype in (pa.string(), pa.large_string()) else None)
+
+def read_table(name, columns=None):
+    """
+    Load a table as a DataFrame, reading only the requested columns.
+
+    Parameters:
+    - name: key of the table in tables ("uniprot", "drugbank", "chembl") or in parsed_tables
+    - columns: list of columns to read (all columns if None)
+
+    The Parquet copy is memory-mapped when it is up to date, otherwise the CSV export is parsed.
+    Text columns are loaded in compact form (see compact_frame).
+    """
+    if name in parsed_tables:
+        return read_parsed_table(name, columns)
+    csv_path, parquet_path = tables[name]
+    if columns is not None:
+        # Keep the caller's order and drop duplicates
+        columns = list(dict.fromkeys(columns))
+
+    if parquet_is_fresh(name) and (columns is None or set(columns) <= set(pq.read_schema(parquet_path).names)):
+        return compact_frame(pq.read_table(parquet_path, columns=columns, memory_map=True))
+
+    if columns == []:
+        # pandas returns no rows without columns, keep the row index of the export
+        return pd.read_csv(csv_path, usecols=[0]).iloc[:, :0]
+    if columns is None:
+        df = parse_table(name, csv_path)
+    else:
+        # Derived columns are computed from the export columns they need only
+        header = set(pd.read_csv(csv_path, sep=export_format(csv_path), nrows=0).columns)
+        derived = [column for column in columns if column not in header]
+        sources = [source for column in derived for source in derived_sources.get(name, {}).get(column, [])]
+        df = read_export(name, csv_path, columns=[column for column in columns if column in header] + sources)
+        if derived:
+            df = add_derived_columns(name, df)
+        df = df[columns]
+    return compact_frame(pa.Table.from_pandas(df, schema=arrow_schema(df), preserve_index=False))
+
+def table_columns(name):
+    """
+    Columns of a table (of its Parquet copy when it is up to date, otherwise of its export)
+    """
+    csv_path, parquet_path = tables[name]
+    if parquet_is_fresh(name):
+        return pq.read_schema(parquet_path).names
+    return pd.read_csv(csv_path, sep=export_format(csv_path), nrows=0).columns.tolist()
+
+def read_parsed_table(name, columns=None):
+    """
+    Load a parsed table, from its Parquet copy when it is up to date, otherwise by parsing
+    the column of its source table
+    """
+    source, parquet_path = parsed_tables[name]
+    if parquet_is_fresh(name):
+        table = pq.read_table(parquet_path, columns=columns, memory_map=True)
+    else:
+        source_columns, schema, parse = parsers[name]
+        df = read_table(source, [column for column in source_columns if column in table_columns(source)])
+        table = pa.Table.from_pandas(parse(df), schema=schema, preserve_index=False)
+        if columns is not None:
+            table = table.select(list(dict.fromkeys(columns)))
+    return compact_frame(table)
+
+def read_document(name):
+    """
+    Parse a JSON document of documents, None if the file does not exist
+    """
+    path = documents[name]
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    # python data_store.py [table=export ...], e.g. uniprot=uniprotkb_gpcr.tsv.gz
+    sources = dict(argument.split("=", 1) for argument in sys.argv[1:])
+    for name in sources or tables:
+        def report(rows, seconds):
+            print(f"\r{name}: {rows} rows, {rows / max(seconds, 1e-9):,.0f} rows/s", end="", flush=True)
+        path, rows, seconds = ingest_table(name, source=sources.get(name), report=report)
+        print(f"\rWrote {path}: {rows} rows in {seconds:.1f} s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+    # Full-text indexes and hydropathy profiles of the new files, read by the app
+    from dataset import get_dataset
+    from text_index import text_index_paths, save_text_index
+    for name in text_index_paths:
+        if name in (sources or tables):
+            print(f"Wrote {save_text_index(get_dataset(), name)}")
+    if "uniprot" in (sources or tables):
+        from hydropathy import save_hydropathy_profiles
+        print(f"Wrote {save_hydropathy_profiles(get_dataset())}")
+        # Neighbour matrix of the new sequences, read by the app (updated for the changed sequences only)
+        from neighbours import NEIGHBOURS_PATH, PROCESSES, build_neighbour_matrix
+        build_neighbour_matrix(get_dataset(), processes=PROCESSES)
+        print(f"Wrote {NEIGHBOURS_PATH}")
+    # SQLite store of the new files (read by the SQLite filter backend)
+    from sql_store import build_store
+    print(f"Wrote {build_store()}")
@@ -0,0 +1,182 @@
+import itertools
+import threading
+import pandas as pd
+from data_store import read_table, source_stamp, table_columns
+
+_instance_ids = itertools.count()
+
+class Dataset:
+    """
+    Process-wide handle on the UniProt and DrugBank tables.
+    Columns are read on first use and kept for every later caller (all Streamlit sessions
+    of the process share the same handle). Structures derived from the tables (indexes,
+    parsed columns...) are memoized with derived() and dropped by reload().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tables = {}
+        self._complete = set()
+        self._derived = {}
+        # One lock per derived key, held while it is built, and per table, held while its files are read
+        self._build_locks = {}
+        self._read_locks = {}
+        self.version = 0
+        # Unique per handle, so caches shared by several datasets never mix their results
+        self.uid = next(_instance_ids)
+        # Files the tables are read from, None for tables given in memory
+        self.sources = source_stamp()
+
+    @classmethod
+    def from_frames(cls, **frames):
+        """
+        Dataset over DataFrames already in memory (benchmarks, scripts), keyed by table name
+        """
+        dataset = cls()
+        for name, df in frames.items():
+            dataset._tables[name] = df
+            dataset._complete.add(name)
+        dataset.sources = None
+        return dataset
+
+    def table(self, name, columns=None):
+        """
+        Return the DataFrame of a table with at least the requested columns loaded.
+        Files are read holding the lock of the table only: callers of other tables, of
+        derived() and of columns already loaded are not blocked.
+
+        Parameters:
+        - name: table name ("uniprot" or "drugbank")
+        - columns: columns needed by the caller (all columns if None)
+        """
+        with self._lock:
+            df = self._loaded(name, columns)
+            if df is not None:
+                return df
+            read_lock = self._read_locks.setdefault(name, threading.RLock())
+        with read_lock:
+            with self._lock:
+                df = self._loaded(name, columns)
+                if df is not None:
+                    return df
+                df = self._tables.get(name)
+                version = self.version
+            if columns is None:
+                df = read_table(name)
+            elif df is None:
+                df = read_table(name, columns=columns)
+            else:
+                missing = [column for column in dict.fromkeys(columns) if column not in df.columns]
+                # Build a new frame instead of inserting, so readers holding the old one are not affected
+                df = pd.concat([df, read_table(name, columns=missing)], axis=1, copy=False)
+            with self._lock:
+                # Not published if reload() ran during the read
+                if self.version == version:
+                    self._tables[name] = df
+                    if columns is None:
+                        self._complete.add(name)
+            return df
+
+    def columns(self, name):
+        """
+        Columns a table can provide without reading another source: those of the DataFrame for
+        tables given in memory, those of the data files otherwise (see data_store.table_columns)
+        """
+        with self._lock:
+            if self.sources is None or name in self._complete:
+                return self._tables[name].columns.tolist()
+        return table_columns(name)
+
+    def _loaded(self, name, columns):
+        """
+        Loaded DataFrame of a table if it holds the columns (all of them if None), None otherwise
+        """
+        if columns is None:
+            return self._tables[name] if name in self._complete else None
+        df = self._tables.get(name)
+        if df is None or any(column not in df.columns for column in columns):
+            return None
+        return df
+
+    def derived(self, key, builder):
+        """
+        Return the structure stored under key, building it with builder(dataset) on first use.
+        The build holds the lock of its key only: callers of other keys and of table() are not
+        blocked, callers of the same key wait for it instead of building it again.
+        """
+        with self._lock:
+            if key in self._derived:
+                return self._derived[key]
+            build_lock = self._build_locks.setdefault(key, threading.RLock())
+        with build_lock:
+            with self._lock:
+                if key in self._derived:
+                    return self._derived[key]
+                version = self.version
+            value = builder(self)
+            with self._lock:
+                # Not published if reload() ran during the build (built from the old files)
+                if self.version == version:
+                    value = self._derived.setdefault(key, value)
+            return value
+
+    def reload(self):
+        """
+        Forget loaded columns and derived structures, the next calls read the files again
+        """
+        with self._lock:
+            self._tables = {}
+            self._complete = set()
+            self._derived = {}
+            self.version += 1
+
+    def refresh(self):
+        """
+        Reload the dataset if its files changed on disk since they were read, and return its version
+        """
+        if self.sources is not None:
+            stamp = source_stamp()
+            if stamp != self.sources:
+                with self._lock:
+                    if stamp != self.sources:
+                        self.reload()
+                        self.sources = stamp
+        return self.version
+
+    def memory_report(self):
+        """
+        Return a DataFrame with the bytes held by each loaded column (table, column, dtype, bytes),
+        largest first
+        """
+        with self._lock:
+            tables = dict(self._tables)
+        rows = []
+        for name, df in tables.items():
+            usage = df.memory_usage(deep=True, index=False)
+            for column in df.columns:
+                rows.append({"table": name, "column": column, "dtype": str(df[column].dtype),
+                             "bytes": int(usage[column])})
+        report = pd.DataFrame(rows, columns=["table", "column", "dtype", "bytes"])
+        return report.sort_values("bytes", ascending=False, ignore_index=True)
+
+_dataset = None
+_dataset_lock = threading.Lock()
+
+def get_dataset():
+    """
+    Return the shared Dataset of the process, creating it on first call
+    """
+    global _dataset
+    if _dataset is None:
+        with _dataset_lock:
+            if _dataset is None:
+                _dataset = Dataset()
+    return _dataset
+
+def memory_report(dataset=None):
+    """
+    Bytes held by each loaded column of a dataset (the shared one by default), see Dataset.memory_report
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return dataset.memory_report()
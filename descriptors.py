@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from sequence_matrix import ALPHABET, PAD, get_sequence_matrix
+
+# The 20 standard residues, first codes of sequence_matrix.ALPHABET
+AMINO_ACIDS = ALPHABET[:20]
+
+# Descriptors offered as range filters: name -> label
+descriptor_fields = {
+    "pI": "Isoelectric point",
+    "GRAVY": "GRAVY (hydropathy)",
+    "Net charge": "Net charge at pH 7",
+    "Aromaticity": "Aromaticity (F+W+Y fraction)",
+}
+
+# Kyte-Doolittle hydropathy of the standard residues
+KYTE_DOOLITTLE = {
+    "A": 1.8, "R": -4.5, "N": -3.5, "D": -3.5, "C": 2.5, "Q": -3.5, "E": -3.5, "G": -0.4, "H": -3.2, "I": 4.5,
+    "L": 3.8, "K": -3.9, "M": 1.9, "F": 2.8, "P": -1.6, "S": -0.8, "T": -0.7, "W": -0.9, "Y": -1.3, "V": 4.2,
+}
+
+# pKa of the charged groups (EMBOSS values), positive and negative side chains
+PKA_N_TERMINUS = 8.6
+PKA_C_TERMINUS = 3.6
+PKA_POSITIVE = {"K": 10.8, "R": 12.5, "H": 6.5}
+PKA_NEGATIVE = {"D": 3.9, "E": 4.1, "C": 8.5, "Y": 10.1}
+
+PHYSIOLOGICAL_PH = 7.0
+
+# Rows counted per bincount call (bounds the temporary arrays for wide matrices)
+CHUNK_ROWS = 4096
+
+def residue_counts(codes):
+    """
+    Number of each residue code in every row of a padded code matrix, as an
+    (rows x len(ALPHABET)) array, with one bincount per chunk of rows
+    """
+    n_codes = PAD + 1
+    counts = np.zeros((len(codes), len(ALPHABET)), dtype=np.int32)
+    for start in range(0, len(codes), CHUNK_ROWS):
+        block = codes[start:start + CHUNK_ROWS].astype(np.int64)
+        # Shift the codes of each row to its own range of bins
+        block += (np.arange(len(block), dtype=np.int64) * n_codes)[:, None]
+        counts[start:start + len(block)] = np.bincount(block.ravel(), minlength=len(block) * n_codes) \
+            .reshape(len(block), n_codes)[:, :len(ALPHABET)]
+    return counts
+
+def net_charge(counts, ph):
+    """
+    Net charge of every row at ph (a number or an array over the rows), from the counts of the
+    standard residues (Henderson-Hasselbalch, one term per charged group). Rows without residues get 0.
+    """
+    ph = np.asarray(ph, dtype=float)
+    has_residues = counts.sum(axis=1) > 0
+    charge = has_residues / (1 + 10 ** (ph - PKA_N_TERMINUS)) - has_residues / (1 + 10 ** (PKA_C_TERMINUS - ph))
+    for residue, pka in PKA_POSITIVE.items():
+        charge = charge + counts[:, AMINO_ACIDS.index(residue)] / (1 + 10 ** (ph - pka))
+    for residue, pka in PKA_NEGATIVE.items():
+        charge = charge - counts[:, AMINO_ACIDS.index(residue)] / (1 + 10 ** (pka - ph))
+    return charge
+
+def isoelectric_point(counts, tolerance=0.001):
+    """
+    pH where the net charge of every row is 0, by a bisection run on all the rows at once
+    """
+    low = np.zeros(len(counts))
+    high = np.full(len(counts), 14.0)
+    while len(counts) and (high - low).max() > tolerance:
+        middle = (low + high) / 2
+        positive = net_charge(counts, middle) > 0
+        # The charge decreases with the pH: the pI is above middle while the charge is positive
+        low = np.where(positive, middle, low)
+        high = np.where(positive, high, middle)
+    return (low + high) / 2
+
+class Descriptors:
+    """
+    Physicochemical descriptors of every UniProt entry, computed from the residue counts
+    of the encoded sequence matrix: composition (% of each standard residue) and the values
+    of descriptor_fields. Entries without a sequence get NaN.
+    """
+
+    def __init__(self, counts):
+        standard = counts[:, :len(AMINO_ACIDS)].astype(np.float64)
+        n_residues = standard.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.composition = (100 * standard / n_residues[:, None]).astype(np.float32)
+            hydropathy = np.array([KYTE_DOOLITTLE[residue] for residue in AMINO_ACIDS])
+            aromatic = [AMINO_ACIDS.index(residue) for residue in "FWY"]
+            self.values = {
+                "pI": isoelectric_point(standard),
+                "GRAVY": standard @ hydropathy / n_residues,
+                "Net charge": net_charge(standard, PHYSIOLOGICAL_PH),
+                "Aromaticity": standard[:, aromatic].sum(axis=1) / n_residues,
+            }
+        missing = n_residues == 0
+        for values in self.values.values():
+            values[missing] = np.nan
+
+    @classmethod
+    def from_sequence_matrix(cls, sequence_matrix):
+        return cls(residue_counts(sequence_matrix.codes))
+
+    def bounds(self, field):
+        """
+        (smallest, largest) value of a descriptor, None if no entry has a sequence
+        """
+        values = self.values[field]
+        if np.isnan(values).all():
+            return None
+        return float(np.nanmin(values)), float(np.nanmax(values))
+
+    def rows(self, field, min_val, max_val):
+        """
+        Boolean array over the rows, True where min_val <= value <= max_val
+        """
+        values = self.values[field]
+        return (values >= min_val) & (values <= max_val)
+
+    def for_row(self, row):
+        """
+        Descriptors of an entry (dictionary name -> value) and its composition (Series residue -> %)
+        """
+        return ({field: float(values[row]) for field, values in self.values.items()},
+                pd.Series(self.composition[row], index=list(AMINO_ACIDS)))
+
+def build_descriptors(dataset):
+    return Descriptors.from_sequence_matrix(get_sequence_matrix(dataset))
+
+def get_descriptors(dataset):
+    """
+    Return the physicochemical descriptors of a dataset, computed on first use
+    """
+    return dataset.derived("descriptors", build_descriptors)
@@ -0,0 +1,65 @@
+import pandas as pd
+
+def parse_drugbank_ids(text):
+    """
+    Parse a text containing DrugBank IDs formatted as "DBXXXXX; Name." and return a list of DrugBank IDs.
+    """
+    if pd.isna(text) or not text:
+        return []
+
+    # Split by quotes and semicolons
+    parts = text.split('"')
+    ids = []
+
+    for part in parts:
+        part = part.strip()
+        if part.startswith('DB'):
+            # Extract the part before the semicolon
+            db_id = part.split(';')[0].strip()
+            ids.append(db_id)
+
+    return ids
+
+class DrugLinks:
+    """
+    Association table between UniProt rows and DrugBank rows, built by exploding the
+    DrugBank cross-references of uniprot.csv and joining them on the DrugBank ID,
+    with dictionaries for the lookups in both directions
+    """
+
+    def __init__(self, df_uniprot, df_drugbank):
+        xrefs = df_uniprot["DrugBank"].map(parse_drugbank_ids)
+        # Rows whose DrugBank cross-reference is filled (even if no ID matches drugbank.csv)
+        self.uniprot_rows = df_uniprot.index[df_uniprot["DrugBank"].notna() & (df_uniprot["DrugBank"] != "")].tolist()
+
+        exploded = xrefs.explode().dropna()
+        pairs = pd.DataFrame({"uniprot_row": exploded.index, "DrugBank ID": exploded.values}).drop_duplicates()
+        drugs = pd.DataFrame({"drugbank_row": df_drugbank.index, "DrugBank ID": df_drugbank["DrugBank ID"].values})
+        # Hash join on the DrugBank ID
+        self.associations = pairs.merge(drugs, on="DrugBank ID", how="inner")[["uniprot_row", "drugbank_row", "DrugBank ID"]]
+
+        self.drugs_by_protein = {row: sorted(group.tolist()) for row, group
+                                 in self.associations.groupby("uniprot_row")["drugbank_row"]}
+        self.proteins_by_drug = {row: sorted(group.tolist()) for row, group
+                                 in self.associations.groupby("drugbank_row")["uniprot_row"]}
+
+    def drugs_for_protein(self, uniprot_row):
+        """
+        DrugBank rows linked to a UniProt row
+        """
+        return self.drugs_by_protein.get(uniprot_row, [])
+
+    def proteins_for_drug(self, drugbank_row):
+        """
+        UniProt rows linked to a DrugBank row
+        """
+        return self.proteins_by_drug.get(drugbank_row, [])
+
+def build_drug_links(dataset):
+    return DrugLinks(dataset.table("uniprot", ["DrugBank"]), dataset.table("drugbank", ["DrugBank ID"]))
+
+def get_drug_links(dataset):
+    """
+    Return the UniProt/DrugBank association table of a dataset, built on first use
+    """
+    return dataset.derived("drug_links", build_drug_links)
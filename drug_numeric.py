@@ -0,0 +1,120 @@
+import re
+import numpy as np
+import pandas as pd
+
+# DrugBank text field -> (column of the lowest value, column of the highest value) parsed from it
+numeric_ranges_drugbank = {
+    "Absorption": ("Absorption min (%)", "Absorption max (%)"),
+    "Protein Binding": ("Protein Binding min (%)", "Protein Binding max (%)"),
+    "Half Life": ("Half Life min (h)", "Half Life max (h)"),
+    "Molecular Weight": ("Molecular Weight (Da)", "Molecular Weight (Da)"),
+}
+
+_number = r"(\d+(?:\.\d+)?)"
+# "80-90%", "80 to 90 %" or "26%"
+_percentage = re.compile(_number + r"(?:\s*(?:-|–|to)\s*" + _number + r")?\s*%")
+# "3-4 hours", "30 minutes", "2.5 days"...
+_duration = re.compile(_number + r"(?:\s*(?:-|–|to)\s*" + _number + r")?\s*"
+                       r"(weeks?|days?|hours?|hrs?|h|minutes?|mins?|seconds?|secs?)\b", re.IGNORECASE)
+_hours_per_unit = {"w": 168.0, "d": 24.0, "h": 1.0, "m": 1 / 60, "s": 1 / 3600}
+
+def parse_percentages(text):
+    """
+    (min, max) of the percentages found in a text, (nan, nan) if there are none.
+    Values above 100% (relative ratios) are ignored.
+    """
+    if pd.isna(text):
+        return np.nan, np.nan
+    values = []
+    for low, high in _percentage.findall(str(text)):
+        values.extend(float(v) for v in (low, high) if v)
+    values = [v for v in values if v <= 100]
+    if not values:
+        return np.nan, np.nan
+    return min(values), max(values)
+
+def parse_half_life(text):
+    """
+    (min, max) of the durations found in a half-life text, in hours
+    """
+    if pd.isna(text):
+        return np.nan, np.nan
+    values = []
+    for low, high, unit in _duration.findall(str(text)):
+        factor = _hours_per_unit[unit[0].lower()]
+        values.extend(float(v) * factor for v in (low, high) if v)
+    if not values:
+        return np.nan, np.nan
+    return min(values), max(values)
+
+def parse_weight(text):
+    """
+    Molecular weight as a float ("29855.195 Da" -> 29855.195)
+    """
+    if pd.isna(text):
+        return np.nan
+    match = re.search(_number, str(text).replace(",", ""))
+    return float(match.group(1)) if match else np.nan
+
+def parse_numeric_columns(df_drugbank):
+    """
+    Numeric columns of numeric_ranges_drugbank, parsed from the text fields of drugbank.csv
+    (only for the text fields present, e.g. when the export is read with a column projection)
+    """
+    columns = {}
+    for field, parser in [("Absorption", parse_percentages),
+                          ("Protein Binding", parse_percentages),
+                          ("Half Life", parse_half_life)]:
+        if field not in df_drugbank.columns:
+            continue
+        low_column, high_column = numeric_ranges_drugbank[field]
+        parsed = [parser(value) for value in df_drugbank[field]]
+        columns[low_column] = [low for low, _ in parsed]
+        columns[high_column] = [high for _, high in parsed]
+    if "Molecular Weight" in df_drugbank.columns:
+        columns["Molecular Weight (Da)"] = [parse_weight(value) for value in df_drugbank["Molecular Weight"]]
+    return pd.DataFrame(columns, index=df_drugbank.index, dtype=float)
+
+class RangeIndex:
+    """
+    Rows sorted by their lowest and highest value, so that the rows whose [low, high]
+    interval overlaps a query range are found with two binary searches
+    """
+
+    def __init__(self, low, high):
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        self.n_rows = len(low)
+        valid = np.flatnonzero(~np.isnan(low) & ~np.isnan(high))
+        self.rows_by_low = valid[np.argsort(low[valid], kind="stable")]
+        self.sorted_low = low[self.rows_by_low]
+        self.rows_by_high = valid[np.argsort(high[valid], kind="stable")]
+        self.sorted_high = high[self.rows_by_high]
+
+    def bounds(self):
+        """
+        (smallest low, largest high), None if no row has a value
+        """
+        if len(self.sorted_low) == 0:
+            return None
+        return float(self.sorted_low[0]), float(self.sorted_high[-1])
+
+    def overlapping(self, min_val, max_val):
+        """
+        Boolean array over the rows, True where low <= max_val and high >= min_val
+        """
+        starts_before = np.zeros(self.n_rows, dtype=bool)
+        starts_before[self.rows_by_low[:np.searchsorted(self.sorted_low, max_val, side="right")]] = True
+        ends_after = np.zeros(self.n_rows, dtype=bool)
+        ends_after[self.rows_by_high[np.searchsorted(self.sorted_high, min_val, side="left"):]] = True
+        return starts_before & ends_after
+
+def get_range_index(dataset, field):
+    """
+    Return the range index of a DrugBank field of numeric_ranges_drugbank, built on first use
+    """
+    def build(dataset):
+        low_column, high_column = numeric_ranges_drugbank[field]
+        df_drugbank = dataset.table("drugbank", [low_column, high_column])
+        return RangeIndex(df_drugbank[low_column], df_drugbank[high_column])
+    return dataset.derived(("range_index", field), build)
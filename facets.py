@@ -0,0 +1,23 @@
+def facet_counts(dic, facets, filter_rows):
+    """
+    Count, for every value of every facet, the rows that the filters of dic would keep
+    with that value selected.
+
+    Parameters:
+    - dic: current filters (same format as filter_results_uniprot)
+    - facets: facet field -> index with a counts(rows) method (BitmapIndex, GeneIndex)
+    - filter_rows: function(filters) -> array of the rows kept by the filters
+
+    The filter of a facet is left out when counting its own values, so that selecting a
+    value does not hide the other values of the same field (they are OR'd).
+    Returns a dictionary field -> {value: count}, values without any row are left out.
+    """
+    counts = {}
+    rows_without = {}
+    for field, index in facets.items():
+        # Facets whose filter is not set share the rows kept by all the filters
+        key = field if dic.get(field) else None
+        if key not in rows_without:
+            rows_without[key] = filter_rows({name: value for name, value in dic.items() if name != key})
+        counts[field] = index.counts(rows_without[key])
+    return counts
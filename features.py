@@ -0,0 +1,176 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# UniProt feature columns ("KEYWORD start..end; /note=...; /evidence=..." items)
+feature_columns = [
+    "Chain", "Signal peptide", "Propeptide", "Transit peptide", "Peptide", "Initiator methionine",
+    "Topological domain", "Transmembrane", "Intramembrane", "Domain [FT]", "Repeat", "Region", "Motif",
+    "Compositional bias", "Coiled coil", "Zinc finger", "DNA binding", "Active site", "Binding site", "Site",
+    "Modified residue", "Lipidation", "Glycosylation", "Disulfide bond", "Cross-link",
+    "Helix", "Beta strand", "Turn", "Natural variant", "Mutagenesis", "Alternative sequence",
+    "Sequence conflict", "Sequence uncertainty", "Non-standard residue", "Non-terminal residue",
+]
+
+# One row per feature: UniProt row, feature keyword (TRANSMEM, CARBOHYD...), 1-based inclusive
+# positions, note, ECO codes and PubMed IDs of the evidence
+feature_schema = pa.schema([("row", pa.int64()), ("type", pa.string()), ("start", pa.int64()),
+                            ("end", pa.int64()), ("note", pa.string()),
+                            ("evidence", pa.list_(pa.string())), ("pubmed", pa.list_(pa.string()))])
+
+# Features whose start and end are two linked residues rather than a segment
+bond_types = {"DISULFID", "CROSSLNK"}
+
+_feature_separator = re.compile(r";\s+(?=[A-Z][A-Z_]+ [<>?]?\d)")
+_location = re.compile(r"([A-Z][A-Z_]+) [<>]?(\d+)(?:\.\.[<>]?(\d+))?;")
+
+def split_features(text):
+    """
+    Split a feature column into its "KEYWORD position; /qualifier=..." items
+    """
+    return _feature_separator.split(text)
+
+def parse_features(value):
+    """
+    One dictionary per feature of a feature column with a known location: type, start, end,
+    note, ECO codes and PubMed IDs. Uncertain bounds ("<1", ">350") are kept as the given
+    position, unknown ones ("?") drop the feature.
+    """
+    if pd.isna(value):
+        return []
+    features = []
+    for item in split_features(str(value).strip()):
+        location = _location.match(item + ";")
+        if not location:
+            continue
+        start = int(location.group(2))
+        note = re.search(r'/note="([^"]*)"', item)
+        evidence = re.search(r'/evidence="([^"]*)"', item)
+        evidence = evidence.group(1) if evidence else ""
+        features.append({"type": location.group(1), "start": start, "end": int(location.group(3) or start),
+                         "note": note.group(1) if note else None,
+                         "evidence": list(dict.fromkeys(re.findall(r"ECO:\d+", evidence))),
+                         "pubmed": list(dict.fromkeys(re.findall(r"PubMed:(\d+)", evidence)))})
+    return features
+
+def feature_frame(df_uniprot, first_row=0):
+    """
+    Parse the feature columns found in df_uniprot into one interval table (see feature_schema).
+
+    Parameters:
+    - df_uniprot: UniProt table (or chunk of it)
+    - first_row: row of the first entry of df_uniprot in the whole table
+    """
+    records = []
+    for column in feature_columns:
+        if column not in df_uniprot.columns:
+            continue
+        for row, value in enumerate(df_uniprot[column], start=first_row):
+            for feature in parse_features(value):
+                feature["row"] = row
+                records.append(feature)
+    return pd.DataFrame(records, columns=feature_schema.names)
+
+class FeatureIndex:
+    """
+    Interval index of the sequence features: features sorted by (row, start), the features of
+    an entry being a slice found by binary search. Within an entry, the features overlapping
+    a range are those starting before its end (a prefix of the slice) and ending after its start.
+    """
+
+    def __init__(self, features):
+        self.features = features.sort_values(["row", "start", "end"], kind="stable").reset_index(drop=True)
+        self.rows = self.features["row"].to_numpy(dtype=np.int64)
+        self.starts = self.features["start"].to_numpy(dtype=np.int64)
+        self.ends = self.features["end"].to_numpy(dtype=np.int64)
+        self.types = self.features["type"].to_numpy(dtype=object)
+        self.notes = pd.Series(self.features["note"].astype(object).where(self.features["note"].notna(), ""),
+                               dtype=object).str.lower()
+
+    def _slice(self, row):
+        return np.searchsorted(self.rows, [row, row + 1])
+
+    def for_row(self, row):
+        """
+        Features of an entry, as a DataFrame
+        """
+        start, stop = self._slice(row)
+        return self.features.iloc[start:stop]
+
+    def overlapping(self, row, start, end, types=None):
+        """
+        Features of an entry overlapping residues start..end (1-based, inclusive), as a DataFrame
+        """
+        first, stop = self._slice(row)
+        # Features of the entry starting at most at end
+        stop = first + np.searchsorted(self.starts[first:stop], end, side="right")
+        positions = first + np.flatnonzero(self.ends[first:stop] >= start)
+        if types:
+            positions = positions[np.isin(self.types[positions], list(types))]
+        return self.features.iloc[positions]
+
+    def _mask(self, types=None, note=None):
+        mask = np.ones(len(self.features), dtype=bool)
+        if types:
+            mask &= np.isin(self.types, list(types))
+        if note:
+            mask &= self.notes.str.contains(note.lower(), regex=False).to_numpy(dtype=bool)
+        return mask
+
+    def rows_with(self, n_rows, types=None, start=None, end=None, note=None, within=None, within_note=None):
+        """
+        Return a boolean array over the n_rows rows, True where the entry has a feature
+
+        Parameters:
+        - types: feature keywords accepted (all if None)
+        - start, end: residues the feature must overlap (whole sequence if None)
+        - note: text the note of the feature must contain
+        - within: keywords of a feature that must contain it (e.g. TOPO_DOM), None for any position
+        - within_note: text the note of that feature must contain (e.g. "Extracellular")
+        """
+        mask = self._mask(types, note)
+        if start is not None:
+            mask &= self.ends >= start
+        if end is not None:
+            mask &= self.starts <= end
+        if within:
+            # Join each candidate with the containing features of the same entry
+            inner = pd.DataFrame({"row": self.rows[mask], "start": self.starts[mask], "end": self.ends[mask]})
+            outer_mask = self._mask(within, within_note)
+            outer = pd.DataFrame({"row": self.rows[outer_mask], "outer_start": self.starts[outer_mask],
+                                  "outer_end": self.ends[outer_mask]})
+            pairs = inner.merge(outer, on="row")
+            pairs = pairs[(pairs["outer_start"] <= pairs["start"]) & (pairs["end"] <= pairs["outer_end"])]
+            found = pairs["row"].to_numpy(dtype=np.int64)
+        else:
+            found = self.rows[mask]
+        result = np.zeros(n_rows, dtype=bool)
+        result[found] = True
+        return result
+
+    def track(self, row, length):
+        """
+        Per-residue track of an entry: DataFrame with one row per residue (1 to length) and one
+        0/1 column per feature type of the entry
+        """
+        features = self.for_row(row)
+        track = pd.DataFrame(index=pd.RangeIndex(1, length + 1, name="Residue"))
+        for feature_type, start, end in zip(features["type"], features["start"], features["end"]):
+            if feature_type not in track.columns:
+                track[feature_type] = 0
+            if feature_type in bond_types:
+                # The two bonded residues only
+                track.loc[[position for position in (start, end) if 1 <= position <= length], feature_type] = 1
+            else:
+                track.loc[max(start, 1):min(end, length), feature_type] = 1
+        return track
+
+def build_feature_index(dataset):
+    return FeatureIndex(dataset.table("features"))
+
+def get_feature_index(dataset):
+    """
+    Return the sequence feature index of a dataset, read on first use
+    """
+    return dataset.derived("feature_index", build_feature_index)
@@ -0,0 +1,69 @@
+# How a filter value restricts the rows, used to tell whether new filters are narrower:
+# "any": rows holding any of the values (narrower with fewer values)
+# "all": rows matching every value (narrower with more values)
+# "range": (min, max) tuple (narrower with a tighter range)
+# "substring": sequence fragment (narrower when it contains the previous fragment)
+# "equal": any other value, only the same value is as narrow
+# Filters missing from a rule table are "range" for tuples, "any" for lists, "equal" otherwise.
+uniprot_refinement_rules = {
+    "Presence": "all",
+    "Motifs": "all",
+    "Sequence": "substring",
+    # Top-k hits are not nested when k changes (ties), only the same search is reused
+    "Similar to": "equal",
+    # Options of one feature search, only the same search is reused
+    "Feature": "equal",
+}
+
+def is_active(value):
+    """
+    True if a filter value restricts the rows (empty lists and texts do not)
+    """
+    if value is None:
+        return False
+    if isinstance(value, tuple):
+        return True
+    if isinstance(value, dict):
+        # {"query": ...} of "Similar to", options of "Feature"
+        if "query" in value:
+            return bool(value["query"])
+        return any(option is not None and option != [] and option != "" for option in value.values())
+    return len(value) != 0
+
+def filter_rule(field, value, rules):
+    if field in rules:
+        return rules[field]
+    if isinstance(value, tuple):
+        return "range"
+    if isinstance(value, list):
+        return "any"
+    return "equal"
+
+def is_narrower(new, old, rules):
+    """
+    True if every row kept by the filters new is also kept by the filters old
+    (new adds constraints, tightens ranges or keeps fewer OR'd values)
+    """
+    for field in set(new) | set(old):
+        old_value = old.get(field)
+        new_value = new.get(field)
+        if not is_active(old_value):
+            continue
+        if not is_active(new_value):
+            # Constraint removed
+            return False
+
+        rule = filter_rule(field, old_value, rules)
+        if rule == "any":
+            narrower = set(new_value) <= set(old_value)
+        elif rule == "all":
+            narrower = set(new_value) >= set(old_value)
+        elif rule == "range":
+            narrower = new_value[0] >= old_value[0] and new_value[1] <= old_value[1]
+        elif rule == "substring":
+            narrower = old_value in new_value
+        else:
+            narrower = new_value == old_value
+        if not narrower:
+            return False
+    return True
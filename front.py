@@ -1,12 +1,17 @@
+import math
 import streamlit as st
 from import_CSV import *
 import py3Dmol
-import re
 import pandas as pd
+import plotly.graph_objects as go
 from subcell_visualization import display_subcellular_location
+from motif_search import gpcr_motifs, compile_prosite
+from query_cache import query_cache
+from hydropathy import TM_THRESHOLD, WINDOW
 
 # Extract filters and initialize filter dictionaries
 filters_uniprot = extract_filters_uniprot()
+filters_drugbank = extract_filters_drugbank()
 
 # Define fields to display
 uniprot_selections = [
@@ -28,6 +33,13 @@ uniprot_selections = [
     "AlphaFoldDB",
 ]
 
+# Fields shown from the annotation tables parsed at ingest: field -> table
+annotation_fields = {
+    "Tissue specificity": "tissue",
+    "Function [CC]": "function",
+    "Involvement in disease": "disease",
+}
+
 st.set_page_config(page_title="GPCR-GPER Data Explorer")
 
 ## Section 1: Sidebar (intelligent filters)
@@ -38,38 +50,55 @@ with st.sidebar:
     with st.expander("✅ Filter by Attribute Presence"):
         st.markdown("**Show only entries with:**")
 
-        # Initialize presence filters in session state if not exists
-        if "presence_filters" not in st.session_state:
-            st.session_state.presence_filters = {}
-
-        # Key attributes to filter by presence/absence
+        # Key attributes to filter by presence/absence (flags computed once at load)
         key_attributes = {
             "has_structure": "3D Structure available (PDB)",
+            "has_alphafold": "AlphaFold model available",
             "has_disease": "Disease involvement",
             "has_mutations": "Mutation data",
             "has_function": "Functional annotation",
+            "has_location": "Subcellular location",
             "has_tissue": "Tissue specificity",
         }
 
         # Create a checkbox for each attribute
-        for key, label in key_attributes.items():
-            st.session_state.presence_filters[key] = st.checkbox(label)
+        presence_choices = [
+            key for key, label in key_attributes.items() if st.checkbox(label)
+        ]
+
+    # Recherche inverse : quelles entrées citent un article PubMed
+    with st.expander("📚 Literature"):
+        pubmed_lookup = st.text_input(
+            "PubMed ID",
+            key="pubmed_lookup",
+            help="Lists the entries and annotations citing this article",
+        ).strip()
 
     # Multi-database filters with tabs
-    uniprot, autre = st.tabs(["Uniprot", " "])
+    uniprot, drugbank = st.tabs(["Uniprot", "DrugBank"])
 
     # Uniprot filters
     with uniprot:
-        uniprot_choices = {}
+        uniprot_choices = {"Presence": presence_choices}
+        facet_placeholders = {}
+        # Recherche plein texte dans les champs descriptifs (function, disease, tissue...)
+        uniprot_text_query = st.text_input(
+            "📝 Full-text search",
+            key="uniprot_text",
+            help='e.g. apoptosis, disease:"breast cancer" or tissue:brain. '
+            "Fields: " + ", ".join(text_fields["uniprot"]),
+        )
+        uniprot_choices.update({"Text": uniprot_text_query.strip()})
         expanders = {
             "ℹ️ General informations": [
                 "Entry",
                 "Entry Name",
                 "Protein names",
                 "Organism",
+                "Clade",
             ],
-            "🧬 Genome": ["Gene Names", "Sequence"],
-            "🔢 Numericals": ["Length", "Mass"],
+            "🧬 Genome": ["Gene Names", "Sequence", "Motifs", "Similar to", "Feature"],
+            "🔢 Numericals": ["Length", "Mass"] + list(descriptor_fields),
         }
 
         for expander, keys in expanders.items():
@@ -77,6 +106,8 @@ with st.sidebar:
                 for key in keys:
                     if key == "Mass":
                         st.markdown(f"**{key} (Da)**")
+                    elif key in descriptor_fields:
+                        st.markdown(f"**{descriptor_fields[key]}**")
                     else:
                         st.markdown(f"**{key}**")
 
@@ -88,6 +119,101 @@ with st.sidebar:
                             help="Enter a sequence pattern to find (e.g., 'AAA')",
                         )
                         uniprot_choices.update({"Sequence": sequence_query})
+                    elif key == "Motifs":
+                        # Conserved GPCR motifs and custom PROSITE patterns
+                        motif_names = st.multiselect(
+                            "Select conserved motifs",
+                            options=list(gpcr_motifs.keys()),
+                            label_visibility="collapsed",
+                        )
+                        custom_motifs = st.text_area(
+                            "PROSITE patterns (one per line)",
+                            key="motif_search",
+                            help="e.g. 'N-P-x(2)-Y', '[DE]-R-Y' or 'C-W-x-P'. Entries must contain every motif.",
+                        )
+                        patterns = [gpcr_motifs[name] for name in motif_names]
+                        for line in custom_motifs.splitlines():
+                            if not line.strip():
+                                continue
+                            try:
+                                compile_prosite(line)
+                                patterns.append(line.strip())
+                            except ValueError as e:
+                                st.error(str(e))
+                        uniprot_choices.update({"Motifs": patterns})
+                    elif key == "Similar to":
+                        # Approximate search: best BLOSUM62 local alignments to a peptide
+                        similar_query = st.text_input(
+                            "Enter a peptide",
+                            key="similar_search",
+                            help="Keeps the entries whose sequence aligns best with this peptide (substitutions allowed)",
+                        )
+                        similar_top_k = st.number_input(
+                            "Number of entries", min_value=1, max_value=100, value=10
+                        )
+                        similar_method = st.selectbox(
+                            "Alignment", options=["ungapped", "smith-waterman"]
+                        )
+                        uniprot_choices.update(
+                            {
+                                "Similar to": {
+                                    "query": similar_query.strip(),
+                                    "top_k": int(similar_top_k),
+                                    "method": similar_method,
+                                }
+                            }
+                        )
+                    elif key == "Feature":
+                        # Entrées ayant un élément de séquence (ex. CARBOHYD dans un TOPO_DOM extracellulaire)
+                        feature_types = get_feature_types_uniprot()
+                        selected_types = st.multiselect(
+                            "Feature types",
+                            options=feature_types,
+                            key="feature_types",
+                        )
+                        feature_start, feature_end = st.columns(2)
+                        start = feature_start.number_input(
+                            "From residue", min_value=0, value=0, key="feature_start",
+                            help="0 for no bound",
+                        )
+                        end = feature_end.number_input(
+                            "To residue", min_value=0, value=0, key="feature_end",
+                            help="0 for no bound",
+                        )
+                        within_types = st.multiselect(
+                            "Within a feature of type",
+                            options=feature_types,
+                            key="feature_within",
+                        )
+                        within_note = st.text_input(
+                            "Whose note contains",
+                            key="feature_within_note",
+                            help="e.g. Extracellular",
+                        ).strip()
+                        feature_filter = {}
+                        if selected_types:
+                            feature_filter["types"] = selected_types
+                        if start:
+                            feature_filter["start"] = int(start)
+                        if end:
+                            feature_filter["end"] = int(end)
+                        if within_types:
+                            feature_filter["within"] = within_types
+                            if within_note:
+                                feature_filter["within_note"] = within_note
+                        uniprot_choices.update({"Feature": feature_filter})
+                    elif key == "Clade":
+                        # Tous les organismes d'un clade (mammifères, téléostéens...)
+                        clades = {clade["taxid"]: clade for clade in get_clades_uniprot()}
+                        selected_clades = st.multiselect(
+                            "Select clades",
+                            options=list(clades),
+                            format_func=lambda taxid: "· " * (clades[taxid]["depth"] - 1)
+                            + f"{clades[taxid]['name']} ({clades[taxid]['rank']}) ({clades[taxid]['count']})",
+                            label_visibility="collapsed",
+                            key="uniprot_Clade",
+                        )
+                        uniprot_choices.update({"Clade": selected_clades})
                     elif key in ["Length", "Mass"]:
                         values = filters_uniprot[key]
                         uniprot_choices.update(
@@ -100,28 +226,120 @@ with st.sidebar:
                                 )
                             }
                         )
+                    elif key in descriptor_fields:
+                        # Descripteurs calculés une fois pour toutes les séquences
+                        low, high = filters_uniprot[key]
+                        low, high = math.floor(low * 100) / 100, math.ceil(high * 100) / 100
+                        selected = st.slider(
+                            f"Select {key}",
+                            min_value=low,
+                            max_value=high,
+                            value=(low, high),
+                            step=0.01,
+                            label_visibility="collapsed",
+                            key=f"uniprot_{key}",
+                        )
+                        # The full range keeps the entries without a sequence
+                        if selected != (low, high):
+                            uniprot_choices.update({key: selected})
                     else:
-                        values = filters_uniprot[key]
+                        # Drawn once every filter is known, with the facet counts
+                        facet_placeholders[key] = st.empty()
                         uniprot_choices.update(
-                            {
-                                key: st.multiselect(
-                                    f"Select {key}",
-                                    options=values,
-                                    label_visibility="collapsed",
-                                )
-                            }
+                            {key: st.session_state.get(f"uniprot_{key}", [])}
                         )
 
+    # DrugBank filters: restrict the drugs listed for each protein
+    with drugbank:
+        drugbank_choices = {}
+        drugbank_placeholders = {}
+        drugbank_text_query = st.text_input(
+            "📝 Full-text search",
+            key="drugbank_text",
+            help="e.g. CYP3A4, metabolism:CYP3A4 or indication:hypertension. "
+            "Fields: " + ", ".join(text_fields["drugbank"]),
+        )
+        if drugbank_text_query.strip():
+            drugbank_choices.update({"Text": drugbank_text_query.strip()})
+        for key in facet_fields_drugbank:
+            st.markdown(f"**{key}**")
+            drugbank_placeholders[key] = st.empty()
+            drugbank_choices.update({key: st.session_state.get(f"drugbank_{key}", [])})
+        for key, label in [
+            ("Absorption", "Absorption (%)"),
+            ("Protein Binding", "Protein Binding (%)"),
+            ("Half Life", "Half Life (h)"),
+            ("Molecular Weight", "Molecular Weight (Da)"),
+        ]:
+            st.markdown(f"**{label}**")
+            low, high = filters_drugbank[key]
+            selected = st.slider(
+                f"Select {label}",
+                min_value=float(low),
+                max_value=float(high),
+                value=(float(low), float(high)),
+                label_visibility="collapsed",
+                key=f"drugbank_{key}",
+            )
+            # The full range keeps the drugs without a value for this field
+            if selected != (float(low), float(high)):
+                drugbank_choices.update({key: selected})
+
+
+def facet_multiselect(placeholder, key, label, values, counts):
+    """
+    Multiselect of a filter listing the values that match rows, with their number of rows.
+    Selected values stay listed even when they no longer match anything.
+    """
+    selected = st.session_state.get(key, [])
+    options = [v for v in values if v in counts or v in selected]
+    placeholder.multiselect(
+        label,
+        options=options,
+        format_func=lambda v: f"{v} ({counts.get(v, 0)})",
+        label_visibility="collapsed",
+        key=key,
+    )
+
+
+# Facet counts: for each value, the number of rows the current filters would keep with it
+uniprot_counts = get_facet_counts_uniprot(uniprot_choices)
+for key, placeholder in facet_placeholders.items():
+    facet_multiselect(
+        placeholder, f"uniprot_{key}", f"Select {key}", filters_uniprot[key], uniprot_counts[key]
+    )
+drugbank_counts = get_facet_counts_drugbank(drugbank_choices)
+for key, placeholder in drugbank_placeholders.items():
+    facet_multiselect(
+        placeholder,
+        f"drugbank_{key}",
+        f"Select {key}",
+        [v for v in filters_drugbank[key] if not pd.isna(v)],
+        drugbank_counts[key],
+    )
+
 ## Section 2: Main area (search and results)
 # Get filtered results
 print(uniprot_choices)
-filtered_uniprot_indices = filter_results_uniprot(uniprot_choices)
+# Narrowing the filters only re-tests the rows kept by the previous run of this session
+filtered_uniprot_indices = refine_results_uniprot(uniprot_choices, st.session_state)
+# Full-text search: best matches first, with the extract of the text around the words
+text_snippets = {}
+if uniprot_choices["Text"]:
+    kept = set(filtered_uniprot_indices)
+    filtered_uniprot_indices = [
+        row for row in search_text("uniprot", uniprot_choices["Text"]) if row in kept
+    ]
+    text_snippets = get_text_snippets(
+        "uniprot", uniprot_choices["Text"], filtered_uniprot_indices
+    )
 filtered_results = get_values_for_rows_uniprot(
     filtered_uniprot_indices, uniprot_selections
 )
 
 # Display results count
-results_number = len(list(filtered_results.values())[0])
+results_number = len(filtered_uniprot_indices)
+citation_counts = get_citation_counts_uniprot(filtered_uniprot_indices)
 
 # Initialize session state for detail view if not exists
 if "show_detail_view" not in st.session_state:
@@ -136,114 +354,105 @@ def show_protein_detail(protein_index):
     st.session_state.show_detail_view = True
 
 
-# Add this before the results display section
-# Filter results based on attribute presence checkboxes
-if "presence_filters" in st.session_state:
-    indices_to_keep = []
-    for i in range(results_number):
-        include_row = True
-
-        # Check if the presence filters require this row to be filtered out
-        if st.session_state.presence_filters.get("has_structure", False):
-            if (
-                "PDB" not in filtered_results
-                or pd.isna(filtered_results["PDB"][i])
-                or filtered_results["PDB"][i] == ""
-            ):
-                include_row = False
-
-        if include_row and st.session_state.presence_filters.get("has_disease", False):
-            if (
-                "Involvement in disease" not in filtered_results
-                or pd.isna(filtered_results["Involvement in disease"][i])
-                or filtered_results["Involvement in disease"][i] == ""
-            ):
-                include_row = False
-
-        if include_row and st.session_state.presence_filters.get(
-            "has_mutations", False
-        ):
-            if (
-                "Mutagenesis" not in filtered_results
-                or pd.isna(filtered_results["Mutagenesis"][i])
-                or filtered_results["Mutagenesis"][i] == ""
-            ):
-                include_row = False
-
-        if include_row and st.session_state.presence_filters.get("has_function", False):
-            if (
-                "Function [CC]" not in filtered_results
-                or pd.isna(filtered_results["Function [CC]"][i])
-                or filtered_results["Function [CC]"][i] == ""
-            ):
-                include_row = False
-
-        if include_row and st.session_state.presence_filters.get("has_location", False):
-            if (
-                "Subcellular location [CC]" not in filtered_results
-                or pd.isna(filtered_results["Subcellular location [CC]"][i])
-                or filtered_results["Subcellular location [CC]"][i] == ""
-            ):
-                include_row = False
-
-        if include_row and st.session_state.presence_filters.get("has_tissue", False):
-            if (
-                "Tissue specificity" not in filtered_results
-                or pd.isna(filtered_results["Tissue specificity"][i])
-                or filtered_results["Tissue specificity"][i] == ""
-            ):
-                include_row = False
-
-        if include_row:
-            indices_to_keep.append(i)
-
-    # Create filtered version of results
-    if any(st.session_state.presence_filters.values()):
-        filtered_display_results = {}
-        for key, values in filtered_results.items():
-            filtered_display_results[key] = [values[i] for i in indices_to_keep]
-        filtered_results = filtered_display_results
-        # Update results number for display
-        results_number = len(indices_to_keep)
-
-# Filter results based on sequence query
+def hydropathy_figure(hydropathy, features):
+    """
+    Plotly chart of a hydropathy profile, with the candidate transmembrane segments (red)
+    and the segments annotated as TRANSMEM (grey)
+    """
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=hydropathy["Residue"],
+            y=hydropathy["Hydropathy"].astype(float),
+            mode="lines",
+            name="Hydropathy",
+        )
+    )
+    fig.add_hline(y=TM_THRESHOLD, line_dash="dash", line_color="red")
+    for start, end in hydropathy["Segments"]:
+        fig.add_vrect(x0=start, x1=end, fillcolor="red", opacity=0.15, line_width=0)
+    if len(features):
+        transmembrane = features[features["type"] == "TRANSMEM"]
+        for start, end in zip(transmembrane["start"], transmembrane["end"]):
+            fig.add_vrect(
+                x0=start, x1=end, y0=0, y1=0.08, fillcolor="grey", opacity=0.6, line_width=0
+            )
+    fig.update_layout(
+        xaxis_title="Residue",
+        yaxis_title="Hydropathy",
+        height=300,
+        margin=dict(l=0, r=0, t=20, b=0),
+        showlegend=False,
+    )
+    return fig
+
+
+def highlight_sequence(sequence, offsets, length):
+    """
+    Return the sequence as HTML with the motif occurrences starting at offsets highlighted
+    """
+    marked = [False] * len(sequence)
+    for offset in offsets:
+        for position in range(offset, min(offset + length, len(sequence))):
+            marked[position] = True
+
+    html = []
+    for residue, is_marked in zip(sequence, marked):
+        html.append(f"<mark>{residue}</mark>" if is_marked else residue)
+    html = "".join(html).replace("</mark><mark>", "")
+    return f'<div style="font-family: monospace; word-break: break-all;">{html}</div>'
+
+
+# Sequence query: rows are already filtered by filter_results_uniprot,
+# keep the motif offsets of the displayed rows for highlighting
+sequence_hits = {}
 if "Sequence" in uniprot_choices and uniprot_choices["Sequence"]:
     sequence_query = uniprot_choices["Sequence"].upper().strip()
-
-    # Vérifier si nous avons réellement le champ Sequence dans les données
-    if not (
-        "Sequence" not in filtered_results or len(filtered_results["Sequence"]) == 0
+    sequence_hits = get_sequence_hits_uniprot(sequence_query, filtered_uniprot_indices)
+
+    if results_number:
+        st.success(f"Found in {results_number} sequence(s)")
+    else:
+        st.warning(f"Aucune séquence contenant '{sequence_query}' trouvée.")
+
+# Motif spans of the displayed rows, shown in the detail view
+motif_hits = {}
+if uniprot_choices.get("Motifs"):
+    motif_hits = get_motif_hits_uniprot(uniprot_choices["Motifs"], filtered_uniprot_indices)
+
+# Alignment of the displayed rows with the peptide of the similarity search
+similar_hits = {}
+if uniprot_choices["Similar to"]["query"]:
+    for hit in search_similar_uniprot(
+        uniprot_choices["Similar to"]["query"],
+        top_k=uniprot_choices["Similar to"]["top_k"],
+        method=uniprot_choices["Similar to"]["method"],
     ):
-        # Si nous avons des séquences, procéder à la recherche
-        indices_to_keep = []
+        similar_hits[hit["row"]] = hit
 
-        for i in range(results_number):
-            if pd.isna(filtered_results["Sequence"][i]):
-                continue
-
-            # Nettoyer la séquence (enlever espaces, sauts de ligne)
-            clean_seq = "".join(filtered_results["Sequence"][i].split())
-
-            # Vérifier si la séquence contient la sous-séquence recherchée
-            if sequence_query in clean_seq.upper():
-                indices_to_keep.append(i)
-
-        # Met à jour les résultats filtrés
-        if indices_to_keep:
-            st.success(f"Found in {len(indices_to_keep)} sequence(s)")
-            filtered_display_results = {}
-            for key, values in filtered_results.items():
-                filtered_display_results[key] = [values[i] for i in indices_to_keep]
-            filtered_results = filtered_display_results
-            # Met à jour le nombre de résultats
-            results_number = len(indices_to_keep)
-        elif sequence_query:  # Si aucune correspondance n'a été trouvée
-            st.warning(f"Aucune séquence contenant '{sequence_query}' trouvée.")
-            results_number = 0
+# Drugs linked to the displayed proteins and kept by the DrugBank filters
+drug_fields = ["DrugBank ID", "Name", "Type", "Groups", "Chemical Formula", "Description"]
+filtered_drugbank_indices = filter_results_drugbank(drugbank_choices)
+protein_drugs = get_values_for_rows_drugbank(
+    filtered_uniprot_indices, filtered_drugbank_indices, drug_fields
+)
 
 # Then continue with your existing code to display results
 # Main view - either results listing or detail page
 if not st.session_state.show_detail_view:
+    if pubmed_lookup:
+        st.subheader(f"📚 Citations of PubMed {pubmed_lookup}")
+        if pubmed_lookup.isdigit():
+            citations = get_citations_pubmed(int(pubmed_lookup))
+            if citations["Entry"]:
+                st.dataframe(
+                    pd.DataFrame(citations).drop(columns="UniProt index"), hide_index=True
+                )
+            else:
+                st.info("No entry cites this article.")
+        else:
+            st.error("A PubMed ID is a number.")
+
     with st.container():
         st.subheader(f"📄 Results ({results_number})")
 
@@ -260,7 +469,12 @@ if not st.session_state.show_detail_view:
                         args=(i,),
                     )
 
+                # Extract of the text matching the full-text search
+                if filtered_uniprot_indices[i] in text_snippets:
+                    st.markdown(text_snippets[filtered_uniprot_indices[i]])
+
                 # Display protein information
+                st.markdown(f"**Citations**: {citation_counts[i]} PubMed references")
                 for key in ["Entry", "Protein names", "Gene Names", "Organism"]:
                     if key in filtered_results:
                         value = filtered_results[key]
@@ -283,8 +497,8 @@ else:
         st.session_state.show_detail_view = False
         st.rerun()
     # Create tabs for different databases
-    uniprot_tab, pdb_tab = st.tabs(
-        ["🧬 UniProt", "🔬 3D Structure"]
+    uniprot_tab, pdb_tab, drugs_tab = st.tabs(
+        ["🧬 UniProt", "🔬 3D Structure", "💊 Drugs"]
     )
 
     with uniprot_tab:
@@ -302,134 +516,160 @@ else:
                 # Special handling for certain fields
                 if field == "Sequence":
                     with st.expander("Sequence"):
-                        st.text(value)
-                elif field == "Mutagenesis":
-                    # Use existing mutagenesis parsing logic if needed
-                    st.markdown(f"**{field}:**")
-                    # Parse mutagenesis data
-                    mutations = []
-                    raw_data = value.split("MUTAGEN ")
-
-                    for mut in raw_data:
-                        if not mut.strip():
-                            continue
-
-                        # Extract position and mutation
-                        position_match = re.search(r"(\d+);", mut)
-                        if position_match:
-                            position = position_match.group(1)
-
-                        # Extract mutation details
-                        mutation_match = re.search(r'\/note="([^"]+)"', mut)
-                        if mutation_match:
-                            mutation_details = mutation_match.group(1)
-
-                        # Extract evidence
-                        evidence_match = re.search(r'\/evidence="([^"]+)"', mut)
-                        evidence = evidence_match.group(1) if evidence_match else ""
-
-                        # Extract PubMed IDs from evidence
-                        pubmed_ids = (
-                            re.findall(r"PubMed:(\d+)", evidence) if evidence else []
-                        )
-
-                        # Format PubMed links with HTML for dataframe display
-                        pubmed_html_links = []
-                        for pmid in pubmed_ids:
-                            pubmed_html_links.append(
-                                f'<a href="https://pubmed.ncbi.nlm.nih.gov/{pmid}" target="_blank">{pmid}</a>'
+                        protein_row = filtered_uniprot_indices[protein_idx]
+                        if protein_row in sequence_hits:
+                            # Highlight the searched motif at the offsets given by the sequence index
+                            clean_seq = "".join(value.split()).upper()
+                            st.caption(
+                                f"'{sequence_query}' found at position(s): "
+                                + ", ".join(str(offset + 1) for offset in sequence_hits[protein_row])
+                            )
+                            st.markdown(
+                                highlight_sequence(
+                                    clean_seq,
+                                    sequence_hits[protein_row],
+                                    len("".join(sequence_query.split())),
+                                ),
+                                unsafe_allow_html=True,
                             )
+                        else:
+                            st.text(value)
+
+                        # Occurrences of the PROSITE motifs used as filters
+                        motif_rows = []
+                        for pattern, hits in motif_hits.items():
+                            for start, end in hits.get(protein_row, []):
+                                motif_rows.append(
+                                    {
+                                        "Motif": pattern,
+                                        "Position": f"{start + 1}-{end}",
+                                        "Match": "".join(value.split()).upper()[start:end],
+                                    }
+                                )
+                        if motif_rows:
+                            st.markdown("**Motif occurrences:**")
+                            st.dataframe(pd.DataFrame(motif_rows), hide_index=True)
 
-                        pubmed_text = (
-                            ", ".join(pubmed_html_links) if pubmed_html_links else "N/A"
-                        )
+                        # Best local alignment with the peptide of the similarity search
+                        if protein_row in similar_hits:
+                            hit = similar_hits[protein_row]
+                            st.markdown(
+                                f"**Similarity score:** {hit['score']} "
+                                f"(residues {hit['start'] + 1}-{hit['end']})"
+                            )
+                            st.code(
+                                f"Query    {hit['aligned_query']}\n"
+                                f"Sequence {hit['aligned_sequence']}",
+                                language=None,
+                            )
 
-                        if position_match and mutation_match:
-                            mutations.append(
-                                {
-                                    "Position": position,
-                                    "Mutation": mutation_details,
-                                    "Evidence": pubmed_text,
-                                }
+                    # Sequence features parsed at ingest, with their per-residue track
+                    features = get_features_uniprot(protein_row)
+                    if len(features):
+                        with st.expander("Sequence features"):
+                            st.area_chart(get_feature_track_uniprot(protein_row), height=200)
+                            st.dataframe(
+                                pd.DataFrame(
+                                    {
+                                        "Type": features["type"].tolist(),
+                                        "Position": [
+                                            str(start) if start == end else f"{start}..{end}"
+                                            for start, end in zip(features["start"], features["end"])
+                                        ],
+                                        "Note": features["note"].tolist(),
+                                        "PubMed": [", ".join(ids) for ids in features["pubmed"]],
+                                    }
+                                ),
+                                hide_index=True,
                             )
 
-                    # Display as a dataframe with clickable links
-                    if mutations:
-                        df = pd.DataFrame(mutations)
+                    # Kyte-Doolittle profile read from the precomputed arrays
+                    hydropathy = get_hydropathy_uniprot(protein_row)
+                    if len(hydropathy["Residue"]):
+                        with st.expander("Hydropathy profile"):
+                            st.plotly_chart(
+                                hydropathy_figure(hydropathy, features), use_container_width=True
+                            )
+                            annotated = (features["type"] == "TRANSMEM").sum() if len(features) else 0
+                            st.caption(
+                                f"Kyte-Doolittle, window of {WINDOW} residues. "
+                                f"{len(hydropathy['Segments'])} candidate transmembrane segment(s) "
+                                f"above {TM_THRESHOLD}, {annotated} annotated."
+                            )
+                elif field == "Mutagenesis":
+                    st.markdown(f"**{field}:**")
+                    # Mutations parsed at ingest (one row per MUTAGEN feature)
+                    mutations = get_annotations_uniprot(
+                        "mutagenesis", filtered_uniprot_indices[protein_idx]
+                    )
+                    if len(mutations):
+                        df = pd.DataFrame(
+                            {
+                                "Position": [
+                                    str(start) if start == end else f"{start}..{end}"
+                                    for start, end in zip(mutations["start"], mutations["end"])
+                                ],
+                                "Mutation": mutations["note"].tolist(),
+                                # PubMed links with HTML for dataframe display
+                                "Evidence": [
+                                    ", ".join(
+                                        f'<a href="https://pubmed.ncbi.nlm.nih.gov/{pmid}" target="_blank">{pmid}</a>'
+                                        for pmid in pubmed_ids
+                                    )
+                                    or "N/A"
+                                    for pubmed_ids in mutations["pubmed"]
+                                ],
+                            }
+                        )
                         st.markdown(df.to_html(escape=False), unsafe_allow_html=True)
                 elif field == "Mass":
                     st.markdown(f"**{field}:** {value} Da")
-                elif field == "Tissue specificity":
-                    # Remove the "TISSUE SPECIFICITY: " prefix and any trailing periods
-                    cleaned_value = value.replace("TISSUE SPECIFICITY: ", "").strip()
-                    cleaned_value = re.sub(r"\.$", "", cleaned_value).strip()
-
-                    # Extract all PubMed IDs
-                    pubmed_matches = re.findall(
-                        r"ECO:0000269\|PubMed:(\d+)", cleaned_value
+                    # Physicochemical descriptors computed from the sequence
+                    values, composition = get_descriptors_uniprot(filtered_uniprot_indices[protein_idx])
+                    if not pd.isna(values["pI"]):
+                        st.markdown(
+                            " · ".join(
+                                f"**{descriptor_fields[name]}:** {values[name]:.2f}"
+                                for name in descriptor_fields
+                            )
+                        )
+                        with st.expander("Amino-acid composition (%)"):
+                            st.bar_chart(composition)
+                elif field in annotation_fields:
+                    # Statements parsed at ingest, with their PubMed references
+                    items = get_annotations_uniprot(
+                        annotation_fields[field], filtered_uniprot_indices[protein_idx]
                     )
-                    if pubmed_matches:
-                        # Remove the entire ECO reference section
-                        cleaned_value = re.sub(r"{ECO:.*}", "", cleaned_value).strip()
-                        # Display the cleaned text
-                        st.markdown(f"**{field}:** {cleaned_value}")
-                        # Create links for all PubMed references
-                        pubmed_links = [
-                            f"[{id}](https://pubmed.ncbi.nlm.nih.gov/{id})"
-                            for id in pubmed_matches
-                        ]
-                        st.markdown(f"🔗 PubMed References: {', '.join(pubmed_links)}")
-                    else:
-                        st.markdown(f"**{field}:** {cleaned_value}")
-                elif field == "Function [CC]":
-                    # Remove the "FUNCTION: " prefix and any trailing periods
-                    cleaned_value = value.replace("FUNCTION: ", "").strip()
-                    cleaned_value = re.sub(r"\.$", "", cleaned_value).strip()
-
-                    # Extract all PubMed IDs
-                    pubmed_matches = re.findall(r"PubMed:(\d+)", cleaned_value)
-                    if pubmed_matches:
-                        # Remove the entire ECO reference section
-                        cleaned_value = re.sub(r"{ECO:.*?}", "", cleaned_value).strip()
-                        # Clean up any remaining parenthetical PubMed references
-                        cleaned_value = re.sub(
-                            r"\(PubMed:[0-9,\s]+\)", "", cleaned_value
-                        ).strip()
-                        # Display the cleaned text
-                        st.markdown(f"**{field}:** {cleaned_value}")
-                        # Create links for all PubMed references
-                        pubmed_links = [
-                            f"[{id}](https://pubmed.ncbi.nlm.nih.gov/{id})"
-                            for id in pubmed_matches
-                        ]
-                        st.markdown(f"🔗 PubMed References: {', '.join(pubmed_links)}")
+                    if field == "Involvement in disease":
+                        texts = []
+                        for disease in items.itertuples(index=False):
+                            heading = ""
+                            if not pd.isna(disease.name):
+                                heading = disease.name
+                                if not pd.isna(disease.acronym):
+                                    heading += f" ({disease.acronym})"
+                                heading += "".join(f" (MIM: {mim})" for mim in disease.mim) + ": "
+                            parts = [part for part in (disease.text, disease.note) if not pd.isna(part)]
+                            texts.append(heading + ". ".join(parts))
                     else:
-                        st.markdown(f"**{field}:** {cleaned_value}")
-
-                elif field == "Involvement in disease":
-                    # Remove the "DISEASE: " prefix and any trailing periods
-                    cleaned_value = value.replace("DISEASE: ", "").strip()
-                    cleaned_value = re.sub(r"\.$", "", cleaned_value).strip()
-
-                    # Extract all PubMed IDs
-                    pubmed_matches = re.findall(r"PubMed:(\d+)", cleaned_value)
-                    if pubmed_matches:
-                        # Remove the entire ECO reference section
-                        cleaned_value = re.sub(r"{ECO:.*?}", "", cleaned_value).strip()
-                        # Remove MIM reference but keep the number
-                        cleaned_value = re.sub(
-                            r"\[MIM:(\d+)\]", r"(MIM: \1)", cleaned_value
-                        )
-                        # Display the cleaned text
-                        st.markdown(f"**{field}:** {cleaned_value}")
+                        texts = items["text"].tolist()
+                    st.markdown(f"**{field}:** {'. '.join(texts) if texts else value}")
+                    pubmed_ids = list(
+                        dict.fromkeys(pmid for pubmed in items["pubmed"] for pmid in pubmed)
+                    )
+                    if pubmed_ids:
                         # Create links for all PubMed references
                         pubmed_links = [
                             f"[{id}](https://pubmed.ncbi.nlm.nih.gov/{id})"
-                            for id in pubmed_matches
+                            for id in pubmed_ids
                         ]
                         st.markdown(f"🔗 PubMed References: {', '.join(pubmed_links)}")
-                    else:
-                        st.markdown(f"**{field}:** {cleaned_value}")
+                elif field == "Organism":
+                    st.markdown(f"**{field}:** {value}")
+                    # Lignée taxonomique de l'organisme (arbre des clades)
+                    lineage = get_lineage_uniprot(filtered_uniprot_indices[protein_idx])
+                    if lineage:
+                        st.caption(" › ".join(taxon["name"] for taxon in lineage))
                 elif field == "Subcellular location [CC]":
                     # st.markdown(f"**{field}:** {value}")
                     # Add the visualization below the text
@@ -438,17 +678,15 @@ else:
                 elif field == "PDB":
                     continue
                 elif field == "PubMed ID":
-                    # Split the PubMed IDs and clean them
-                    pubmed_ids = [
-                        pid.strip() for pid in value.split(";") if pid.strip()
-                    ]
-
-                    # Create the links
-                    st.markdown(f"**{field}:**")
+                    # PubMed IDs of the entry from the reverse index, with the fields citing them
+                    citations = get_citations_uniprot(filtered_uniprot_indices[protein_idx])
+                    st.markdown(f"**{field}:** {len(citations)} distinct references")
                     pubmed_links = []
-                    for pid in pubmed_ids:
+                    for pid, fields in citations.items():
+                        cited_in = [name for name in fields if name != "PubMed ID"]
+                        link = f"[{pid}](https://pubmed.ncbi.nlm.nih.gov/{pid})"
                         pubmed_links.append(
-                            f"[{pid}](https://pubmed.ncbi.nlm.nih.gov/{pid})"
+                            f"{link} ({', '.join(cited_in)})" if cited_in else link
                         )
 
                     # Display all links with commas between them
@@ -457,6 +695,28 @@ else:
                     st.markdown(f"**{field}:** {value}")
                 st.divider()  # Add a divider between fields
 
+        # Entrées les plus proches (matrice de voisins précalculée)
+        with st.expander("🧭 Closest entries"):
+            closest_k = st.number_input(
+                "Number of entries", min_value=1, max_value=50, value=10, key="closest_k"
+            )
+            refine = st.checkbox(
+                "Refine by local alignment (Smith-Waterman)", key="closest_refine"
+            )
+            closest = get_closest_uniprot(
+                filtered_uniprot_indices[protein_idx],
+                top_k=int(closest_k),
+                refine="smith-waterman" if refine else None,
+            )
+            if closest is None:
+                st.info("The neighbour matrix is not built yet: run `python neighbours.py`.")
+            elif closest["Entry"]:
+                st.dataframe(
+                    pd.DataFrame(closest).drop(columns=["UniProt index"]), hide_index=True
+                )
+            else:
+                st.info("No entry shares 3-mers with this sequence.")
+
     with pdb_tab:
         st.subheader("3D Structures View")
 
@@ -527,3 +787,54 @@ else:
             pd.isna(alphafold_value) or not alphafold_value
         ):
             st.info("No 3D structures available for this protein.")
+
+    with drugs_tab:
+        st.subheader("DrugBank Drugs")
+
+        # Rows of protein_drugs belonging to the selected protein
+        protein_row = filtered_uniprot_indices[protein_idx]
+        drug_positions = [
+            i
+            for i, row in enumerate(protein_drugs["UniProt index"])
+            if row == protein_row
+        ]
+
+        if drug_positions:
+            drugs = pd.DataFrame(
+                {field: [protein_drugs[field][i] for i in drug_positions] for field in drug_fields}
+            )
+            drugs["DrugBank ID"] = [
+                f'<a href="https://go.drugbank.com/drugs/{db_id}" target="_blank">{db_id}</a>'
+                for db_id in drugs["DrugBank ID"]
+            ]
+            st.markdown(f"{len(drug_positions)} drug(s) linked to this protein")
+            st.markdown(
+                drugs.drop(columns=["Description"]).to_html(escape=False, index=False),
+                unsafe_allow_html=True,
+            )
+            for i in drug_positions:
+                with st.expander(protein_drugs["Name"][i]):
+                    if not pd.isna(protein_drugs["Description"][i]):
+                        st.markdown(protein_drugs["Description"][i])
+                    # Autres protéines ciblées par ce médicament
+                    targets = get_proteins_drugbank(protein_drugs["DrugBank index"][i])
+                    others = [
+                        f"{entry} ({organism})"
+                        for row, entry, organism in zip(
+                            targets["UniProt index"], targets["Entry"], targets["Organism"]
+                        )
+                        if row != protein_row
+                    ]
+                    if others:
+                        st.markdown(f"**Other targets ({len(others)}):** {', '.join(others)}")
+                    else:
+                        st.markdown("No other target in UniProt.")
+        else:
+            st.info("No DrugBank drugs linked to this protein for the current filters.")
+
+# Query cache counters (reruns with unchanged filters are answered from the cache)
+cache_stats = query_cache.stats()
+st.sidebar.caption(
+    f"Query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+    f"{cache_stats['bytes'] / 1e6:.1f} MB"
+)
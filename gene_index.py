@@ -0,0 +1,81 @@
+import re
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+
+# UniProt columns holding gene symbols, separated by spaces (and ";" between genes)
+gene_columns = ["Gene Names", "Gene Names (primary)", "Gene Names (synonym)"]
+
+class GeneIndex:
+    """
+    Inverted index from upper-cased gene symbol to the rows of the UniProt table containing it
+    """
+
+    def __init__(self, df_uniprot):
+        self.n_rows = len(df_uniprot)
+        postings = {}
+        for column in gene_columns:
+            if column not in df_uniprot.columns:
+                continue
+            for row, gene_group in enumerate(df_uniprot[column]):
+                if pd.isna(gene_group):
+                    continue
+                for gene in re.split(r"[\s;]+", str(gene_group).upper()):
+                    if gene:
+                        postings.setdefault(gene, set()).add(row)
+
+        self.postings = {gene: np.array(sorted(rows), dtype=np.int64) for gene, rows in postings.items()}
+        # Sorted symbols, used for the option list and prefix lookups
+        self.symbols = sorted(self.postings)
+        # All postings flattened as (symbol number, row) pairs, for the facet counts
+        self.posting_symbols = np.repeat(np.arange(len(self.symbols)),
+                                         [len(self.postings[symbol]) for symbol in self.symbols])
+        self.posting_rows = (np.concatenate([self.postings[symbol] for symbol in self.symbols])
+                             if self.symbols else np.zeros(0, dtype=np.int64))
+
+    def matching_symbols(self, gene):
+        """
+        Return the symbols matched by gene: the symbol itself, or every symbol starting
+        with the given prefix when gene ends with "*" (e.g. "GPR*")
+        """
+        gene = gene.strip().upper()
+        if not gene.endswith("*"):
+            return [gene] if gene in self.postings else []
+
+        prefix = gene[:-1]
+        start = bisect_left(self.symbols, prefix)
+        matches = []
+        for symbol in self.symbols[start:]:
+            if not symbol.startswith(prefix):
+                break
+            matches.append(symbol)
+        return matches
+
+    def rows(self, genes):
+        """
+        Return a boolean array over the rows, True where any of the genes is found
+        """
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for gene in genes:
+            for symbol in self.matching_symbols(gene):
+                mask[self.postings[symbol]] = True
+        return mask
+
+    def counts(self, rows):
+        """
+        Return a dictionary symbol -> number of the given rows containing it (symbols found in none are left out)
+        """
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[np.asarray(rows, dtype=np.int64)] = True
+        counts = np.bincount(self.posting_symbols[mask[self.posting_rows]], minlength=len(self.symbols))
+        found = np.flatnonzero(counts)
+        return dict(zip([self.symbols[i] for i in found], counts[found].tolist()))
+
+def build_gene_index(dataset):
+    return GeneIndex(dataset.table("uniprot", gene_columns))
+
+def get_gene_index(dataset):
+    """
+    Return the gene index of a dataset, built on first use
+    """
+    return dataset.derived("gene_index", build_gene_index)
@@ -0,0 +1,167 @@
+import json
+import os
+import tempfile
+import numpy as np
+from sequence_matrix import ALPHABET, get_sequence_matrix
+from descriptors import KYTE_DOOLITTLE
+from text_index import table_stamp
+
+# Kyte-Doolittle window: 19 residues, mean above 1.6 for a transmembrane helix
+WINDOW = 19
+TM_THRESHOLD = 1.6
+
+# Runs of windows above the threshold whose centres are at most this many residues apart are
+# one segment (short dips inside a helix); runs of neighbouring helices stay apart
+MERGE_GAP = 5
+
+# Profiles saved next to the columnar copies, reused while uniprot.csv is unchanged
+HYDROPATHY_PATH = "uniprot_hydropathy.npz"
+
+# Version of the saved segments, files of another version are computed again
+SEGMENTS_VERSION = 2
+
+# Rows convolved at once (bounds the temporary float arrays)
+CHUNK_ROWS = 4096
+
+# Hydropathy of every residue code (0 for the ambiguous codes and the padding)
+_hydropathy = np.zeros(len(ALPHABET) + 1, dtype=np.float32)
+for _residue, _value in KYTE_DOOLITTLE.items():
+    _hydropathy[ALPHABET.index(_residue)] = _value
+
+def window_means(codes, lengths, window=WINDOW):
+    """
+    Mean hydropathy of every window of every sequence of a padded code matrix, by a box
+    convolution along the rows (difference of cumulative sums). Return the values of the
+    complete windows, row after row, and the number of windows of each row.
+    """
+    n_windows = np.maximum(lengths - window + 1, 0)
+    values = []
+    for start in range(0, len(codes), CHUNK_ROWS):
+        block = _hydropathy[codes[start:start + CHUNK_ROWS]]
+        sums = np.cumsum(block, axis=1, dtype=np.float32)
+        sums = np.concatenate([np.zeros((len(block), 1), dtype=np.float32), sums], axis=1)
+        means = (sums[:, window:] - sums[:, :-window]) / window
+        # Windows ending inside the sequence only
+        complete = np.arange(means.shape[1])[None, :] < n_windows[start:start + len(block), None]
+        values.append(means[complete])
+    return (np.concatenate(values) if values else np.zeros(0, dtype=np.float32)), n_windows
+
+class HydropathyProfiles:
+    """
+    Kyte-Doolittle profiles of all UniProt sequences, stored as float16 values of consecutive
+    windows (row after row, the windows of a row being profiles[offsets[row]:offsets[row + 1]]),
+    with the candidate transmembrane segments: residues at the centre of the runs of windows
+    above TM_THRESHOLD.
+    """
+
+    def __init__(self, entries, profiles, offsets, segment_rows, segment_starts, segment_ends, window=WINDOW):
+        self.entries = entries
+        self.profiles = profiles
+        self.offsets = offsets
+        self.segment_rows = segment_rows
+        self.segment_starts = segment_starts
+        self.segment_ends = segment_ends
+        self.window = window
+        self.rows = {entry: row for row, entry in enumerate(entries.tolist())}
+
+    @classmethod
+    def build(cls, entries, codes, lengths, window=WINDOW, threshold=TM_THRESHOLD):
+        means, n_windows = window_means(codes, lengths, window)
+        offsets = np.concatenate([[0], np.cumsum(n_windows)]).astype(np.int64)
+
+        # Runs of windows above the threshold, not crossing the end of a sequence
+        above = means >= threshold
+        first = np.zeros(len(means), dtype=bool)
+        first[offsets[:-1][n_windows > 0]] = True
+        last = np.zeros(len(means), dtype=bool)
+        last[offsets[1:][n_windows > 0] - 1] = True
+        previous = np.concatenate([[False], above[:-1]])
+        following = np.concatenate([above[1:], [False]])
+        run_starts = np.flatnonzero(above & (~previous | first))
+        run_ends = np.flatnonzero(above & (~following | last))
+        rows = np.searchsorted(offsets, run_starts, side="right") - 1
+        # Residues at the centre of the first and last windows of the run (1-based, inclusive)
+        starts = run_starts - offsets[rows] + window // 2 + 1
+        ends = run_ends - offsets[rows] + window // 2 + 1
+        merged = np.concatenate([[False], (rows[1:] == rows[:-1]) & (starts[1:] <= ends[:-1] + MERGE_GAP)])
+        keep = ~merged
+        segment_ends = ends[np.concatenate([np.flatnonzero(keep)[1:] - 1, [len(ends) - 1]])] if len(ends) else ends
+        return cls(np.asarray(entries, dtype=str), means.astype(np.float16), offsets, rows[keep],
+                   starts[keep], segment_ends, window)
+
+    def save(self, path, stamp):
+        """
+        Write the profiles to path (npz) with the stamp of the files they were computed from
+        """
+        # Unique file next to the final one, renamed at the end (see text_index.TextIndex.save)
+        fd, partial_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".partial",
+                                            dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, entries=self.entries, profiles=self.profiles, offsets=self.offsets,
+                         segment_rows=self.segment_rows, segment_starts=self.segment_starts,
+                         segment_ends=self.segment_ends, window=np.asarray(self.window),
+                         segments_version=np.asarray(SEGMENTS_VERSION), stamp=np.asarray(json.dumps(stamp)))
+            os.replace(partial_path, path)
+        except BaseException:
+            os.remove(partial_path)
+            raise
+
+    @classmethod
+    def load(cls, path, stamp, window=WINDOW):
+        """
+        Read profiles written by save, None if the file is missing, was computed from other
+        files, with another window or another version of the segments
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            if json.loads(str(arrays["stamp"])) != json.loads(json.dumps(stamp)) or int(arrays["window"]) != window \
+                    or "segments_version" not in arrays or int(arrays["segments_version"]) != SEGMENTS_VERSION:
+                return None
+            return cls(arrays["entries"], arrays["profiles"], arrays["offsets"], arrays["segment_rows"],
+                       arrays["segment_starts"], arrays["segment_ends"], window)
+
+    def profile(self, entry):
+        """
+        (residue at the centre of each window, mean hydropathy of the window) of an entry,
+        empty arrays for sequences shorter than the window
+        """
+        row = self.rows[entry]
+        values = self.profiles[self.offsets[row]:self.offsets[row + 1]]
+        return np.arange(len(values)) + self.window // 2 + 1, values
+
+    def segments(self, entry):
+        """
+        Candidate transmembrane segments of an entry, as a list of (start, end) residues
+        """
+        row = self.rows[entry]
+        start, stop = np.searchsorted(self.segment_rows, [row, row + 1])
+        return list(zip(self.segment_starts[start:stop].tolist(), self.segment_ends[start:stop].tolist()))
+
+def build_hydropathy_profiles(dataset):
+    sequence_matrix = get_sequence_matrix(dataset)
+    return HydropathyProfiles.build(dataset.table("uniprot", ["Entry"])["Entry"].astype(str).to_numpy(),
+                                    sequence_matrix.codes, sequence_matrix.lengths)
+
+def get_hydropathy_profiles(dataset):
+    """
+    Return the hydropathy profiles of a dataset, read from HYDROPATHY_PATH when they were
+    computed from the current uniprot.csv, otherwise computed in memory (the file is only
+    written by save_hydropathy_profiles, at ingest)
+    """
+    def build(dataset):
+        if dataset.sources is not None:
+            profiles = HydropathyProfiles.load(HYDROPATHY_PATH, table_stamp("uniprot"))
+            if profiles is not None:
+                return profiles
+        return build_hydropathy_profiles(dataset)
+    return dataset.derived("hydropathy", build)
+
+def save_hydropathy_profiles(dataset):
+    """
+    Compute the hydropathy profiles of the data files and write them to HYDROPATHY_PATH
+    """
+    stamp = table_stamp("uniprot")
+    build_hydropathy_profiles(dataset).save(HYDROPATHY_PATH, stamp)
+    return HYDROPATHY_PATH
@@ -1,4 +1,30 @@
+import copy
+import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+from dataset import get_dataset
+from gene_index import get_gene_index
+from sequence_index import get_sequence_index
+from motif_search import get_motif_search
+from similarity_search import get_similarity_hits, PROCESSES as SIMILARITY_PROCESSES
+from bitmap_index import all_rows, pack_mask, bitmap_rows, RowSelection, get_bitmap_index
+from presence_flags import get_presence_flags
+from drug_links import parse_drugbank_ids, get_drug_links
+from drug_numeric import numeric_ranges_drugbank, get_range_index
+from query_cache import cached_query
+from filter_refinement import is_narrower, uniprot_refinement_rules
+from facets import facet_counts
+from annotations import get_annotation_table
+from text_index import get_text_index, snippet, text_fields
+from citations import get_pubmed_index
+from taxonomy import get_taxonomy, ROOT
+from features import get_feature_index
+from descriptors import descriptor_fields, get_descriptors
+from hydropathy import get_hydropathy_profiles
+from neighbours import get_neighbour_matrix, refine_neighbours
+from sequence_matrix import get_sequence_matrix
+import sql_store
 
 list_field_uniprot = [
         "Entry",
@@ -28,231 +54,506 @@ list_field_drugbank = ["DrugBank ID",
                        "Patents",
                        "Spectra"]
 
-df_uniprot = pd.read_csv("uniprot.csv")
-df_drugbank = pd.read_csv("drugbank.csv")
+# Multiselect filters shown with the number of matching rows next to each value
+facet_fields_uniprot = ["Entry", "Entry Name", "Protein names", "Organism", "Gene Names"]
+facet_fields_drugbank = ["Name", "Type", "Groups"]
 
-def get_uniprot_drugbank():
+# Filters of filter_results_uniprot that are not columns of uniprot.csv
+# "Motifs": list of PROSITE patterns, entries must contain all of them
+# "Similar to": {"query": peptide, "top_k": 10, "method": "ungapped" or "smith-waterman",
+# "processes": worker processes (optional, similarity_search.PROCESSES by default)},
+# keeps the top_k entries with the best BLOSUM62 local alignment score
+# "Presence": list of presence flags (see presence_flags), entries must have all of them
+# "Text": full-text query over the narrative columns (see text_index), entries must contain every word
+# "Clade": list of taxon IDs (see taxonomy), keeps the entries whose organism belongs to any of them
+# "Feature": {"types": ["CARBOHYD"], "start": 120, "end": 160, "note": ..., "within": ["TOPO_DOM"],
+# "within_note": "Extracellular"} (all keys optional, see features.FeatureIndex.rows_with),
+# keeps the entries having such a sequence feature
+list_special_filters_uniprot = ["Motifs", "Similar to", "Presence", "Text", "Clade", "Feature"]
+
+# Where the filters are evaluated: "memory" (indexes over the loaded tables) or "sqlite"
+# (parameterized queries on the store of sql_store, for datasets read from the data files)
+FILTER_BACKEND = os.environ.get("GPER_FILTER_BACKEND", "memory")
+
+def use_sql_store(dataset):
+    # The in-memory indexes answer while the store is missing or older than the files
+    return FILTER_BACKEND == "sqlite" and dataset.sources is not None and sql_store.get_store() is not None
+
+def get_uniprot_drugbank(dataset=None):
     """
     Return indices of rows in df_drugbank that match DrugBank IDs found in df_uniprot,
     preserving the order of data in uniprot.csv
     """
-    # Initialize a list to store drugbank indices for each row in uniprot
-    # Use None for rows that don't have DrugBank entries
-    result = [None] * len(df_uniprot)
-    
-    # Find rows in df_uniprot that have DrugBank entries
-    request = (~pd.isna(df_uniprot["DrugBank"])) & (df_uniprot["DrugBank"] != "")
-    
-    # Get the list of indices with DrugBank entries
-    uniprot_indices = df_uniprot[request].index.tolist()
-    
-    # Process only rows that have DrugBank entries
-    for idx in uniprot_indices:
-        # Extract DrugBank IDs for this uniprot entry
-        drugbank_ids = parse_drugbank_ids(df_uniprot.loc[idx, "DrugBank"])
-        drugbank_ids = list(set(drugbank_ids))  # Remove duplicates
-        matched_indices = []
-        for db_id in drugbank_ids:
-            mask = df_drugbank["DrugBank ID"] == db_id
-            if mask.any():
-                matched_indices.extend(df_drugbank[mask].index.tolist())
-        
-        # Store the matched indices at the corresponding position
-        result[idx] = matched_indices
-    
-    # Filter out None entries if you only want results for rows with matches
-    result = [indices for indices in result if indices is not None]
-    
-    return result
+    if dataset is None:
+        dataset = get_dataset()
+    # Association table built once per dataset (hash join on the DrugBank ID)
+    links = get_drug_links(dataset)
+    return [links.drugs_for_protein(row) for row in links.uniprot_rows]
 
-def parse_drugbank_ids(text):
-    """
-    Parse a text containing DrugBank IDs formatted as "DBXXXXX; Name." and return a list of DrugBank IDs.
-    """
-    if pd.isna(text) or not text:
-        return []
-    
-    # Split by quotes and semicolons
-    parts = text.split('"')
-    ids = []
-    
-    for part in parts:
-        part = part.strip()
-        if part.startswith('DB'):
-            # Extract the part before the semicolon
-            db_id = part.split(';')[0].strip()
-            ids.append(db_id)
-            
-    return ids
+def extract_filters_uniprot(dataset=None):
+    if dataset is None:
+        dataset = get_dataset()
+    df_uniprot = dataset.table("uniprot", list_field_uniprot)
 
-def extract_filters_uniprot():
     # Get your original filters first (your existing code)
     filters = {column:df_uniprot[column].unique().tolist() for column in list_field_uniprot}
     
-    # Special handling for Gene Names
+    # Gene Names options come from the gene index (individual symbols, upper-cased)
     if "Gene Names" in filters:
-        # Split the combined gene names and process them
-        all_genes = []
-        for gene_group in filters["Gene Names"]:
-            if pd.notna(gene_group) and gene_group:
-                # Split by space and ensure capitalization
-                genes = [gene.strip().upper() for gene in gene_group.split() if gene.strip()]
-                all_genes.extend(genes)
-        
-        # Remove duplicates and sort
-        filters["Gene Names"] = sorted(list(set(all_genes)))
+        filters["Gene Names"] = list(get_gene_index(dataset).symbols)
+    
+    # Ranges of the physicochemical descriptors computed from the sequences
+    descriptors = get_descriptors(dataset)
+    for field in descriptor_fields:
+        bounds = descriptors.bounds(field)
+        filters[field] = list(bounds) if bounds is not None else [0.0, 0.0]
     
     return filters
 
+@cached_query
+def get_clades_uniprot(dataset=None):
+    """
+    Return the clades of the taxonomy tree holding entries, in depth-first order, as a list of
+    dictionaries with the taxon ID, name, rank, depth in the tree and number of entries
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    taxonomy = get_taxonomy(dataset)
+    clades = []
+    for taxid in taxonomy.order:
+        count = taxonomy.count(taxid)
+        if taxid != ROOT and count:
+            clades.append({"taxid": taxid, "name": taxonomy.name[taxid], "rank": taxonomy.rank[taxid],
+                           "depth": taxonomy.depth[taxid], "count": count})
+    return clades
+
+def get_lineage_uniprot(row, dataset=None):
+    """
+    Return the lineage of the organism of a UniProt row, from the top of the taxonomy tree down
+    to the organism, as a list of dictionaries with the taxon ID, name and rank (empty without lineage)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    taxonomy = get_taxonomy(dataset)
+    number = taxonomy.row_numbers[row]
+    if number < 0:
+        return []
+    # The nested-set number of a taxon is its position in the depth-first order
+    return [{"taxid": taxid, "name": taxonomy.name[taxid], "rank": taxonomy.rank[taxid]}
+            for taxid in taxonomy.lineage(taxonomy.order[number]) if taxid != ROOT]
+
 def get_attribute_values_uniprot(data,field): #Renvoie la liste des valeurs pour un attribut donné
     return data.get(field)
 
-def filter_results_uniprot(dic): 
+@cached_query
+def filter_results_uniprot(dic, dataset=None):
     '''dic contient les fields en clés et les valeurs sont des listes de valeurs correspondant 
     à union des field=value
     On renvoie une liste d'indices (ligne 2 du csv correspond à 0)'''
-    if len(dic.keys())==0:
-        return df_uniprot.index.tolist()
-    else:
-        request=pd.Series([True] * len(df_uniprot))
-        
-        # Handle gene names separately
-        gene_names_filter = None
-        if "Gene Names" in dic and dic["Gene Names"]:
-            selected_genes = dic["Gene Names"]
-            gene_names_filter = pd.Series([False] * len(df_uniprot))
-            
-            # For each row in the data
-            for i, gene_group in enumerate(df_uniprot["Gene Names"]):
-                if pd.notna(gene_group):
-                    # Convert to string in case it's not already
-                    gene_string = str(gene_group).upper()
-                    # Check if any selected gene is in this entry's gene group
-                    if any(gene.upper() in gene_string for gene in selected_genes):
-                        gene_names_filter.iloc[i] = True
-        
-        # Handle sequence search separately
-        sequence_filter = None
-        if "Sequence" in dic and dic["Sequence"]:
-            sequence_query = dic["Sequence"].upper()
-            sequence_filter = pd.Series([False] * len(df_uniprot))
-            
-            # For each row in the data
-            for i, sequence in enumerate(df_uniprot["Sequence"]):
-                if pd.notna(sequence):
-                    # Convert to string and clean up whitespace
-                    sequence_str = str(sequence).upper().replace(" ", "")
-                    # Check if the query is in this sequence
-                    if sequence_query in sequence_str:
-                        sequence_filter.iloc[i] = True
-        
-        # Process all other filters normally
-        for field in dic.keys():
-            # Skip Gene Names and Sequence as we're handling them separately
-            if field == "Gene Names" or field == "Sequence":
-                continue
-                
-            if isinstance(dic[field], tuple):
-                request &= (df_uniprot[field] >= dic[field][0]) & (df_uniprot[field] <= dic[field][1])
-            else:
-                request_or = pd.Series([False] * len(df_uniprot))
-                if len(dic[field])!=0:
-                    for value in dic[field]:
-                        request_or |= (df_uniprot[field] == value)
-                    request &= request_or
-        
-        # Combine the special filters with other filters if they exist
-        if gene_names_filter is not None:
-            request &= gene_names_filter
-            
-        if sequence_filter is not None:
-            request &= sequence_filter
+    if dataset is None:
+        dataset = get_dataset()
+    if use_sql_store(dataset):
+        return sql_store.filter_results_uniprot(dic, dataset)
+    return filter_rows_uniprot(dic, dataset).tolist()
+
+def filter_rows_uniprot(dic, dataset, candidates=None):
+    """
+    Evaluate the filters of filter_results_uniprot and return the rows kept as an array.
+    With candidates (rows kept by a broader query), only those rows are tested.
+    """
+    # Only range filters read their column, the other filters use indexes
+    df_uniprot = dataset.table("uniprot", [field for field in dic if isinstance(dic[field], tuple)
+                                           and field not in descriptor_fields])
+    n_rows = len(df_uniprot)
+    # Rows kept so far: packed bitmap over the table, or the surviving candidates
+    selection = RowSelection(n_rows, candidates)
+    
+    # Handle gene names separately
+    if "Gene Names" in dic and dic["Gene Names"]:
+        # Exact symbol lookups in the gene index ("GPR*" for a prefix)
+        selection.keep_mask(get_gene_index(dataset).rows(dic["Gene Names"]))
+    
+    # Handle sequence search separately
+    if "Sequence" in dic and dic["Sequence"]:
+        # Motif lookup in the k-mer index of all sequences
+        selection.keep_mask(get_sequence_index(dataset).rows(dic["Sequence"]))
+    
+    # Handle PROSITE motifs separately (one scan for all the patterns)
+    if "Motifs" in dic and dic["Motifs"]:
+        sequence_index = get_sequence_index(dataset)
+        motif_search = get_motif_search(dic["Motifs"])
+        if candidates is None:
+            selection.keep_mask(motif_search.rows(sequence_index))
+        else:
+            # Few candidates left: scan their sequences only
+            selection.keep_among(lambda rows: motif_search.rows_among(sequence_index, rows))
+    
+    # Handle similarity search separately (top-k entries by alignment score)
+    if "Similar to" in dic and dic["Similar to"] and dic["Similar to"].get("query"):
+        options = dic["Similar to"]
+        hits = search_similar_uniprot(options["query"],
+                                      top_k=options.get("top_k", 10),
+                                      method=options.get("method", "ungapped"),
+                                      processes=options.get("processes"),
+                                      dataset=dataset)
+        selection.keep_among(lambda rows: np.isin(rows, [hit["row"] for hit in hits]))
+    
+    # Handle attribute presence with the precomputed flags
+    if "Presence" in dic and dic["Presence"]:
+        presence_bitmaps = get_presence_flags(dataset).bitmaps
+        for flag in dic["Presence"]:
+            selection.keep_bitmap(presence_bitmaps[flag])
+    
+    # Handle clades with the nested-set numbers of the taxonomy tree
+    if "Clade" in dic and dic["Clade"]:
+        selection.keep_mask(get_taxonomy(dataset).rows(dic["Clade"]))
+    
+    # Handle sequence features with the interval index of the feature columns
+    if "Feature" in dic and dic["Feature"]:
+        selection.keep_mask(get_feature_index(dataset).rows_with(n_rows, **dic["Feature"]))
+    
+    # Handle full-text search with the inverted index of the narrative columns
+    if "Text" in dic and dic["Text"] and dic["Text"].strip():
+        selection.keep_mask(get_text_index(dataset, "uniprot").rows(dic["Text"]))
+    
+    # Process all other filters normally
+    for field in dic.keys():
+        # Skip Gene Names, Sequence and the special filters as we're handling them separately
+        if field in ["Gene Names", "Sequence"] + list_special_filters_uniprot:
+            continue
             
-        filtered_df = df_uniprot.loc[request]
-        return filtered_df.index.tolist()
+        if field in descriptor_fields:
+            # Descriptors computed once per dataset version (NaN without sequence, never kept)
+            min_val, max_val = dic[field]
+            selection.keep_where(get_descriptors(dataset).values[field],
+                                 lambda values: (values >= min_val) & (values <= max_val))
+        elif isinstance(dic[field], tuple):
+            min_val, max_val = dic[field]
+            selection.keep_where(df_uniprot[field], lambda values: (values >= min_val) & (values <= max_val))
+        elif len(dic[field])!=0:
+            # Union of the precomputed bitmaps of the selected values
+            selection.keep_values(get_bitmap_index(dataset, "uniprot", field), dic[field])
+    
+    return selection.rows()
+
+def refine_results_uniprot(dic, session, dataset=None):
+    """
+    Same result as filter_results_uniprot, for an interactive session that narrows its query
+    step by step: the last filters and their result are kept in session (a dict, e.g.
+    st.session_state), and when the new filters are narrower only the previous rows are tested.
+    Relaxed or unrelated filters are evaluated over the whole table. With the SQLite backend
+    every query goes to the store (its full-text matching differs from the in-memory index).
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    version = dataset.refresh()
+    previous = session.get("uniprot_refinement")
+    if use_sql_store(dataset):
+        previous = None
+    if previous is not None and previous["dataset"] == (dataset.uid, version) \
+            and is_narrower(dic, previous["filters"], uniprot_refinement_rules):
+        if dic == previous["filters"]:
+            rows = previous["rows"]
+        else:
+            # The previous rows already satisfy the unchanged filters, test the others only
+            changed = {field: value for field, value in dic.items()
+                       if field not in previous["filters"] or previous["filters"][field] != value}
+            rows = filter_rows_uniprot(changed, dataset, candidates=previous["rows"])
+    else:
+        rows = np.asarray(filter_results_uniprot(dic, dataset=dataset), dtype=np.int64)
+    session["uniprot_refinement"] = {"dataset": (dataset.uid, version),
+                                     "filters": copy.deepcopy(dic), "rows": rows}
+    return rows.tolist()
+
 
+@cached_query
+def get_facet_counts_uniprot(dic, dataset=None):
+    """
+    Return a dictionary field -> {value: number of rows} for the fields of facet_fields_uniprot,
+    counted over the rows kept by the filters of dic (see facets.facet_counts)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    facets = {field: get_gene_index(dataset) if field == "Gene Names"
+              else get_bitmap_index(dataset, "uniprot", field)
+              for field in facet_fields_uniprot}
+    if use_sql_store(dataset):
+        # Same backend as the result list
+        return facet_counts(dic, facets, lambda filters: np.asarray(
+            sql_store.filter_results_uniprot(filters, dataset), dtype=np.int64))
+    return facet_counts(dic, facets, lambda filters: filter_rows_uniprot(filters, dataset))
 
-def get_values_for_rows_uniprot(list_index, list_fields):#Renvoie un dictionnaire où les clés sont les attributs de list_fields
+@cached_query
+def get_values_for_rows_uniprot(list_index, list_fields, dataset=None):#Renvoie un dictionnaire où les clés sont les attributs de list_fields
     #et où les valeurs sont des listes où chaque élément correspond à la valeur de l'attribut pour une ligne 
+    if dataset is None:
+        dataset = get_dataset()
+    df_uniprot = dataset.table("uniprot", list_fields)
+
     dic = {}
     for field in list_fields:
         dic[field] = df_uniprot.loc[list_index,field].tolist()
     return dic
 
-def extract_filters_drugbank():
+def get_annotations_uniprot(name, row, dataset=None):
+    """
+    Return the items parsed at ingest from an annotation column of a UniProt row, as a DataFrame.
+    name is "mutagenesis", "function", "disease" or "tissue" (see annotations.annotation_columns).
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return get_annotation_table(dataset, name).for_row(row)
+
+def get_feature_types_uniprot(dataset=None):
+    """
+    Return the feature keywords found in the UniProt table (TRANSMEM, CARBOHYD...), sorted
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return sorted(set(get_feature_index(dataset).types.tolist()))
+
+def get_features_uniprot(row, start=None, end=None, dataset=None):
+    """
+    Return the sequence features of a UniProt row (type, start, end, note, evidence, pubmed),
+    as a DataFrame sorted by position. With start and end, only the features overlapping
+    those residues (1-based, inclusive).
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    index = get_feature_index(dataset)
+    if start is None and end is None:
+        return index.for_row(row)
+    return index.overlapping(row, start if start is not None else 1, end if end is not None else np.inf)
+
+def get_feature_track_uniprot(row, dataset=None):
+    """
+    Return the per-residue track of the features of a UniProt row: DataFrame indexed by residue
+    (1 to the sequence length) with one 0/1 column per feature type
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    length = dataset.table("uniprot", ["Length"]).loc[row, "Length"]
+    return get_feature_index(dataset).track(row, int(length))
+
+def get_descriptors_uniprot(row, dataset=None):
+    """
+    Return the physicochemical descriptors of a UniProt row (dictionary name -> value, see
+    descriptors.descriptor_fields) and its amino-acid composition (Series residue -> %)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return get_descriptors(dataset).for_row(row)
+
+def get_hydropathy_uniprot(row, dataset=None):
+    """
+    Return the precomputed Kyte-Doolittle profile of a UniProt row as a dictionary with
+    "Residue" (centre of each window), "Hydropathy" (float16 values) and "Segments"
+    (candidate transmembrane segments, list of (start, end) residues)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    profiles = get_hydropathy_profiles(dataset)
+    entry = str(dataset.table("uniprot", ["Entry"]).loc[row, "Entry"])
+    residues, values = profiles.profile(entry)
+    return {"Residue": residues, "Hydropathy": values, "Segments": profiles.segments(entry)}
+
+def get_closest_uniprot(row, top_k=10, refine=None, dataset=None):
+    """
+    Return the top_k entries closest to a UniProt row by k-mer Jaccard index (precomputed
+    neighbour matrix), as a dictionary of columns: "UniProt index", "Entry", "Entry Name",
+    "Organism" and "Jaccard". With refine ("ungapped" or "smith-waterman"), the entries are
+    aligned with the row and ranked by their "Alignment score". None if the neighbour matrix
+    is not built (see neighbours.get_neighbour_matrix).
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    matrix = get_neighbour_matrix(dataset)
+    if matrix is None:
+        return None
+    rows, scores = matrix.closest(row, top_k)
+    df_uniprot = dataset.table("uniprot", ["Entry", "Entry Name", "Organism"])
+    closest = {
+        "UniProt index": rows.tolist(),
+        "Entry": df_uniprot.loc[rows, "Entry"].tolist(),
+        "Entry Name": df_uniprot.loc[rows, "Entry Name"].tolist(),
+        "Organism": df_uniprot.loc[rows, "Organism"].tolist(),
+        "Jaccard": [round(float(score), 3) for score in scores],
+    }
+    if refine is not None and len(rows):
+        sequence = get_sequence_index(dataset).sequences[row]
+        alignment = refine_neighbours(sequence, get_sequence_matrix(dataset).codes[rows], method=refine)
+        order = np.argsort(-alignment, kind="stable")
+        closest = {column: [values[i] for i in order] for column, values in closest.items()}
+        closest["Alignment score"] = alignment[order].tolist()
+    return closest
+
+def get_citations_pubmed(pubmed_id, dataset=None):
+    """
+    Return the UniProt annotations citing a PubMed ID (reverse index of citations), as a dictionary
+    of columns: "UniProt index", "Entry", "Field", "Evidence" (ECO code) and "Context"
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    citations = get_pubmed_index(dataset).cited_by(pubmed_id)
+    df_uniprot = dataset.table("uniprot", ["Entry"])
+    return {
+        "UniProt index": citations["row"].tolist(),
+        "Entry": df_uniprot.loc[citations["row"], "Entry"].tolist(),
+        "Field": citations["field"].tolist(),
+        "Evidence": citations["evidence"].tolist(),
+        "Context": citations["context"].tolist(),
+    }
+
+def get_citations_uniprot(row, dataset=None):
+    """
+    Return a dictionary PubMed ID -> list of the fields of a UniProt row citing it
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    citations = get_pubmed_index(dataset).cited_in(row)
+    fields = {}
+    for pubmed, field in zip(citations["pubmed"].tolist(), citations["field"].tolist()):
+        fields.setdefault(pubmed, [])
+        if field not in fields[pubmed]:
+            fields[pubmed].append(field)
+    return fields
+
+def get_citation_counts_uniprot(list_index, dataset=None):
+    """
+    Return the number of distinct PubMed IDs cited by each UniProt row of list_index
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return get_pubmed_index(dataset).counts[list(list_index)].tolist()
+
+def get_sequence_hits_uniprot(sequence_query, list_index, dataset=None):
+    """
+    Return a dictionary row -> list of 0-based offsets where sequence_query occurs
+    in the sequence of that row, restricted to the rows of list_index
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    hits = get_sequence_index(dataset).search(sequence_query)
+    return {index: hits[index] for index in list_index if index in hits}
+
+def get_motif_hits_uniprot(patterns, list_index, dataset=None):
+    """
+    Return a dictionary pattern -> {row: [(start, end), ...]} with the 0-based spans of each
+    PROSITE pattern in the sequences, restricted to the rows of list_index
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    hits = get_motif_search(patterns).search(get_sequence_index(dataset))
+    rows = set(list_index)
+    return {pattern: {row: spans for row, spans in pattern_hits.items() if row in rows}
+            for pattern, pattern_hits in hits.items()}
+
+@lru_cache(maxsize=32)
+def _search_similar_uniprot(dataset, version, query, top_k, method, processes):
+    return get_similarity_hits(dataset, query, top_k=top_k, method=method, processes=processes)
+
+def search_similar_uniprot(query, top_k=10, method="ungapped", processes=None, dataset=None):
+    """
+    Return the top_k entries most similar to a peptide (BLOSUM62 local alignment), best first.
+    Each hit is a dictionary with the row, the score and the aligned regions.
+    The sequences are scored by processes worker processes (similarity_search.PROCESSES if None).
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    if processes is None:
+        processes = SIMILARITY_PROCESSES
+    return _search_similar_uniprot(dataset, dataset.version, query, top_k, method, processes)
+
+@cached_query
+def search_text(table, query, dataset=None):
+    """
+    Return the rows of a table ("uniprot" or "drugbank") matching a full-text query,
+    best BM25 score first (see text_index)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    if use_sql_store(dataset):
+        return sql_store.search_text(table, query, dataset)
+    return get_text_index(dataset, table).search(query)[0].tolist()
+
+def get_text_snippets(table, query, list_index, dataset=None):
+    """
+    Return a dictionary row -> Markdown extract of the narrative columns around the words of
+    the query (see text_index.snippet), for the rows of list_index having a match
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    fields = text_fields[table]
+    df = dataset.table(table, list(fields.values()))
+    snippets = {}
+    for row in list_index:
+        extract = snippet(query, {field: df.at[row, column] for field, column in fields.items()})
+        if extract is not None:
+            snippets[row] = extract
+    return snippets
+
+def extract_filters_drugbank(dataset=None):
+    if dataset is None:
+        dataset = get_dataset()
+    df_drugbank = dataset.table("drugbank", list_field_drugbank)
+
     # Get your original filters first
     filters = {column:df_drugbank[column].unique().tolist() for column in list_field_drugbank}
     
-    # Convert numeric fields to proper numbers
-    for key in ["Absorption", "Protein Binding", "Molecular Weight"]:
-        if key in filters:
-            numeric_values = []
-            for value in filters[key]:
-                if pd.notna(value):
-                    if key in ["Absorption", "Protein Binding"]:
-                        # Extract percentages using regex
-                        import re
-                        matches = re.findall(r'(\d+(?:\.\d+)?)%', str(value))
-                        if matches:
-                            numeric_values.extend([float(match) for match in matches])
-                    else:  # Molecular Weight
-                        try:
-                            # Try to convert to float directly
-                            numeric_values.append(float(value))
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Replace the original values with numeric ones
-            if numeric_values:
-                filters[key] = numeric_values
-            else:
-                # If no numeric values were found, provide defaults
-                if key in ["Absorption", "Protein Binding"]:
-                    filters[key] = [0.0, 100.0]  # Default percentage range
-                else:  # Molecular Weight
-                    filters[key] = [100.0, 1000.0]  # Default weight range
+    # Numeric fields: [min, max] of the values parsed at ingest
+    default_ranges = {"Absorption": [0.0, 100.0],       # Default percentage range
+                      "Protein Binding": [0.0, 100.0],
+                      "Half Life": [0.0, 100.0],         # Default half-life range (hours)
+                      "Molecular Weight": [100.0, 1000.0]}  # Default weight range
+    for key in numeric_ranges_drugbank:
+        bounds = get_range_index(dataset, key).bounds()
+        filters[key] = list(bounds) if bounds is not None else default_ranges[key]
     
     return filters
 
 def get_attribute_values_drugbank(data,field): #Renvoie la liste des valeurs pour un attribut donné
     return data.get(field)
 
-def filter_results_drugbank(dic):
+@cached_query
+def filter_results_drugbank(dic, dataset=None):
     '''dic contient les fields en clés et les valeurs sont des listes de valeurs correspondant 
     à union des field=value
     On renvoie une liste d'indices (ligne 2 du csv correspond à 0)'''
+    if dataset is None:
+        dataset = get_dataset()
+    if use_sql_store(dataset):
+        return sql_store.filter_results_drugbank(dic, dataset)
+    # Only range filters on plain columns read them, the other filters use indexes
+    df_drugbank = dataset.table("drugbank", [field for field in dic if isinstance(dic[field], tuple)
+                                             and field not in numeric_ranges_drugbank])
+    n_rows = len(df_drugbank)
+
     if len(dic.keys())==0:
         return df_drugbank.index.tolist()
     else:
-        request=pd.Series([True] * len(df_drugbank))
+        # Packed bitmap of the rows kept so far (one bit per row)
+        request = all_rows(n_rows)
         
         # Process all filters
         for field in dic.keys():
             # Skip empty filters
             if not dic[field]:
                 continue
+            
+            # Full-text search with the inverted index of the narrative columns
+            if field == "Text":
+                request &= pack_mask(get_text_index(dataset, "drugbank").rows(dic[field]))
+                continue
                 
             if isinstance(dic[field], tuple):
                 min_val, max_val = dic[field]
                 
-                # Handle special fields with percentage extraction
-                if field in ["Absorption", "Protein Binding"]:
-                    field_request = pd.Series([False] * len(df_drugbank))
+                # Fields parsed into numeric intervals at ingest (percentages, hours, Da):
+                # rows whose interval overlaps the range, found with binary searches
+                if field in numeric_ranges_drugbank:
+                    request &= pack_mask(get_range_index(dataset, field).overlapping(min_val, max_val))
                     
-                    for i, value in enumerate(df_drugbank[field]):
-                        if pd.notna(value):
-                            # Extract percentages using regex
-                            import re
-                            matches = re.findall(r'(\d+(?:\.\d+)?)%', str(value))
-                            if matches:
-                                percentages = [float(match) for match in matches]
-                                # If any percentage is in range, include this entry
-                                if any(min_val <= p <= max_val for p in percentages):
-                                    field_request.iloc[i] = True
-                    
-                    request &= field_request
-                    
-                # Handle normal numeric fields like Molecular Weight
+                # Handle other numeric fields
                 else:
                     # Convert column to numeric, forcing non-convertible values to NaN
                     numeric_values = pd.to_numeric(df_drugbank[field], errors='coerce')
@@ -260,30 +561,79 @@ def filter_results_drugbank(dic):
                     valid_rows = (numeric_values >= min_val) & (numeric_values <= max_val)
                     # Fill NaN values with False in the mask
                     valid_rows = valid_rows.fillna(False)
-                    request &= valid_rows
+                    request &= pack_mask(valid_rows)
             else:
-                request_or = pd.Series([False] * len(df_drugbank))
-                for value in dic[field]:
-                    request_or |= (df_drugbank[field] == value)
-                request &= request_or
+                # Union of the precomputed bitmaps of the selected values
+                request &= get_bitmap_index(dataset, "drugbank", field).bitmap(dic[field])
         
-        filtered_df = df_drugbank.loc[request]
-        return filtered_df.index.tolist()
+        return bitmap_rows(request, n_rows).tolist()
+
+@cached_query
+def get_facet_counts_drugbank(dic, dataset=None):
+    """
+    Return a dictionary field -> {value: number of drugs} for the fields of facet_fields_drugbank,
+    counted over the drugs kept by the filters of dic (see facets.facet_counts)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    facets = {field: get_bitmap_index(dataset, "drugbank", field) for field in facet_fields_drugbank}
+    return facet_counts(dic, facets, lambda filters: filter_results_drugbank(filters, dataset=dataset))
 
-def get_values_for_rows_drugbank(list_index_uniprot,list_index,list_fields):#Renvoie un dictionnaire où les clés sont les attributs de list_fields
-    #et où les valeurs sont des listes où chaque élément correspond à la valeur de l'attribut pour une ligne
+@cached_query
+def get_values_for_rows_drugbank(list_index_uniprot,list_index,list_fields,dataset=None):
+    """
+    Return the drugs linked to the UniProt rows of list_index_uniprot and kept by the DrugBank
+    filter (list_index, from filter_results_drugbank), as a dictionary of columns:
+    "UniProt index" and "DrugBank index" give the pair of rows, then one list per field of list_fields.
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    links = get_drug_links(dataset)
+    df_drugbank = dataset.table("drugbank", list(list_fields))
+    drugbank_rows = set(list_index)
 
-    if 9 not in list_index_uniprot and 10 not in list_index_uniprot and 12 not in list_index_uniprot:
-        return []
-    else:
+    dic = {"UniProt index": [], "DrugBank index": []}
+    for uniprot_row in sorted(set(list_index_uniprot)):
+        for drugbank_row in links.drugs_for_protein(uniprot_row):
+            if drugbank_row in drugbank_rows:
+                dic["UniProt index"].append(uniprot_row)
+                dic["DrugBank index"].append(drugbank_row)
+    for field in list_fields:
+        dic[field] = df_drugbank.loc[dic["DrugBank index"], field].tolist()
+    return dic
 
-        list_index_drugbank_uniprot = get_uniprot_drugbank()
-        list_dic = []
-        for list_index_drugbank in list_index_drugbank_uniprot:
-            dic = {}
-            for field in list_fields:
-                dic[field] = df_drugbank.loc[list(set(list_index_drugbank)&set(list_index)),field].tolist()
-                list_dic.append(dic)
-        return list_dic
-    
-print(filter_results_drugbank({'DrugBank ID': ['DB01193'], 'Name': [], 'Type': [], 'Groups': [], 'Synonyms': [], 'Chemical Formula': [], 'IUPAC Name': [], 'CAS Number': [], 'InChIKey': [], 'UNII': [], 'Food Interactions': [], 'Affected Organisms': [], 'Patents': [], 'Spectra': []}))
\ No newline at end of file
+def get_proteins_drugbank(drugbank_row, dataset=None):
+    """
+    Return the UniProt entries linked to a DrugBank row (targets of the drug), as a dictionary
+    of columns: "UniProt index", "Entry", "Entry Name" and "Organism"
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    rows = get_drug_links(dataset).proteins_for_drug(drugbank_row)
+    df_uniprot = dataset.table("uniprot", ["Entry", "Entry Name", "Organism"])
+    return {
+        "UniProt index": list(rows),
+        "Entry": df_uniprot.loc[rows, "Entry"].tolist(),
+        "Entry Name": df_uniprot.loc[rows, "Entry Name"].tolist(),
+        "Organism": df_uniprot.loc[rows, "Organism"].tolist(),
+    }
+
+@cached_query
+def filter_results_chembl(dic, dataset=None):
+    """
+    Return the ChEMBL IDs (targets of chembl_ref.csv and GPER compounds) kept by the filters of dic:
+    "Type" (target or molecule type) and the members of the bioactivity data of an entry
+    (e.g. "organism", "activity_count"), as lists of values or (min, max) ranges
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return sql_store.filter_results_chembl(dic, dataset)
+
+@cached_query
+def get_values_for_rows_chembl(list_chembl_ids, dataset=None):
+    """
+    Return a dictionary of columns for the ChEMBL IDs of list_chembl_ids (see sql_store.get_values_for_rows_chembl)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    return sql_store.get_values_for_rows_chembl(list_chembl_ids, dataset)
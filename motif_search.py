@@ -0,0 +1,144 @@
+import re
+from functools import lru_cache
+import numpy as np
+
+# Residue letters found in sequences, wildcards and exclusions never match the separator
+RESIDUES = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Conserved GPCR motifs, as PROSITE patterns
+gpcr_motifs = {
+    "DRY": "[DE]-R-Y",
+    "NPxxY": "N-P-x(2)-Y",
+    "CWxP": "C-W-x-P",
+}
+
+# One pattern element and its optional repetition, e.g. "x(2,4)" or "[ST]"
+_element = re.compile(r"(\[[^\]]*\]|\{[^}]*\}|[A-Za-z<>])(?:\((\d+)(?:,(\d+))?\))?")
+
+def compile_prosite(pattern):
+    """
+    Convert a PROSITE pattern into a regular expression string.
+    Accepts the dashed syntax ("N-P-x(2)-Y", "[DE]-R-Y", "<M-{P}") and the compact
+    form ("NPxxY"), where x is any residue, [..] any of, {..} none of, < and > the
+    N- and C-terminus.
+    """
+    compact = pattern.strip().rstrip(".").replace("-", "").replace(" ", "")
+    if not compact:
+        raise ValueError("Empty PROSITE pattern")
+
+    regex = []
+    pos = 0
+    while pos < len(compact):
+        match = _element.match(compact, pos)
+        if match is None:
+            raise ValueError(f"Invalid PROSITE pattern '{pattern}' near '{compact[pos:]}'")
+        pos = match.end()
+        element, low, high = match.groups()
+
+        if element == "<":
+            part = f"(?<![{RESIDUES}])"
+        elif element == ">":
+            part = f"(?![{RESIDUES}])"
+        elif element in ("x", "X"):
+            part = f"[{RESIDUES}]"
+        elif element.startswith("["):
+            letters = element[1:-1].upper()
+            residues = letters.replace(">", "")
+            if not residues.isalpha():
+                raise ValueError(f"Invalid residue class '{element}' in '{pattern}'")
+            part = f"[{residues}]"
+            if ">" in letters:
+                # e.g. [G>]: G or the C-terminus
+                part = f"(?:{part}|(?![{RESIDUES}]))"
+        elif element.startswith("{"):
+            excluded = element[1:-1].upper()
+            if not excluded.isalpha():
+                raise ValueError(f"Invalid residue class '{element}' in '{pattern}'")
+            part = "[" + "".join(r for r in RESIDUES if r not in excluded) + "]"
+        else:
+            part = element.upper()
+
+        if low is not None:
+            if element in ("<", ">"):
+                raise ValueError(f"Terminus '{element}' cannot be repeated in '{pattern}'")
+            part += f"{{{low},{high}}}" if high is not None else f"{{{low}}}"
+        regex.append(part)
+    return "".join(regex)
+
+class MotifSearch:
+    """
+    Several PROSITE patterns compiled into one regular expression, so that the
+    concatenated sequences are scanned once whatever the number of motifs
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(p.strip() for p in patterns if p.strip()))
+        self.regexes = [re.compile(compile_prosite(p)) for p in self.patterns]
+        alternatives = "|".join(f"(?P<m{i}>{regex.pattern})" for i, regex in enumerate(self.regexes))
+        # Zero-width match at every position where one of the motifs starts (overlaps included)
+        self.combined = re.compile(f"(?=(?:{alternatives}))")
+
+    def scan(self, text):
+        """
+        Return, for each pattern, the list of (start, end) spans of its occurrences in text
+        """
+        spans = [[] for _ in self.patterns]
+        if not self.patterns:
+            return spans
+        for match in self.combined.finditer(text):
+            start = match.start()
+            # The alternation reports the first motif matching here, check the following ones
+            first = int(match.lastgroup[1:])
+            spans[first].append(match.span(match.lastgroup))
+            for i in range(first + 1, len(self.regexes)):
+                other = self.regexes[i].match(text, start)
+                if other is not None:
+                    spans[i].append(other.span())
+        return spans
+
+    def search(self, sequence_index):
+        """
+        Return a dictionary pattern -> {row: [(start, end), ...]} with 0-based offsets
+        in the sequences of a SequenceIndex
+        """
+        result = {}
+        for pattern, spans in zip(self.patterns, self.scan(sequence_index.text)):
+            hits = {}
+            if spans:
+                starts = np.array([start for start, _ in spans], dtype=np.int64)
+                lengths = np.array([end - start for start, end in spans], dtype=np.int64)
+                rows, offsets = sequence_index.locate(starts)
+                for row, offset, length in zip(rows.tolist(), offsets.tolist(), lengths.tolist()):
+                    hits.setdefault(row, []).append((offset, offset + length))
+            result[pattern] = hits
+        return result
+
+    def rows(self, sequence_index):
+        """
+        Return a boolean array over the rows, True where the sequence contains every pattern
+        """
+        mask = np.ones(sequence_index.n_rows, dtype=bool)
+        for hits in self.search(sequence_index).values():
+            pattern_mask = np.zeros(sequence_index.n_rows, dtype=bool)
+            pattern_mask[list(hits)] = True
+            mask &= pattern_mask
+        return mask
+
+    def rows_among(self, sequence_index, rows):
+        """
+        Return a boolean array over the given rows, True where the sequence contains every
+        pattern. Only the sequences of these rows are scanned.
+        """
+        sequences = sequence_index.sequences
+        return np.array([all(regex.search(sequences[row]) for regex in self.regexes) for row in rows],
+                        dtype=bool)
+
+@lru_cache(maxsize=64)
+def _motif_search(patterns):
+    return MotifSearch(patterns)
+
+def get_motif_search(patterns):
+    """
+    Return the compiled MotifSearch for a list of patterns (compiled once per list)
+    """
+    return _motif_search(tuple(patterns))
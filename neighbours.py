@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sequence_matrix import get_sequence_matrix
+from sequence_index import get_sequence_index
+from similarity_search import score_all
+from text_index import table_stamp
+
+# Length of the k-mers compared (over the 20 standard residues)
+KMER_SIZE = 3
+N_KMERS = 20 ** KMER_SIZE
+
+# Closest entries kept for every entry
+NEIGHBOURS = 50
+
+# Neighbour matrix (rows x NEIGHBOURS, memory-mapped) and what it was computed from
+# (stamp of the files, entries and sequence hashes), next to the columnar copies
+NEIGHBOURS_PATH = "uniprot_neighbours.npy"
+NEIGHBOURS_META_PATH = "uniprot_neighbours_meta.npz"
+
+# Above this number of new or changed sequences, every row is recomputed
+INCREMENTAL_LIMIT = 250
+
+# Rows handled by one task of the process pool
+CHUNK_ROWS = 256
+
+# Worker processes of a build (GPER_NEIGHBOUR_PROCESSES, one per core by default), at most MAX_PROCESSES
+MAX_PROCESSES = 8
+PROCESSES = min(int(os.environ.get("GPER_NEIGHBOUR_PROCESSES", os.cpu_count() or 1)), MAX_PROCESSES)
+
+# Row and score of a neighbour, row -1 for unused slots
+neighbour_dtype = np.dtype([("row", np.int32), ("score", np.float32)])
+
+def sequence_hashes(sequences):
+    """
+    64-bit hash of every sequence, to find the sequences changed between two versions of the table
+    """
+    return np.array([int.from_bytes(hashlib.blake2b(sequence.encode("ascii", errors="replace"),
+                                                    digest_size=8).digest(), "little")
+                     for sequence in sequences], dtype=np.uint64)
+
+class KmerSets:
+    """
+    Set of the k-mers of every sequence, stored both ways: k-mers of a row and rows of a k-mer
+    (CSR arrays), so that the shared k-mers of one row with all the others are counted with
+    one bincount over the postings of its k-mers
+    """
+
+    def __init__(self, codes):
+        self.n_rows = len(codes)
+        width = codes.shape[1] - KMER_SIZE + 1 if codes.ndim == 2 else 0
+        if width <= 0:
+            codes = np.zeros((self.n_rows, KMER_SIZE), dtype=np.int8) + 20
+            width = 1
+        ids = np.zeros((self.n_rows, width), dtype=np.int64)
+        valid = np.ones((self.n_rows, width), dtype=bool)
+        for j in range(KMER_SIZE):
+            window = codes[:, j:j + width].astype(np.int64)
+            ids = ids * 20 + window
+            # K-mers with an ambiguous residue or the padding are left out
+            valid &= window < 20
+        rows, _ = np.nonzero(valid)
+        keys = np.unique(rows * N_KMERS + ids[valid])
+        rows, kmers = keys // N_KMERS, keys % N_KMERS
+
+        self.row_pointers = np.searchsorted(rows, np.arange(self.n_rows + 1)).astype(np.int64)
+        self.row_kmers = kmers.astype(np.int32)
+        self.sizes = np.diff(self.row_pointers)
+        order = np.argsort(kmers, kind="stable")
+        self.kmer_pointers = np.concatenate([[0], np.cumsum(np.bincount(kmers, minlength=N_KMERS))]).astype(np.int64)
+        self.kmer_rows = rows[order].astype(np.int32)
+
+    def jaccard(self, row):
+        """
+        Jaccard index of the k-mer set of a row with that of every row (-1 for the row itself)
+        """
+        kmers = self.row_kmers[self.row_pointers[row]:self.row_pointers[row + 1]]
+        starts = self.kmer_pointers[kmers]
+        lengths = self.kmer_pointers[kmers + 1] - starts
+        # Positions of the postings of all its k-mers, concatenated
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        shared = np.bincount(self.kmer_rows[positions], minlength=self.n_rows)
+        union = self.sizes[row] + self.sizes - shared
+        scores = np.divide(shared, union, out=np.zeros(self.n_rows), where=union > 0).astype(np.float32)
+        scores[row] = -1
+        return scores
+
+def top_neighbours(scores, k=NEIGHBOURS):
+    """
+    The k best (row, score) of a score array, best first, as a neighbour_dtype array
+    (rows with a score of 0 or less are left out, unused slots have row -1)
+    """
+    neighbours = np.zeros(k, dtype=neighbour_dtype)
+    neighbours["row"] = -1
+    neighbours["score"] = -1
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        # Ties at the k-th score are broken by row, as in update_neighbours
+        threshold = -np.partition(-scores[candidates], k - 1)[k - 1]
+        above = candidates[scores[candidates] > threshold]
+        candidates = np.concatenate([above, candidates[scores[candidates] == threshold][:k - len(above)]])
+    candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+    neighbours["row"][:len(candidates)] = candidates
+    neighbours["score"][:len(candidates)] = scores[candidates]
+    return neighbours
+
+# K-mer sets used by the worker processes, set once per process
+_kmer_sets = None
+
+def _set_kmer_sets(kmer_sets):
+    global _kmer_sets
+    _kmer_sets = kmer_sets
+
+def _neighbour_chunk(args):
+    rows, keep_scores = args
+    neighbours = np.zeros((len(rows), NEIGHBOURS), dtype=neighbour_dtype)
+    scores = np.zeros((len(rows), _kmer_sets.n_rows), dtype=np.float32) if keep_scores else None
+    for i, row in enumerate(rows):
+        row_scores = _kmer_sets.jaccard(row)
+        neighbours[i] = top_neighbours(row_scores)
+        if keep_scores:
+            scores[i] = row_scores
+    return neighbours, scores
+
+def compute_neighbours(kmer_sets, rows, keep_scores=False, processes=None):
+    """
+    Closest entries of the given rows, as a (len(rows) x NEIGHBOURS) neighbour_dtype array,
+    and with keep_scores their scores with every row (len(rows) x n_rows)
+
+    Parameters:
+    - kmer_sets: KmerSets of all the sequences
+    - rows: rows to compute
+    - processes: number of worker processes for the chunks of rows (None to compute in this process)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    chunks = [(rows[start:start + CHUNK_ROWS], keep_scores) for start in range(0, len(rows), CHUNK_ROWS)]
+    if processes is not None and processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_set_kmer_sets,
+                                 initargs=(kmer_sets,)) as executor:
+            results = list(executor.map(_neighbour_chunk, chunks))
+    else:
+        _set_kmer_sets(kmer_sets)
+        results = [_neighbour_chunk(chunk) for chunk in chunks]
+    neighbours = np.concatenate([part for part, _ in results]) if results \
+        else np.zeros((0, NEIGHBOURS), dtype=neighbour_dtype)
+    scores = (np.concatenate([part for _, part in results]) if results
+              else np.zeros((0, kmer_sets.n_rows), dtype=np.float32)) if keep_scores else None
+    return neighbours, scores
+
+def update_neighbours(previous, previous_entries, previous_hashes, entries, hashes, kmer_sets, processes=None):
+    """
+    Neighbour matrix of the current rows from the one of a previous version of the table:
+    only the new or changed sequences (and the rows whose neighbours changed or disappeared)
+    are compared with every row, the other rows merge the scores of those with their list.
+    Return None when too many rows would be recomputed.
+    """
+    previous_rows = {entry: row for row, entry in enumerate(previous_entries.tolist())}
+    # Current row -> previous row of the same entry with the same sequence, -1 otherwise
+    mapping = np.array([previous_rows.get(entry, -1) for entry in entries.tolist()], dtype=np.int64)
+    mapping[mapping >= 0] = np.where(previous_hashes[mapping[mapping >= 0]] == hashes[mapping >= 0],
+                                     mapping[mapping >= 0], -1)
+    old_to_new = np.full(len(previous_entries), -1, dtype=np.int64)
+    old_to_new[mapping[mapping >= 0]] = np.flatnonzero(mapping >= 0)
+
+    # Unchanged rows, with their neighbours renumbered
+    kept = np.flatnonzero(mapping >= 0)
+    neighbours = np.zeros((len(entries), NEIGHBOURS), dtype=neighbour_dtype)
+    neighbours["row"] = -1
+    neighbours["score"] = -1
+    neighbours[kept] = previous[mapping[kept]]
+    used = neighbours["row"][kept] >= 0
+    renumbered = np.where(used, old_to_new[np.maximum(neighbours["row"][kept], 0)], -1)
+    # A neighbour that changed or disappeared may leave a better candidate out of the list
+    stale = (used & (renumbered < 0)).any(axis=1)
+    neighbours["row"][kept] = renumbered
+
+    changed = np.union1d(np.flatnonzero(mapping < 0), kept[stale])
+    if len(changed) > INCREMENTAL_LIMIT:
+        return None
+    computed, scores = compute_neighbours(kmer_sets, changed, keep_scores=True, processes=processes)
+    neighbours[changed] = computed
+
+    # Scores of the other rows with the recomputed ones (symmetric), merged with their list
+    others = np.setdiff1d(np.arange(len(entries)), changed)
+    if len(changed) and len(others):
+        # Recomputed rows already in a list come back with their new score
+        listed = neighbours["row"][others]
+        listed = np.where(np.isin(listed, changed), -1, listed)
+        candidates = np.concatenate([listed,
+                                     np.broadcast_to(changed, (len(others), len(changed)))], axis=1)
+        candidate_scores = np.concatenate([neighbours["score"][others],
+                                           scores[:, others].T], axis=1)
+        candidate_scores[candidates < 0] = -1
+        order = np.lexsort((candidates, -candidate_scores), axis=1)[:, :NEIGHBOURS]
+        best_rows = np.take_along_axis(candidates, order, axis=1)
+        best_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        neighbours["row"][others] = np.where(best_scores > 0, best_rows, -1)
+        neighbours["score"][others] = np.where(best_scores > 0, best_scores, -1)
+    return neighbours
+
+class NeighbourMatrix:
+    """
+    The NEIGHBOURS closest entries of every UniProt entry by k-mer Jaccard index, best first:
+    row i of the matrix holds (row, score) pairs, so a lookup reads k slots only
+    """
+
+    def __init__(self, neighbours, entries, hashes):
+        self.neighbours = neighbours
+        self.entries = entries
+        self.hashes = hashes
+
+    def save(self, path, meta_path, stamp):
+        """
+        Write the matrix (npy, memory-mapped when read back) and its metadata with the stamp of the files
+        """
+        for target, write in [(path, lambda f: np.save(f, np.asarray(self.neighbours))),
+                              (meta_path, lambda f: np.savez(f, entries=self.entries, hashes=self.hashes,
+                                                             stamp=np.asarray(json.dumps(stamp))))]:
+            with open(target + ".partial", "wb") as f:
+                write(f)
+        os.replace(path + ".partial", path)
+        os.replace(meta_path + ".partial", meta_path)
+
+    @classmethod
+    def load(cls, path, meta_path):
+        """
+        Read a matrix written by save, memory-mapped, and the stamp it was computed from.
+        Return (None, None) if the files are missing or do not match.
+        """
+        if not os.path.exists(path) or not os.path.exists(meta_path):
+            return None, None
+        with np.load(meta_path, allow_pickle=False) as arrays:
+            entries, hashes, stamp = arrays["entries"], arrays["hashes"], json.loads(str(arrays["stamp"]))
+        neighbours = np.load(path, mmap_mode="r")
+        if neighbours.dtype != neighbour_dtype or neighbours.shape != (len(entries), NEIGHBOURS):
+            return None, None
+        return cls(neighbours, entries, hashes), stamp
+
+    def closest(self, row, top_k=10):
+        """
+        Rows and Jaccard indices of the top_k closest entries of a row, best first
+        """
+        neighbours = np.asarray(self.neighbours[row, :top_k])
+        neighbours = neighbours[neighbours["row"] >= 0]
+        return neighbours["row"].astype(np.int64), neighbours["score"]
+
+def refine_neighbours(sequence, codes, method="smith-waterman"):
+    """
+    Local alignment scores (BLOSUM62) of a sequence against the encoded sequences of a few
+    neighbours (rows of the sequence matrix), to rank them by alignment (see similarity_search.score_all)
+    """
+    scores, _, _ = score_all(sequence, codes, method=method)
+    return scores
+
+def build_neighbour_matrix(dataset, processes=None):
+    """
+    Neighbour matrix of the dataset: read from NEIGHBOURS_PATH when it was computed from the
+    current files, updated from it for the changed sequences, otherwise computed for every row
+    """
+    stamp = table_stamp("uniprot") if dataset.sources is not None else None
+    previous, previous_stamp = NeighbourMatrix.load(NEIGHBOURS_PATH, NEIGHBOURS_META_PATH) \
+        if stamp is not None else (None, None)
+    if previous is not None and previous_stamp == json.loads(json.dumps(stamp)):
+        return previous
+
+    entries = np.asarray(dataset.table("uniprot", ["Entry"])["Entry"].astype(str), dtype=str)
+    hashes = sequence_hashes(get_sequence_index(dataset).sequences)
+    kmer_sets = KmerSets(get_sequence_matrix(dataset).codes)
+    neighbours = None
+    if previous is not None:
+        neighbours = update_neighbours(np.asarray(previous.neighbours), previous.entries, previous.hashes,
+                                       entries, hashes, kmer_sets, processes=processes)
+    if neighbours is None:
+        neighbours, _ = compute_neighbours(kmer_sets, np.arange(len(entries)), processes=processes)
+    matrix = NeighbourMatrix(neighbours, entries, hashes)
+    if stamp is not None:
+        matrix.save(NEIGHBOURS_PATH, NEIGHBOURS_META_PATH, stamp)
+        # Serve the memory-mapped copy
+        matrix, _ = NeighbourMatrix.load(NEIGHBOURS_PATH, NEIGHBOURS_META_PATH)
+    return matrix
+
+def read_neighbour_matrix(dataset):
+    """
+    Neighbour matrix saved at NEIGHBOURS_PATH, memory-mapped, None if it is missing or was
+    computed from other files
+    """
+    matrix, stamp = NeighbourMatrix.load(NEIGHBOURS_PATH, NEIGHBOURS_META_PATH)
+    if matrix is None or stamp != json.loads(json.dumps(table_stamp("uniprot"))):
+        return None
+    return matrix
+
+def get_neighbour_matrix(dataset):
+    """
+    Return the neighbour matrix of a dataset. For the data files, only the matrix built by
+    "python neighbours.py" (or the ingest of uniprot in data_store.py) is read, None until it is
+    built for the current files. Datasets given in memory compute it in this process.
+    """
+    if dataset.sources is None:
+        return dataset.derived("neighbours", build_neighbour_matrix)
+    if not os.path.exists(NEIGHBOURS_META_PATH):
+        return None
+    # Keyed by the time of the last build, so that a new build is read
+    return dataset.derived(("neighbours", os.path.getmtime(NEIGHBOURS_META_PATH)), read_neighbour_matrix)
+
+if __name__ == "__main__":
+    from dataset import get_dataset
+    print(f"Computing the neighbour matrix with {PROCESSES} process(es)")
+    matrix = build_neighbour_matrix(get_dataset(), processes=PROCESSES)
+    print(f"Wrote {NEIGHBOURS_PATH}: {len(matrix.entries)} entries")
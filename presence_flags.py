@@ -0,0 +1,53 @@
+import pandas as pd
+from bitmap_index import pack_mask
+
+# Presence flag -> UniProt column that must be filled
+presence_columns = {
+    "has_structure": "PDB",
+    "has_alphafold": "AlphaFoldDB",
+    "has_disease": "Involvement in disease",
+    "has_mutations": "Mutagenesis",
+    "has_function": "Function [CC]",
+    "has_location": "Subcellular location [CC]",
+    "has_tissue": "Tissue specificity",
+}
+
+def presence_flag_columns(df_uniprot):
+    """
+    Boolean columns telling which entries have a value for the columns of presence_columns.
+    Computed at ingest (chunk by chunk) and stored with the UniProt table, for the columns
+    present (an export read with a column projection gets the flags of its columns only).
+    """
+    flags = pd.DataFrame(index=df_uniprot.index)
+    for flag, column in presence_columns.items():
+        if column not in df_uniprot.columns:
+            continue
+        values = df_uniprot[column]
+        flags[flag] = values.notna() & (values.astype(str).str.strip() != "")
+    return flags
+
+class PresenceFlags:
+    """
+    Presence flags of the UniProt entries (see presence_flag_columns), with their packed
+    bitmaps for the filters
+    """
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.bitmaps = {flag: pack_mask(self.flags[flag]) for flag in presence_columns}
+
+def build_presence_flags(dataset):
+    # Flags stored at ingest, the others computed from their column when it is loaded
+    # (a projected export or a dataset given in memory may have neither: never present)
+    available = set(dataset.columns("uniprot"))
+    stored = [flag for flag in presence_columns if flag in available]
+    sources = [column for flag, column in presence_columns.items() if flag not in available and column in available]
+    df_uniprot = dataset.table("uniprot", stored + sources)
+    flags = pd.concat([df_uniprot[stored], presence_flag_columns(df_uniprot[sources])], axis=1)
+    return PresenceFlags(flags.reindex(columns=list(presence_columns), fill_value=False).astype(bool))
+
+def get_presence_flags(dataset):
+    """
+    Return the presence flags of a dataset, read on first use
+    """
+    return dataset.derived("presence_flags", build_presence_flags)
@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import inspect
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from dataset import get_dataset
+
+# Memory budget of the query cache shared by the filter and projection functions
+QUERY_CACHE_BYTES = 64 * 1024 * 1024
+
+# Items measured in a list before extrapolating to its full length
+_SIZE_SAMPLE = 64
+
+def rows_key(array):
+    """
+    Row lists: digest of the integers instead of one tuple item per row
+    """
+    return ("rows", len(array), hashlib.blake2b(array.astype(np.int64).tobytes(), digest_size=16).digest())
+
+def canonical(value):
+    """
+    Hashable, order-stable form of a filter argument (dict keys are sorted, numpy scalars
+    become Python numbers). Lists and tuples stay distinct since tuples are ranges.
+    """
+    if isinstance(value, dict):
+        return ("dict",) + tuple(sorted((str(key), canonical(item)) for key, item in value.items()))
+    if isinstance(value, tuple):
+        return ("tuple",) + tuple(canonical(item) for item in value)
+    if isinstance(value, (np.ndarray, pd.Index, pd.Series)):
+        array = np.asarray(value)
+        if array.ndim == 1 and array.dtype.kind in "iu":
+            return rows_key(array)
+        return ("list",) + tuple(canonical(item) for item in value)
+    if isinstance(value, list):
+        # Not converted with np.asarray: ragged or nested lists are canonicalized item by item
+        types = set(map(type, value))
+        if value and all(issubclass(kind, (int, np.integer)) and not issubclass(kind, (bool, np.bool_))
+                         for kind in types):
+            return rows_key(np.asarray(value, dtype=np.int64))
+        return ("list",) + tuple(canonical(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set",) + tuple(sorted(canonical(item) for item in value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def query_key(name, dataset, version, arguments):
+    """
+    Digest of a call: function name, dataset handle and version, canonical arguments
+    """
+    text = repr((name, dataset.uid, version, canonical(arguments)))
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def estimate_size(value):
+    """
+    Approximate memory used by a cached result, in bytes
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size = sys.getsizeof(value)
+        if len(value) == 0:
+            return size
+        sample = list(value)[:_SIZE_SAMPLE] if len(value) > _SIZE_SAMPLE else value
+        return size + sum(estimate_size(item) for item in sample) * len(value) // len(sample)
+    return sys.getsizeof(value)
+
+class QueryCache:
+    """
+    LRU cache of query results bounded by memory: the least recently used results are
+    evicted once the estimated size of the stored results exceeds max_bytes.
+    Results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        (True, result) if key is cached, (False, None) otherwise
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Hit/miss counters and memory use of the cache
+        """
+        with self._lock:
+            calls = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit rate": self.hits / calls if calls else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "evictions": self.evictions,
+            }
+
+query_cache = QueryCache()
+
+def cached_query(function):
+    """
+    Memoize a query function taking a dataset=None argument in query_cache.
+    The key holds the dataset version, which changes when its files are modified on disk,
+    so results computed on older data are never returned.
+    The function without cache stays available as function.__wrapped__.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        dataset = arguments.arguments.pop("dataset")
+        if dataset is None:
+            dataset = get_dataset()
+        key = query_key(function.__qualname__, dataset, dataset.refresh(), arguments.arguments)
+        found, result = query_cache.get(key)
+        if not found:
+            result = function(**arguments.arguments, dataset=dataset)
+            query_cache.put(key, result)
+        return result
+
+    return wrapper
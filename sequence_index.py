@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+# Length of the indexed k-mers, motifs shorter than this use a range of k-mers
+KMER_SIZE = 3
+
+# Byte placed between sequences (and after the last one), never part of a motif
+SEPARATOR = 0
+
+def clean_sequence(sequence):
+    """
+    Remove whitespace and upper-case a sequence ("" for missing values)
+    """
+    if pd.isna(sequence):
+        return ""
+    return "".join(str(sequence).split()).upper()
+
+class SequenceIndex:
+    """
+    K-mer posting index over all sequences of the UniProt table, concatenated.
+    Every residue position is indexed by the k-mer starting there, so a motif is found by
+    intersecting the positions of its k-mers instead of scanning every sequence.
+    """
+
+    def __init__(self, sequences, k=KMER_SIZE):
+        self.k = k
+        self.sequences = [clean_sequence(sequence) for sequence in sequences]
+        self.n_rows = len(self.sequences)
+
+        lengths = np.array([len(sequence) for sequence in self.sequences], dtype=np.int64)
+        # Start of each sequence in the concatenated text (one separator after each sequence)
+        self.starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1])) if self.n_rows else np.zeros(0, dtype=np.int64)
+
+        # Concatenated sequences, also scanned directly by the motif search
+        self.text = "\x00".join(self.sequences)
+        text = self.text.encode("ascii")
+        codes = np.frombuffer(text + b"\x00" * k, dtype=np.uint8).astype(np.uint32)
+        n = len(text)
+
+        # Integer key of the k-mer starting at each position (base 256)
+        keys = np.zeros(n, dtype=np.uint32)
+        for j in range(k):
+            keys = (keys << 8) | codes[j:j + n]
+
+        positions = np.flatnonzero(codes[:n] != SEPARATOR)
+        dtype = np.int32 if n < 2 ** 31 else np.int64
+        order = np.argsort(keys[positions], kind="stable")
+        self.kmer_keys = keys[positions][order]
+        self.kmer_positions = positions[order].astype(dtype)
+
+    def _key_range(self, kmer):
+        """
+        Range of k-mer keys starting with kmer (a single key when len(kmer) == k)
+        """
+        key = 0
+        for char in kmer.encode("ascii"):
+            key = (key << 8) | char
+        shift = 8 * (self.k - len(kmer))
+        return key << shift, ((key + 1) << shift) - 1
+
+    def _positions(self, kmer):
+        """
+        Sorted positions, in the concatenated text, of the k-mers starting with kmer
+        """
+        low, high = self._key_range(kmer)
+        start = np.searchsorted(self.kmer_keys, low, side="left")
+        stop = np.searchsorted(self.kmer_keys, high, side="right")
+        return np.sort(self.kmer_positions[start:stop])
+
+    def find(self, motif):
+        """
+        Return the start positions of motif in the concatenated text
+        """
+        motif = clean_sequence(motif)
+        if not motif or not motif.isascii():
+            return np.zeros(0, dtype=np.int64)
+        if len(motif) <= self.k:
+            return self._positions(motif)
+
+        # Candidate starts given by each k-mer of the motif, rarest first
+        candidates = [self._positions(motif[j:j + self.k]) - j for j in range(len(motif) - self.k + 1)]
+        candidates.sort(key=len)
+        hits = candidates[0]
+        for positions in candidates[1:]:
+            if len(hits) == 0:
+                break
+            hits = np.intersect1d(hits, positions, assume_unique=True)
+        return hits
+
+    def locate(self, positions):
+        """
+        Convert positions in the concatenated text into (rows, 0-based offsets in the sequence)
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = np.searchsorted(self.starts, positions, side="right") - 1
+        return rows, positions - self.starts[rows]
+
+    def search(self, motif):
+        """
+        Return a dictionary row -> list of 0-based offsets of motif in the sequence of that row
+        """
+        rows, offsets = self.locate(self.find(motif))
+        result = {}
+        for row, offset in zip(rows.tolist(), offsets.tolist()):
+            result.setdefault(row, []).append(offset)
+        return result
+
+    def rows(self, motif):
+        """
+        Return a boolean array over the rows, True where the sequence contains motif
+        """
+        mask = np.zeros(self.n_rows, dtype=bool)
+        rows, _ = self.locate(self.find(motif))
+        mask[rows] = True
+        return mask
+
+def build_sequence_index(dataset):
+    return SequenceIndex(dataset.table("uniprot", ["Sequence"])["Sequence"])
+
+def get_sequence_index(dataset):
+    """
+    Return the sequence index of a dataset, built on first use
+    """
+    return dataset.derived("sequence_index", build_sequence_index)
@@ -0,0 +1,50 @@
+import numpy as np
+from sequence_index import get_sequence_index
+
+# Residue codes, in the order of the BLOSUM62 matrix (unknown letters are encoded as X)
+ALPHABET = "ARNDCQEGHILKMFPSTWYVBZX*"
+
+# Code used after the end of each sequence in the padded matrix
+PAD = len(ALPHABET)
+
+_lookup = np.full(256, ALPHABET.index("X"), dtype=np.int8)
+for _code, _residue in enumerate(ALPHABET):
+    _lookup[ord(_residue)] = _code
+
+def encode_sequence(sequence):
+    """
+    Return the residue codes of a single (clean, upper-case) sequence
+    """
+    return _lookup[np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)]
+
+class SequenceMatrix:
+    """
+    All sequences of the UniProt table as one padded integer matrix (rows x max length),
+    shared by the vectorized sequence computations
+    """
+
+    def __init__(self, codes, lengths):
+        self.codes = codes
+        self.lengths = lengths
+
+    @classmethod
+    def from_sequence_index(cls, sequence_index):
+        lengths = np.array([len(sequence) for sequence in sequence_index.sequences], dtype=np.int64)
+        width = int(lengths.max()) if len(lengths) else 0
+        codes = np.full((sequence_index.n_rows, width), PAD, dtype=np.int8)
+
+        # Scatter the residues of the concatenated text into the matrix in one go
+        text = np.frombuffer(sequence_index.text.encode("ascii"), dtype=np.uint8)
+        positions = np.flatnonzero(text != 0)
+        rows, offsets = sequence_index.locate(positions)
+        codes[rows, offsets] = _lookup[text[positions]]
+        return cls(codes, lengths)
+
+def build_sequence_matrix(dataset):
+    return SequenceMatrix.from_sequence_index(get_sequence_index(dataset))
+
+def get_sequence_matrix(dataset):
+    """
+    Return the encoded sequence matrix of a dataset, built on first use
+    """
+    return dataset.derived("sequence_matrix", build_sequence_matrix)
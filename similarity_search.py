@@ -0,0 +1,273 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sequence_matrix import ALPHABET, PAD, encode_sequence, get_sequence_matrix
+from sequence_index import clean_sequence, get_sequence_index
+
+_blosum62_text = """
+   A  R  N  D  C  Q  E  G  H  I  L  K  M  F  P  S  T  W  Y  V  B  Z  X  *
+A  4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0 -2 -1  0 -4
+R -1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3 -1  0 -1 -4
+N -2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3  3  0 -1 -4
+D -2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3  4  1 -1 -4
+C  0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1 -3 -3 -2 -4
+Q -1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2  0  3 -1 -4
+E -1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+G  0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3 -1 -2 -1 -4
+H -2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3  0  0 -1 -4
+I -1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3 -3 -3 -1 -4
+L -1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1 -4 -3 -1 -4
+K -1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2  0  1 -1 -4
+M -1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1 -3 -1 -1 -4
+F -2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1 -3 -3 -1 -4
+P -1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2 -2 -1 -2 -4
+S  1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2  0  0  0 -4
+T  0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0 -1 -1  0 -4
+W -3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3 -4 -3 -2 -4
+Y -2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1 -3 -2 -1 -4
+V  0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4 -3 -2 -1 -4
+B -2 -1  3  4 -3  0  1 -1  0 -3 -4  0 -3 -3 -2  0 -1 -4 -3 -3  4  1 -1 -4
+Z -1  0  0  1 -3  3  4 -2  0 -3 -3  1 -1 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+X  0 -1 -1 -1 -2 -1 -1 -1 -1 -1 -1 -1 -1 -1 -2  0  0 -2 -1 -1 -1 -1 -1 -4
+* -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4  1
+"""
+
+def _parse_blosum62():
+    lines = _blosum62_text.strip().splitlines()
+    header = lines[0].split()
+    assert "".join(header) == ALPHABET
+    # One extra row/column for the padding code, low enough to end any local alignment
+    matrix = np.full((PAD + 1, PAD + 1), -100, dtype=np.int32)
+    for i, line in enumerate(lines[1:]):
+        matrix[i, :PAD] = [int(value) for value in line.split()[1:]]
+    return matrix
+
+BLOSUM62 = _parse_blosum62()
+
+# Affine gap penalties of the gapped search (cost of a gap of length n: open + n * extend)
+GAP_OPEN = 11
+GAP_EXTEND = 1
+
+# Sequences scored together in one NumPy pass
+CHUNK_SIZE = 5000
+
+# Worker processes of the searches of the app (GPER_SIMILARITY_PROCESSES, 1 scores in the
+# process of the request), at most MAX_PROCESSES
+MAX_PROCESSES = 8
+PROCESSES = min(int(os.environ.get("GPER_SIMILARITY_PROCESSES", 1)), MAX_PROCESSES)
+
+def ungapped_scores(query_codes, codes):
+    """
+    Best ungapped local alignment score of the query against every row of codes.
+    Returns (scores, query_ends, sequence_ends), ends being 0-based inclusive positions.
+    """
+    n, width = codes.shape
+    # Scores fit in int16 unless the query is very long (11 is the best BLOSUM62 score)
+    dtype = np.int16 if 11 * len(query_codes) < 2 ** 15 else np.int32
+    # Row i: scores of query residue i against every residue code
+    profile = BLOSUM62[query_codes].astype(dtype)
+    diagonal = np.zeros((n, width), dtype=dtype)
+    best = np.zeros(n, dtype=np.int32)
+    query_ends = np.zeros(n, dtype=np.int64)
+    sequence_ends = np.zeros(n, dtype=np.int64)
+    rows = np.arange(n)
+
+    for i in range(len(query_codes)):
+        # H[i, j] = max(0, H[i-1, j-1] + s(q_i, s_j)), the previous row shifted by one residue
+        current = profile[i][codes]
+        current[:, 1:] += diagonal[:, :-1]
+        np.maximum(current, 0, out=current)
+        diagonal = current
+
+        positions = diagonal.argmax(axis=1)
+        scores = diagonal[rows, positions]
+        improved = scores > best
+        best[improved] = scores[improved]
+        query_ends[improved] = i
+        sequence_ends[improved] = positions[improved]
+    return best, query_ends, sequence_ends
+
+def smith_waterman_scores(query_codes, codes, gap_open=GAP_OPEN, gap_extend=GAP_EXTEND):
+    """
+    Best Smith-Waterman score (affine gaps) of the query against every row of codes,
+    computed one anti-diagonal at a time for all the sequences at once.
+    Returns (scores, query_ends, sequence_ends), ends being 0-based inclusive positions.
+    """
+    n, width = codes.shape
+    m = len(query_codes)
+    profile = BLOSUM62[query_codes]
+    query_positions = np.arange(m)
+    negative = -10 ** 6
+
+    h_previous = np.zeros((n, m), dtype=np.int32)   # H on diagonal d-1, indexed by query position
+    h_before = np.zeros((n, m), dtype=np.int32)     # H on diagonal d-2
+    e_previous = np.full((n, m), negative, dtype=np.int32)
+    f_previous = np.full((n, m), negative, dtype=np.int32)
+    best = np.zeros(n, dtype=np.int32)
+    query_ends = np.zeros(n, dtype=np.int64)
+    sequence_ends = np.zeros(n, dtype=np.int64)
+    rows = np.arange(n)
+
+    for d in range(m + width - 1):
+        sequence_positions = d - query_positions
+        valid = (sequence_positions >= 0) & (sequence_positions < width)
+        substitution = profile[query_positions, codes[:, np.clip(sequence_positions, 0, width - 1)]]
+
+        # Cells (i-1, j) and (i-1, j-1) are at index i-1 of the diagonals d-1 and d-2
+        up_h = np.zeros_like(h_previous)
+        up_h[:, 1:] = h_previous[:, :-1]
+        up_f = np.full_like(f_previous, negative)
+        up_f[:, 1:] = f_previous[:, :-1]
+        diagonal_h = np.zeros_like(h_before)
+        diagonal_h[:, 1:] = h_before[:, :-1]
+
+        e = np.maximum(e_previous - gap_extend, h_previous - gap_open - gap_extend)
+        f = np.maximum(up_f - gap_extend, up_h - gap_open - gap_extend)
+        h = np.maximum(np.maximum(diagonal_h + substitution, 0), np.maximum(e, f))
+        h[:, ~valid] = 0
+        e[:, ~valid] = negative
+        f[:, ~valid] = negative
+
+        positions = h.argmax(axis=1)
+        scores = h[rows, positions]
+        improved = scores > best
+        best[improved] = scores[improved]
+        query_ends[improved] = positions[improved]
+        sequence_ends[improved] = d - positions[improved]
+
+        h_before, h_previous, e_previous, f_previous = h_previous, h, e, f
+    return best, query_ends, sequence_ends
+
+_scorers = {
+    "ungapped": ungapped_scores,
+    "smith-waterman": smith_waterman_scores,
+}
+
+def _score_chunk(args):
+    method, query_codes, codes = args
+    return _scorers[method](query_codes, codes)
+
+def score_all(query, codes, method="ungapped", processes=None):
+    """
+    Score a query peptide against every row of an encoded sequence matrix.
+
+    Parameters:
+    - query: peptide sequence
+    - codes: padded matrix of residue codes (see sequence_matrix)
+    - method: "ungapped" (fast) or "smith-waterman" (affine gaps)
+    - processes: number of worker processes for the chunks (None to score in this process)
+
+    Returns (scores, query_ends, sequence_ends) arrays over the rows.
+    """
+    if method not in _scorers:
+        raise ValueError(f"Unknown alignment method '{method}'")
+    query_codes = encode_sequence(clean_sequence(query)).astype(np.int64)
+    chunks = [(method, query_codes, codes[start:start + CHUNK_SIZE])
+              for start in range(0, len(codes), CHUNK_SIZE)]
+    if not chunks or len(query_codes) == 0:
+        empty = np.zeros(len(codes), dtype=np.int64)
+        return empty, empty.copy(), empty.copy()
+
+    if processes is not None and processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_score_chunk, chunks))
+    else:
+        results = [_score_chunk(chunk) for chunk in chunks]
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+def align(query, sequence, method="ungapped", gap_open=GAP_OPEN, gap_extend=GAP_EXTEND):
+    """
+    Local alignment of query and sequence with traceback (used for the few best hits only).
+    Returns a dictionary with the score, 0-based half-open regions and the aligned strings.
+    """
+    query, sequence = clean_sequence(query), clean_sequence(sequence)
+    q, s = encode_sequence(query), encode_sequence(sequence)
+    m, n = len(q), len(s)
+    gapped = method == "smith-waterman"
+    negative = -10 ** 6
+
+    # Plain Python lists: faster than NumPy scalars for a cell-by-cell recurrence
+    h = [[0] * (n + 1) for _ in range(m + 1)]
+    e = [[negative] * (n + 1) for _ in range(m + 1)]
+    f = [[negative] * (n + 1) for _ in range(m + 1)]
+    substitution = [BLOSUM62[code][s].tolist() for code in q]
+    best, best_i, best_j = 0, 0, 0
+    for i in range(1, m + 1):
+        row = substitution[i - 1]
+        h_row, h_up = h[i], h[i - 1]
+        for j in range(1, n + 1):
+            value = max(h_up[j - 1] + row[j - 1], 0)
+            if gapped:
+                e[i][j] = max(e[i][j - 1] - gap_extend, h_row[j - 1] - gap_open - gap_extend)
+                f[i][j] = max(f[i - 1][j] - gap_extend, h_up[j] - gap_open - gap_extend)
+                value = max(value, e[i][j], f[i][j])
+            h_row[j] = value
+            if value > best:
+                best, best_i, best_j = value, i, j
+
+    i, j = best_i, best_j
+    score = best
+    query_end, sequence_end = i, j
+    aligned_query, aligned_sequence = [], []
+    state = "h"
+    while i > 0 and j > 0 and (state != "h" or h[i][j] > 0):
+        if state == "h":
+            if not gapped or h[i][j] == h[i - 1][j - 1] + substitution[i - 1][j - 1]:
+                aligned_query.append(query[i - 1])
+                aligned_sequence.append(sequence[j - 1])
+                i, j = i - 1, j - 1
+            elif h[i][j] == e[i][j]:
+                state = "e"
+            else:
+                state = "f"
+        elif state == "e":
+            # Gap in the query
+            aligned_query.append("-")
+            aligned_sequence.append(sequence[j - 1])
+            state = "h" if e[i][j] == h[i][j - 1] - gap_open - gap_extend else "e"
+            j -= 1
+        else:
+            # Gap in the sequence
+            aligned_query.append(query[i - 1])
+            aligned_sequence.append("-")
+            state = "h" if f[i][j] == h[i - 1][j] - gap_open - gap_extend else "f"
+            i -= 1
+
+    return {
+        "score": score,
+        "query_start": i,
+        "query_end": query_end,
+        "start": j,
+        "end": sequence_end,
+        "aligned_query": "".join(reversed(aligned_query)),
+        "aligned_sequence": "".join(reversed(aligned_sequence)),
+    }
+
+def search_similar(query, sequence_matrix, sequences, top_k=10, method="ungapped", processes=None):
+    """
+    Return the top_k rows most similar to query, best first, as a list of dictionaries
+    (row, score, aligned regions and strings). Rows with a score of 0 are left out.
+    """
+    scores, _, _ = score_all(query, sequence_matrix.codes, method=method, processes=processes)
+    if top_k >= len(scores):
+        candidates = np.arange(len(scores))
+    else:
+        candidates = np.argpartition(-scores, top_k)[:top_k]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    hits = []
+    for row in candidates.tolist():
+        if scores[row] <= 0:
+            continue
+        hit = align(query, sequences[row], method=method)
+        hit["row"] = row
+        hits.append(hit)
+    return hits
+
+def get_similarity_hits(dataset, query, top_k=10, method="ungapped", processes=None):
+    """
+    search_similar over the sequences of a dataset
+    """
+    sequences = get_sequence_index(dataset).sequences
+    return search_similar(query, get_sequence_matrix(dataset), sequences,
+                          top_k=top_k, method=method, processes=processes)
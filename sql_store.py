@@ -0,0 +1,689 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+import pandas as pd
+from dataset import get_dataset
+from data_store import source_stamp, read_document
+from gene_index import get_gene_index
+from sequence_index import clean_sequence
+from presence_flags import presence_columns, get_presence_flags
+from drug_links import get_drug_links
+from drug_numeric import numeric_ranges_drugbank
+from motif_search import compile_prosite
+from similarity_search import get_similarity_hits, PROCESSES as SIMILARITY_PROCESSES
+from text_index import text_fields
+from taxonomy import get_taxonomy
+from descriptors import get_descriptors
+
+# SQLite copy of the tables, shared by every process of the app
+STORE_PATH = "gper.sqlite"
+
+# Schema of structureBD.puml. Protein and Drugs keep the row of the entry in uniprot.csv /
+# drugbank.csv so that results match filter_results_uniprot / filter_results_drugbank, and
+# carry the extra columns the sidebar filters need (Entry, Length, Mass, presence flags,
+# pharmacokinetic ranges, physicochemical descriptors). Protein_Gene holds one row per gene
+# symbol for the gene filter, Taxon the nested-set numbers of the taxonomy (see taxonomy) for
+# the clade filter, Protein_Feature the sequence features (see features), and the FTS5 tables
+# the narrative columns of text_index.text_fields for the full-text filter.
+schema = """
+CREATE TABLE Protein (
+    Protein_Id INTEGER PRIMARY KEY,
+    Entry TEXT NOT NULL UNIQUE,
+    Entry_Name TEXT,
+    Protein_Name TEXT,
+    Sequence TEXT,
+    Gene_Name TEXT,
+    Organism TEXT,
+    Length INTEGER,
+    Mass INTEGER,
+    Function TEXT,
+    Taxon_Number INTEGER,
+    pI REAL,
+    GRAVY REAL,
+    Net_Charge REAL,
+    Aromaticity REAL,
+    {presence_columns}
+);
+CREATE INDEX Protein_Entry_Name ON Protein (Entry_Name);
+CREATE INDEX Protein_Protein_Name ON Protein (Protein_Name);
+CREATE INDEX Protein_Organism ON Protein (Organism);
+CREATE INDEX Protein_Length ON Protein (Length);
+CREATE INDEX Protein_Mass ON Protein (Mass);
+CREATE INDEX Protein_Taxon_Number ON Protein (Taxon_Number);
+CREATE INDEX Protein_pI ON Protein (pI);
+CREATE INDEX Protein_GRAVY ON Protein (GRAVY);
+CREATE INDEX Protein_Net_Charge ON Protein (Net_Charge);
+CREATE INDEX Protein_Aromaticity ON Protein (Aromaticity);
+
+CREATE TABLE Taxon (
+    Taxon_Id INTEGER PRIMARY KEY,
+    Name TEXT,
+    Rank TEXT,
+    Left_Number INTEGER NOT NULL,
+    Right_Number INTEGER NOT NULL
+);
+
+CREATE TABLE Protein_Feature (
+    Protein_Id INTEGER NOT NULL REFERENCES Protein (Protein_Id),
+    Type TEXT NOT NULL,
+    Start INTEGER NOT NULL,
+    End INTEGER NOT NULL,
+    Note TEXT
+);
+CREATE INDEX Protein_Feature_Type ON Protein_Feature (Type, Protein_Id);
+CREATE INDEX Protein_Feature_Protein_Id ON Protein_Feature (Protein_Id, Start);
+
+CREATE TABLE Protein_Gene (
+    Gene TEXT NOT NULL,
+    Protein_Id INTEGER NOT NULL REFERENCES Protein (Protein_Id),
+    PRIMARY KEY (Gene, Protein_Id)
+) WITHOUT ROWID;
+
+CREATE TABLE Drugs (
+    Drug_Id TEXT PRIMARY KEY CHECK (Drug_Id GLOB 'DB[0-9][0-9][0-9][0-9][0-9]'),
+    Drug_Row INTEGER NOT NULL UNIQUE,
+    Type TEXT,
+    Name TEXT,
+    Groups TEXT,
+    Description TEXT,
+    Adverse_effects TEXT,
+    Indications TEXT,
+    Absorption_Min REAL,
+    Absorption_Max REAL,
+    Protein_Binding_Min REAL,
+    Protein_Binding_Max REAL,
+    Half_Life_Min REAL,
+    Half_Life_Max REAL,
+    Molecular_Weight REAL
+);
+CREATE INDEX Drugs_Type ON Drugs (Type);
+CREATE INDEX Drugs_Name ON Drugs (Name);
+CREATE INDEX Drugs_Groups ON Drugs (Groups);
+
+CREATE TABLE Protein_Drug (
+    Protein_Id INTEGER NOT NULL REFERENCES Protein (Protein_Id),
+    Drug_Id TEXT NOT NULL REFERENCES Drugs (Drug_Id),
+    General_Function TEXT,
+    Specific_Function TEXT,
+    Molecular_Weight REAL,
+    PRIMARY KEY (Protein_Id, Drug_Id)
+) WITHOUT ROWID;
+CREATE INDEX Protein_Drug_Drug_Id ON Protein_Drug (Drug_Id);
+
+CREATE TABLE ChEMBL (
+    ChEMBL_Id TEXT PRIMARY KEY CHECK (ChEMBL_Id GLOB 'CHEMBL[0-9]*'),
+    Type TEXT,
+    Bioactivity_data TEXT CHECK (json_valid(Bioactivity_data))
+);
+CREATE INDEX ChEMBL_Type ON ChEMBL (Type);
+
+CREATE TABLE Protein_Molecule (
+    Relationship_Id INTEGER PRIMARY KEY,
+    Protein_Id INTEGER NOT NULL REFERENCES Protein (Protein_Id),
+    Molecule_Id TEXT NOT NULL REFERENCES ChEMBL (ChEMBL_Id),
+    Relationship TEXT,
+    Preferred_Name TEXT,
+    Target_Type TEXT,
+    UNIQUE (Protein_Id, Molecule_Id, Relationship)
+);
+CREATE INDEX Protein_Molecule_Molecule_Id ON Protein_Molecule (Molecule_Id);
+
+CREATE TABLE Drugs_Drugs (
+    Id_drug1 TEXT NOT NULL REFERENCES Drugs (Drug_Id) CHECK (Id_drug1 GLOB 'DB[0-9][0-9][0-9][0-9][0-9]'),
+    Id_drug2 TEXT NOT NULL REFERENCES Drugs (Drug_Id) CHECK (Id_drug2 GLOB 'DB[0-9][0-9][0-9][0-9][0-9]'),
+    Interaction TEXT,
+    PRIMARY KEY (Id_drug1, Id_drug2)
+) WITHOUT ROWID;
+CREATE INDEX Drugs_Drugs_Id_drug2 ON Drugs_Drugs (Id_drug2);
+
+CREATE VIRTUAL TABLE Protein_Text USING fts5 ({uniprot_text}, tokenize = 'porter unicode61');
+CREATE VIRTUAL TABLE Drugs_Text USING fts5 ({drugbank_text}, tokenize = 'porter unicode61');
+
+CREATE TABLE Meta (
+    Key TEXT PRIMARY KEY,
+    Value TEXT
+);
+""".format(presence_columns=",\n    ".join(f"{flag} INTEGER NOT NULL DEFAULT 0" for flag in presence_columns),
+           uniprot_text=", ".join(text_fields["uniprot"]), drugbank_text=", ".join(text_fields["drugbank"]))
+
+# Full-text table of a table of text_fields, keyed by the row of the entry
+text_tables_sql = {"uniprot": "Protein_Text", "drugbank": "Drugs_Text"}
+
+# filter_results_uniprot field -> Protein column
+uniprot_columns_sql = {
+    "Entry": "Entry",
+    "Entry Name": "Entry_Name",
+    "Protein names": "Protein_Name",
+    "Organism": "Organism",
+    "Length": "Length",
+    "Mass": "Mass",
+}
+
+# descriptors.descriptor_fields -> Protein column
+descriptor_columns_sql = {
+    "pI": "pI",
+    "GRAVY": "GRAVY",
+    "Net charge": "Net_Charge",
+    "Aromaticity": "Aromaticity",
+}
+
+# Options of the "Feature" filter (see features.FeatureIndex.rows_with)
+feature_options = {"types", "start", "end", "note", "within", "within_note"}
+
+# filter_results_drugbank field -> Drugs column (values) or (low column, high column) (ranges)
+drugbank_columns_sql = {
+    "DrugBank ID": "Drug_Id",
+    "Name": "Name",
+    "Type": "Type",
+    "Groups": "Groups",
+}
+drugbank_ranges_sql = {
+    "Absorption": ("Absorption_Min", "Absorption_Max"),
+    "Protein Binding": ("Protein_Binding_Min", "Protein_Binding_Max"),
+    "Half Life": ("Half_Life_Min", "Half_Life_Max"),
+    "Molecular Weight": ("Molecular_Weight", "Molecular_Weight"),
+}
+
+def sql_value(value):
+    """
+    Python value for SQLite (NaN -> NULL, numpy scalars -> numbers)
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def parse_interactions(df_drugbank):
+    """
+    Return (DrugBank ID, DrugBank ID, sentence) for the interactions between drugs of drugbank.csv.
+    The scraped "Drug Interactions" text lists "<Name> <sentence>." items, only partners that
+    are themselves in the table are kept.
+    """
+    ids_by_name = {str(name).lower(): drug_id for name, drug_id
+                   in zip(df_drugbank["Name"], df_drugbank["DrugBank ID"]) if not pd.isna(name)}
+    if not ids_by_name:
+        return []
+    names = re.compile(r"(?<![\w-])(" + "|".join(re.escape(name) for name in sorted(ids_by_name, key=len, reverse=True))
+                       + r")(?![\w-])", re.IGNORECASE)
+
+    interactions = {}
+    for drug_id, text in zip(df_drugbank["DrugBank ID"], df_drugbank["Drug Interactions"]):
+        if pd.isna(text) or "DRUG INTERACTION" not in text:
+            continue
+        items = text.split("DRUG INTERACTION", 1)[1]
+        for sentence in re.split(r"(?<=\.)\s+", items):
+            partners = {ids_by_name[match.lower()] for match in names.findall(sentence)} - {drug_id}
+            for partner in partners:
+                # Drop the "<Name> " heading of the item
+                interaction = re.sub(r"^\S+\s+(?=[A-Z])", "", sentence.strip())
+                interactions.setdefault((drug_id, partner), interaction)
+    return [(drug1, drug2, interaction) for (drug1, drug2), interaction in interactions.items()]
+
+def load_protein_rows(dataset):
+    columns = ["Entry", "Entry Name", "Protein names", "Sequence", "Gene Names",
+               "Organism", "Length", "Mass", "Function [CC]"]
+    # The shared table may hold more columns than asked for
+    df_uniprot = dataset.table("uniprot", columns)[columns]
+    taxon_numbers = get_taxonomy(dataset).row_numbers
+    descriptors = get_descriptors(dataset).values
+    flags = get_presence_flags(dataset).flags[list(presence_columns)].to_numpy()
+    rows = []
+    for row, values in enumerate(df_uniprot.itertuples(index=False)):
+        rows.append([row] + [sql_value(values[i]) for i in range(3)]
+                    + [clean_sequence(values[3])]
+                    + [sql_value(value) for value in values[4:9]]
+                    + [int(taxon_numbers[row]) if taxon_numbers[row] >= 0 else None]
+                    + [sql_value(descriptors[field][row]) for field in descriptor_columns_sql]
+                    + [int(flag) for flag in flags[row]])
+    return rows
+
+def load_text(connection, dataset, table):
+    """
+    Fill the FTS5 table of a table with its narrative columns (see text_index.text_fields)
+    """
+    fields = text_fields[table]
+    df = dataset.table(table, list(fields.values()))[list(fields.values())]
+    connection.executemany(
+        f"INSERT INTO {text_tables_sql[table]} (rowid, {', '.join(fields)}) "
+        f"VALUES ({', '.join('?' * (len(fields) + 1))})",
+        [[row] + [sql_value(value) for value in values] for row, values in enumerate(df.itertuples(index=False))])
+
+def load_store(connection, dataset):
+    """
+    Fill an empty store with the UniProt, DrugBank and ChEMBL data of a dataset
+    """
+    # Protein, genes and full-text index
+    protein_rows = load_protein_rows(dataset)
+    connection.executemany(f"INSERT INTO Protein VALUES "
+                           f"({', '.join('?' * (11 + len(descriptor_columns_sql) + len(presence_columns)))})",
+                           protein_rows)
+    gene_index = get_gene_index(dataset)
+    connection.executemany("INSERT INTO Protein_Gene VALUES (?, ?)",
+                           [(symbol, int(row)) for symbol in gene_index.symbols for row in gene_index.postings[symbol]])
+    load_text(connection, dataset, "uniprot")
+
+    # Taxonomy tree and sequence features
+    taxonomy = get_taxonomy(dataset)
+    connection.executemany("INSERT INTO Taxon VALUES (?, ?, ?, ?, ?)",
+                           [(taxid, taxonomy.name[taxid], taxonomy.rank[taxid], taxonomy.left[taxid],
+                             taxonomy.right[taxid]) for taxid in taxonomy.order])
+    features = dataset.table("features")
+    connection.executemany("INSERT INTO Protein_Feature VALUES (?, ?, ?, ?, ?)",
+                           [(int(row), feature_type, int(start), int(end), sql_value(note)) for row, feature_type, start, end, note
+                            in features[["row", "type", "start", "end", "note"]].itertuples(index=False)])
+
+    # Drugs, with the numeric fields parsed at ingest
+    numeric = [column for field in drugbank_ranges_sql for column in numeric_ranges_drugbank[field]]
+    df_drugbank = dataset.table("drugbank", ["DrugBank ID", "Type", "Name", "Groups", "Description",
+                                             "Adverse Effects", "Indication", "Mechanism of Action",
+                                             "Pharmacodynamics", "Drug Interactions"] + numeric)
+    drug_rows = []
+    for row, values in enumerate(df_drugbank[["DrugBank ID", "Type", "Name", "Groups", "Description",
+                                              "Adverse Effects", "Indication"]
+                                             + list(dict.fromkeys(numeric))].itertuples(index=False)):
+        drug_rows.append([sql_value(values[0]), row] + [sql_value(value) for value in values[1:]])
+    connection.executemany(f"INSERT INTO Drugs VALUES ({', '.join('?' * 15)})", drug_rows)
+    load_text(connection, dataset, "drugbank")
+
+    # Protein_Drug from the association table (drugbank.csv has no target-level annotations:
+    # the functions are the mechanism of action and the pharmacodynamics of the drug)
+    weight_column = numeric_ranges_drugbank["Molecular Weight"][0]
+    connection.executemany(
+        "INSERT OR IGNORE INTO Protein_Drug VALUES (?, ?, ?, ?, ?)",
+        [(int(uniprot_row), drug_id,
+          sql_value(df_drugbank.at[drugbank_row, "Mechanism of Action"]),
+          sql_value(df_drugbank.at[drugbank_row, "Pharmacodynamics"]),
+          sql_value(df_drugbank.at[drugbank_row, weight_column]))
+         for uniprot_row, drugbank_row, drug_id in get_drug_links(dataset).associations.itertuples(index=False)])
+    connection.executemany("INSERT INTO Drugs_Drugs VALUES (?, ?, ?)", parse_interactions(df_drugbank))
+
+    # ChEMBL targets of chembl_ref.csv, linked to the proteins through the ChEMBL cross-reference
+    df_chembl = dataset.table("chembl")
+    targets = {}
+    for record in df_chembl.to_dict("records"):
+        chembl_id = record["target_chembl_id"]
+        targets[chembl_id] = record
+        data = {key: sql_value(value) for key, value in record.items()
+                if key not in ("target_chembl_id", "target_type")}
+        connection.execute("INSERT OR REPLACE INTO ChEMBL VALUES (?, ?, ?)",
+                           (chembl_id, sql_value(record["target_type"]), json.dumps(data)))
+
+    relationships = []
+    proteins_by_target = {}
+    df_xref = dataset.table("uniprot", ["ChEMBL"])
+    for row, value in enumerate(df_xref["ChEMBL"]):
+        for chembl_id in re.findall(r"CHEMBL\d+", "" if pd.isna(value) else str(value)):
+            proteins_by_target.setdefault(chembl_id, []).append(row)
+            if chembl_id in targets:
+                relationships.append((row, chembl_id, "target", sql_value(targets[chembl_id]["pref_name"]),
+                                      sql_value(targets[chembl_id]["target_type"])))
+
+    # GPER compounds fetched from ChEMBL (scrapping/chembling.py), when the file exists
+    compounds = read_document("gper_compounds") or {}
+    activities_by_molecule = {}
+    for activity in compounds.get("activities", {}).values():
+        activities_by_molecule.setdefault(activity.get("molecule_chembl_id"), []).append(activity)
+    for chembl_id, target in compounds.get("targets", {}).items():
+        connection.execute("INSERT OR IGNORE INTO ChEMBL VALUES (?, ?, ?)",
+                           (chembl_id, target.get("target_type"), json.dumps(target)))
+    for chembl_id, molecule in compounds.get("molecules", {}).items():
+        activities = activities_by_molecule.get(chembl_id, [])
+        connection.execute("INSERT OR IGNORE INTO ChEMBL VALUES (?, ?, ?)",
+                           (chembl_id, molecule.get("molecule_type") or "molecule",
+                            json.dumps({"molecule": molecule, "activities": activities})))
+        for activity in activities:
+            target_id = activity.get("target_chembl_id")
+            target = compounds.get("targets", {}).get(target_id, {})
+            for row in proteins_by_target.get(target_id, []):
+                relationships.append((row, chembl_id, "active compound", molecule.get("pref_name"),
+                                      target.get("target_type")))
+    connection.executemany("INSERT OR IGNORE INTO Protein_Molecule "
+                           "(Protein_Id, Molecule_Id, Relationship, Preferred_Name, Target_Type) "
+                           "VALUES (?, ?, ?, ?, ?)", relationships)
+
+def build_store(path=STORE_PATH, dataset=None):
+    """
+    Write the SQLite store of a dataset (the shared one by default) to path, replacing it atomically.
+    Returns the path.
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    stamp = source_stamp()
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    connection = sqlite3.connect(partial_path)
+    try:
+        with connection:
+            connection.executescript(schema)
+            load_store(connection, dataset)
+            connection.execute("INSERT INTO Meta VALUES ('sources', ?)", (json.dumps(stamp),))
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    os.replace(partial_path, path)
+    return path
+
+def store_stamp(path):
+    """
+    Source stamp the store at path was built from, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        value = connection.execute("SELECT Value FROM Meta WHERE Key = 'sources'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        connection.close()
+    return json.loads(value[0]) if value else None
+
+@lru_cache(maxsize=256)
+def _compiled(pattern):
+    return re.compile(pattern)
+
+def _regexp(pattern, value):
+    return value is not None and _compiled(pattern).search(value) is not None
+
+_connections = threading.local()
+
+def get_store(path=STORE_PATH):
+    """
+    Return a read-only connection of the current thread to the store, None if the store is
+    missing or older than the data files (it is only built by "python sql_store.py" and the
+    ingest of data_store.py, never while answering a query)
+    """
+    stamp = json.loads(json.dumps(source_stamp()))
+    cached = getattr(_connections, "stores", {}).get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    if store_stamp(path) != stamp:
+        return None
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    connection.create_function("REGEXP", 2, _regexp, deterministic=True)
+    if cached is not None:
+        cached[1].close()
+    _connections.stores = dict(getattr(_connections, "stores", {}), **{path: (stamp, connection)})
+    return connection
+
+def open_store(path=STORE_PATH, dataset=None):
+    """
+    get_store for the queries of a dataset, raising an error if the store cannot answer them
+    """
+    if dataset is not None and dataset.sources is None:
+        raise ValueError("The SQLite store holds the data files, not a dataset given in memory")
+    connection = get_store(path)
+    if connection is None:
+        raise RuntimeError(f"The SQLite store {path} is missing or older than the data files, "
+                           f"build it with: python sql_store.py")
+    return connection
+
+def placeholders(values):
+    return ", ".join("?" * len(values))
+
+def fts_query(query, fields):
+    """
+    Translate a query of the full-text filter (see text_index.parse_query) into an FTS5 query:
+    every word must occur, in its field for "field:word" and field:"several words".
+    Returns None if the query has no word.
+    """
+    terms = []
+    for match in re.finditer(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))', query):
+        field, quoted, word = match.group(1), match.group(2), match.group(3)
+        text = quoted if quoted is not None else word
+        if field is not None and field.lower() not in fields:
+            text, field = match.group(0), None
+        for word in re.findall(r"[A-Za-z0-9]+", text):
+            terms.append(f'{field.lower()} : "{word}"' if field else f'"{word}"')
+    return " AND ".join(terms) or None
+
+def compile_feature_filter(options):
+    """
+    Compile the options of the "Feature" filter (see features.FeatureIndex.rows_with) into a
+    condition on Protein_Id and its parameters: the feature and, with "within", the feature
+    containing it are matched in Protein_Feature
+    """
+    unknown = set(options) - feature_options
+    if unknown:
+        raise ValueError(f"Unknown feature option(s) {sorted(unknown)}")
+    join = ""
+    conditions = []
+    params = []
+    if options.get("within"):
+        join = ("JOIN Protein_Feature o ON o.Protein_Id = f.Protein_Id AND o.Start <= f.Start AND f.End <= o.End "
+                "AND o.Type IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(options["within"])))
+        if options.get("within_note"):
+            join += " AND instr(lower(o.Note), ?) > 0"
+            params.append(options["within_note"].lower())
+    if options.get("types"):
+        conditions.append("f.Type IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(options["types"])))
+    if options.get("note"):
+        conditions.append("instr(lower(f.Note), ?) > 0")
+        params.append(options["note"].lower())
+    if options.get("start") is not None:
+        conditions.append("f.End >= ?")
+        params.append(int(options["start"]))
+    if options.get("end") is not None:
+        conditions.append("f.Start <= ?")
+        params.append(int(options["end"]))
+    return (f"Protein_Id IN (SELECT f.Protein_Id FROM Protein_Feature f {join} "
+            f"WHERE {' AND '.join(conditions) or '1'})"), params
+
+def compile_filters_uniprot(dic, dataset):
+    """
+    Compile the filters of filter_results_uniprot into a WHERE clause on Protein and its parameters
+    """
+    conditions = []
+    params = []
+    for field, value in dic.items():
+        if field == "Gene Names":
+            if not value:
+                continue
+            genes = []
+            for gene in value:
+                gene = gene.strip().upper()
+                if not gene.endswith("*"):
+                    genes.append("Gene = ?")
+                    params.append(gene)
+                elif gene == "*":
+                    genes.append("1")
+                else:
+                    # Prefix lookup as a range of the primary key
+                    prefix = gene[:-1]
+                    genes.append("(Gene >= ? AND Gene < ?)")
+                    params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+            conditions.append(f"Protein_Id IN (SELECT Protein_Id FROM Protein_Gene WHERE {' OR '.join(genes)})")
+        elif field == "Sequence":
+            if not value:
+                continue
+            motif = clean_sequence(value)
+            if not motif or not motif.isascii():
+                conditions.append("0")
+            else:
+                conditions.append("instr(Sequence, ?) > 0")
+                params.append(motif)
+        elif field == "Motifs":
+            for pattern in value or []:
+                if pattern.strip():
+                    conditions.append("Sequence REGEXP ?")
+                    params.append(compile_prosite(pattern))
+        elif field == "Similar to":
+            if not value or not value.get("query"):
+                continue
+            hits = get_similarity_hits(dataset, value["query"], top_k=value.get("top_k", 10),
+                                       method=value.get("method", "ungapped"),
+                                       processes=value.get("processes") or SIMILARITY_PROCESSES)
+            # Row set passed as one JSON array (no limit on the number of rows)
+            conditions.append("Protein_Id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps([int(hit["row"]) for hit in hits]))
+        elif field == "Text":
+            if not value or not value.strip():
+                continue
+            match = fts_query(value, text_fields["uniprot"])
+            conditions.append("Protein_Id IN (SELECT rowid FROM Protein_Text WHERE Protein_Text MATCH ?)"
+                              if match else "0")
+            params += [match] if match else []
+        elif field == "Clade":
+            if not value:
+                continue
+            # Nested-set numbers: the organism is in the clade when its number is within the bounds of the clade
+            conditions.append("EXISTS (SELECT 1 FROM Taxon WHERE Taxon_Id IN (SELECT value FROM json_each(?)) "
+                              "AND Protein.Taxon_Number BETWEEN Left_Number AND Right_Number)")
+            params.append(json.dumps([int(clade) for clade in value]))
+        elif field == "Feature":
+            if not value:
+                continue
+            condition, feature_params = compile_feature_filter(value)
+            conditions.append(condition)
+            params += feature_params
+        elif field in descriptor_columns_sql:
+            # Stored at build time, NULL without sequence (never kept)
+            conditions.append(f"{descriptor_columns_sql[field]} BETWEEN ? AND ?")
+            params += [float(value[0]), float(value[1])]
+        elif field == "Presence":
+            for flag in value or []:
+                if flag not in presence_columns:
+                    raise ValueError(f"Unknown presence flag '{flag}'")
+                conditions.append(f"{flag} = 1")
+        elif field in uniprot_columns_sql:
+            column = uniprot_columns_sql[field]
+            if isinstance(value, tuple):
+                conditions.append(f"{column} BETWEEN ? AND ?")
+                params += [sql_value(value[0]), sql_value(value[1])]
+            elif len(value) != 0:
+                values = [sql_value(v) for v in value if sql_value(v) is not None]
+                condition = f"{column} IN ({placeholders(values)})" if values else "0"
+                if len(values) < len(value):
+                    # NaN among the selected values
+                    condition = f"({condition} OR {column} IS NULL)"
+                conditions.append(condition)
+                params += values
+        else:
+            raise ValueError(f"Filter '{field}' is not supported by the SQLite store")
+    return " AND ".join(conditions) or "1", params
+
+def compile_filters_drugbank(dic, dataset):
+    """
+    Compile the filters of filter_results_drugbank into a WHERE clause on Drugs and its parameters
+    """
+    conditions = []
+    params = []
+    for field, value in dic.items():
+        if not value:
+            continue
+        if field == "Text":
+            match = fts_query(value, text_fields["drugbank"])
+            conditions.append("Drug_Row IN (SELECT rowid FROM Drugs_Text WHERE Drugs_Text MATCH ?)" if match else "0")
+            params += [match] if match else []
+        elif isinstance(value, tuple) and field in drugbank_ranges_sql:
+            # Drugs whose [low, high] interval overlaps the range
+            low, high = drugbank_ranges_sql[field]
+            conditions.append(f"{high} >= ? AND {low} <= ?")
+            params += [sql_value(value[0]), sql_value(value[1])]
+        elif not isinstance(value, tuple) and field in drugbank_columns_sql:
+            column = drugbank_columns_sql[field]
+            values = [sql_value(v) for v in value if sql_value(v) is not None]
+            condition = f"{column} IN ({placeholders(values)})" if values else "0"
+            if len(values) < len(value):
+                condition = f"({condition} OR {column} IS NULL)"
+            conditions.append(condition)
+            params += values
+        else:
+            raise ValueError(f"Filter '{field}' is not supported by the SQLite store")
+    return " AND ".join(conditions) or "1", params
+
+def compile_filters_chembl(dic):
+    """
+    Compile ChEMBL filters into a WHERE clause on ChEMBL: "Type" is a column, the other
+    fields are members of Bioactivity_data (lists of values or (min, max) ranges)
+    """
+    conditions = []
+    params = []
+    for field, value in dic.items():
+        if not value:
+            continue
+        if field == "Type":
+            column = "Type"
+        else:
+            column = "json_extract(Bioactivity_data, ?)"
+            member = '$."' + field.replace('"', '""') + '"'
+        if isinstance(value, tuple):
+            conditions.append(f"{column} BETWEEN ? AND ?")
+            params += ([] if field == "Type" else [member]) + [sql_value(value[0]), sql_value(value[1])]
+        else:
+            values = [sql_value(v) for v in value]
+            conditions.append(f"{column} IN ({placeholders(values)})")
+            params += ([] if field == "Type" else [member]) + values
+    return " AND ".join(conditions) or "1", params
+
+def filter_results_uniprot(dic, dataset=None, path=STORE_PATH):
+    """
+    SQLite version of import_CSV.filter_results_uniprot: same filters and rows, except for "Text",
+    matched by the FTS5 porter stemmer instead of text_index.stem (a few word forms differ)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    where, params = compile_filters_uniprot(dic, dataset)
+    cursor = open_store(path, dataset).execute(f"SELECT Protein_Id FROM Protein WHERE {where} ORDER BY Protein_Id", params)
+    return [row for row, in cursor]
+
+def filter_results_drugbank(dic, dataset=None, path=STORE_PATH):
+    """
+    SQLite version of import_CSV.filter_results_drugbank: same filters and rows, except for "Text"
+    (see filter_results_uniprot)
+    """
+    if dataset is None:
+        dataset = get_dataset()
+    where, params = compile_filters_drugbank(dic, dataset)
+    cursor = open_store(path, dataset).execute(f"SELECT Drug_Row FROM Drugs WHERE {where} ORDER BY Drug_Row", params)
+    return [row for row, in cursor]
+
+def filter_results_chembl(dic, dataset=None, path=STORE_PATH):
+    """
+    Return the ChEMBL IDs (targets and compounds) kept by the filters, see compile_filters_chembl
+    """
+    where, params = compile_filters_chembl(dic)
+    cursor = open_store(path, dataset).execute(f"SELECT ChEMBL_Id FROM ChEMBL WHERE {where} ORDER BY ChEMBL_Id", params)
+    return [chembl_id for chembl_id, in cursor]
+
+def get_values_for_rows_chembl(chembl_ids, dataset=None, path=STORE_PATH):
+    """
+    Return a dictionary of columns for the ChEMBL IDs: "ChEMBL ID", "Type", then one list per
+    member of Bioactivity_data (None where an entry does not have it)
+    """
+    connection = open_store(path, dataset)
+    records = {}
+    for chembl_id, chembl_type, data in connection.execute(
+            "SELECT ChEMBL_Id, Type, Bioactivity_data FROM ChEMBL WHERE ChEMBL_Id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(chembl_ids)),)):
+        records[chembl_id] = (chembl_type, json.loads(data))
+    fields = list(dict.fromkeys(key for _, data in records.values() for key in data))
+    dic = {"ChEMBL ID": list(chembl_ids), "Type": [records.get(i, (None, {}))[0] for i in chembl_ids]}
+    for field in fields:
+        dic[field] = [records.get(i, (None, {}))[1].get(field) for i in chembl_ids]
+    return dic
+
+def search_text(table, query, dataset=None, path=STORE_PATH):
+    """
+    SQLite version of import_CSV.search_text: rows of a table ("uniprot" or "drugbank")
+    matching a full-text query in its FTS5 table, best BM25 rank first
+    """
+    if table not in text_tables_sql:
+        raise ValueError(f"Unknown table '{table}'")
+    match = fts_query(query, text_fields[table])
+    if match is None:
+        return []
+    text_table = text_tables_sql[table]
+    cursor = open_store(path, dataset).execute(
+        f"SELECT rowid FROM {text_table} WHERE {text_table} MATCH ? ORDER BY rank, rowid", (match,))
+    return [row for row, in cursor]
+
+if __name__ == "__main__":
+    print(f"Wrote {build_store()}")
@@ -0,0 +1,118 @@
+import re
+import numpy as np
+import pandas as pd
+
+# UniProt columns the taxonomy is built from
+taxonomy_columns = ["Organism", "Organism (ID)", "Taxonomic lineage", "Taxonomic lineage (Ids)"]
+
+# Taxon above every lineage (cellular organisms, viruses...)
+ROOT = 1
+
+_lineage_item = re.compile(r"(.*?) \(([^()]+)\)(?:, |$)")
+
+def parse_lineage(names, ids):
+    """
+    Return the (taxon ID, name, rank) of a lineage, from the root down, given the
+    "Taxonomic lineage" and "Taxonomic lineage (Ids)" values of an entry
+    """
+    if pd.isna(ids):
+        return []
+    id_items = _lineage_item.findall(str(ids))
+    name_items = _lineage_item.findall(str(names)) if not pd.isna(names) else []
+    if len(name_items) != len(id_items):
+        # Names that could not be split, keep the IDs
+        name_items = [(taxid, rank) for taxid, rank in id_items]
+    return [(int(taxid), name, rank) for (taxid, rank), (name, _) in zip(id_items, name_items)]
+
+class Taxonomy:
+    """
+    Taxonomy tree of the UniProt entries, built from their lineage and organism, with
+    nested-set numbering: the taxa of a clade are numbered from left[clade] to right[clade]
+    in a depth-first walk, so an entry belongs to a clade when the number of its organism is
+    in that interval (one range check per row, whatever the size of the tree).
+    """
+
+    def __init__(self, df_uniprot):
+        self.parent = {ROOT: None}
+        self.name = {ROOT: "root"}
+        self.rank = {ROOT: "no rank"}
+        organisms = []
+        for organism, organism_id, names, ids in df_uniprot[taxonomy_columns].itertuples(index=False):
+            lineage = parse_lineage(names, ids)
+            if not pd.isna(organism_id) and int(organism_id) not in [taxid for taxid, _, _ in lineage]:
+                lineage.append((int(organism_id), organism, "species"))
+            parent = ROOT
+            for taxid, name, rank in lineage:
+                if taxid not in self.parent:
+                    self.parent[taxid] = parent
+                    self.name[taxid] = name
+                    self.rank[taxid] = rank
+                parent = taxid
+            organisms.append(parent if lineage else None)
+
+        children = {}
+        for taxid, parent in self.parent.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(taxid)
+
+        # Nested-set numbers and depth, from a depth-first walk (children by name)
+        self.left = {}
+        self.right = {}
+        self.depth = {ROOT: 0}
+        self.order = []
+        counter = 0
+        stack = [(ROOT, False)]
+        while stack:
+            taxid, done = stack.pop()
+            if done:
+                self.right[taxid] = counter - 1
+                continue
+            self.left[taxid] = counter
+            self.order.append(taxid)
+            counter += 1
+            stack.append((taxid, True))
+            for child in sorted(children.get(taxid, []), key=lambda child: self.name[child], reverse=True):
+                self.depth[child] = self.depth[taxid] + 1
+                stack.append((child, False))
+
+        # Number of the organism of every row (-1 without lineage)
+        self.row_numbers = np.array([self.left[taxid] if taxid is not None else -1 for taxid in organisms],
+                                    dtype=np.int64)
+        self.sorted_numbers = np.sort(self.row_numbers)
+
+    def rows(self, clades):
+        """
+        Return a boolean array over the rows, True where the organism belongs to any of the clades (taxon IDs)
+        """
+        mask = np.zeros(len(self.row_numbers), dtype=bool)
+        for clade in clades:
+            clade = int(clade)
+            if clade in self.left:
+                mask |= (self.row_numbers >= self.left[clade]) & (self.row_numbers <= self.right[clade])
+        return mask
+
+    def count(self, clade):
+        """
+        Number of rows whose organism belongs to a clade
+        """
+        start, stop = np.searchsorted(self.sorted_numbers, [self.left[clade], self.right[clade] + 1])
+        return int(stop - start)
+
+    def lineage(self, taxid):
+        """
+        Taxon IDs from the root down to taxid
+        """
+        lineage = []
+        while taxid is not None:
+            lineage.append(taxid)
+            taxid = self.parent[taxid]
+        return lineage[::-1]
+
+def build_taxonomy(dataset):
+    return Taxonomy(dataset.table("uniprot", taxonomy_columns))
+
+def get_taxonomy(dataset):
+    """
+    Return the taxonomy tree of a dataset, built on first use
+    """
+    return dataset.derived("taxonomy", build_taxonomy)
@@ -0,0 +1,303 @@
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from data_store import tables, source_stamp
+
+# Narrative columns searched by the full-text filter: table -> {field name used in queries: column}
+text_fields = {
+    "uniprot": {
+        "name": "Protein names",
+        "function": "Function [CC]",
+        "disease": "Involvement in disease",
+        "tissue": "Tissue specificity",
+        "location": "Subcellular location [CC]",
+    },
+    "drugbank": {
+        "name": "Name",
+        "description": "Description",
+        "indication": "Indication",
+        "pharmacodynamics": "Pharmacodynamics",
+        "mechanism": "Mechanism of Action",
+        "absorption": "Absorption",
+        "metabolism": "Metabolism",
+        "elimination": "Route of Elimination",
+        "interactions": "Drug Interactions",
+        "food": "Food Interactions",
+    },
+}
+
+# Index saved next to the columnar copies, reused while the files of the table are unchanged
+text_index_paths = {"uniprot": "uniprot_text.npz", "drugbank": "drugbank_text.npz"}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_word = re.compile(r"[A-Za-z0-9]+")
+_vowel = re.compile(r"[aeiouy]")
+
+# Derivational suffixes reduced by stem(), longest first
+_suffixes = [
+    ("ational", "ate"), ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"), ("ousness", "ous"),
+    ("ations", "ate"), ("ation", "ate"), ("ating", "ate"), ("ated", "ate"), ("ities", "ity"),
+    ("ness", ""), ("ings", ""), ("ing", ""), ("sses", "ss"), ("ies", "y"), ("ed", ""), ("s", ""),
+]
+
+@lru_cache(maxsize=1 << 16)
+def stem(word):
+    """
+    Light English stemmer (suffix stripping in the spirit of Porter's step 1), so that
+    "receptors", "inhibits"/"inhibited"/"inhibiting" and "activation"/"activate" match.
+    Words with digits (gene and enzyme names, e.g. "cyp3a4") and short words are kept as they are.
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    for suffix, replacement in _suffixes:
+        if word.endswith(suffix) and not (suffix == "s" and word.endswith(("ss", "us", "is"))):
+            base = word[:-len(suffix)] + replacement
+            # Keep a vowel and at least 3 letters in the stem
+            if len(base) >= 3 and _vowel.search(base[:-1] if len(base) > 1 else base):
+                if suffix in ("ed", "ing", "ings") and len(base) > 3 and base[-1] == base[-2] \
+                        and base[-1] not in "lsz":
+                    # Doubled consonant: "stopped" -> "stop"
+                    base = base[:-1]
+                return base
+    return word
+
+def tokenize(text):
+    """
+    Stemmed, lower-cased words of a text
+    """
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return []
+    return [stem(word.lower()) for word in _word.findall(str(text))]
+
+def parse_query(query, fields):
+    """
+    Split a query into clauses (fields, terms): every term must occur in one of the fields of its
+    clause (all the fields when None). "field:word" and field:"several words" restrict the words
+    to a field of fields, other words and "quoted words" search every field.
+    """
+    clauses = []
+    for match in re.finditer(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))', query):
+        field, quoted, word = match.group(1), match.group(2), match.group(3)
+        text = quoted if quoted is not None else word
+        if field is not None and field.lower() not in fields:
+            # Not a field name (e.g. "Ca:2"), search the whole text
+            text, field = match.group(0), None
+        for term in tokenize(text):
+            clauses.append(((field.lower(),) if field else None, term))
+    return clauses
+
+class TextIndex:
+    """
+    Inverted index over the narrative columns of a table, with BM25 ranking.
+    For every field the postings of a term are a slice of rows (and term frequencies)
+    given by a pointer array over the sorted vocabulary.
+    """
+
+    def __init__(self, terms, pointers, rows, frequencies, lengths):
+        # Sorted vocabulary shared by the fields, then per field: pointers into posting_rows and
+        # posting_frequencies (term i is in posting_rows[pointers[i]:pointers[i + 1]]) and the
+        # number of words per row
+        self.terms = terms
+        self.fields = list(pointers)
+        self.pointers = pointers
+        self.posting_rows = rows
+        self.posting_frequencies = frequencies
+        self.lengths = lengths
+        self.n_rows = len(next(iter(lengths.values()))) if lengths else 0
+        self.average_lengths = {field: max(float(length.mean()), 1.0) if len(length) else 1.0
+                                for field, length in lengths.items()}
+
+    @classmethod
+    def build(cls, columns):
+        """
+        Index a dictionary field -> Series of texts (all of the same length)
+        """
+        postings = {}
+        lengths = {}
+        for field, texts in columns.items():
+            field_terms, field_rows, field_frequencies = [], [], []
+            length = np.zeros(len(texts), dtype=np.float32)
+            for row, text in enumerate(texts):
+                counts = Counter(tokenize(text))
+                length[row] = sum(counts.values())
+                field_terms += counts.keys()
+                field_rows += [row] * len(counts)
+                field_frequencies += counts.values()
+            postings[field] = (np.asarray(field_terms, dtype=str), np.asarray(field_rows, dtype=np.int32),
+                               np.asarray(field_frequencies, dtype=np.float32))
+            lengths[field] = length
+
+        terms = np.unique(np.concatenate([field_terms for field_terms, _, _ in postings.values()])
+                          if postings else np.zeros(0, dtype=str))
+        pointers, rows, frequencies = {}, {}, {}
+        for field, (field_terms, field_rows, field_frequencies) in postings.items():
+            term_ids = np.searchsorted(terms, field_terms)
+            order = np.lexsort((field_rows, term_ids))
+            pointers[field] = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(terms)))]).astype(np.int64)
+            rows[field] = field_rows[order]
+            frequencies[field] = field_frequencies[order]
+        return cls(terms, pointers, rows, frequencies, lengths)
+
+    def save(self, path, stamp):
+        """
+        Write the index to path (npz) with the stamp of the files it was built from
+        """
+        arrays = {"terms": self.terms, "fields": np.asarray(self.fields, dtype=str),
+                  "stamp": np.asarray(json.dumps(stamp))}
+        for i, field in enumerate(self.fields):
+            arrays[f"pointers_{i}"] = self.pointers[field]
+            arrays[f"rows_{i}"] = self.posting_rows[field]
+            arrays[f"frequencies_{i}"] = self.posting_frequencies[field]
+            arrays[f"lengths_{i}"] = self.lengths[field]
+        # Unique file next to the final one, renamed at the end: readers and concurrent
+        # writers never see a partial index
+        fd, partial_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".partial",
+                                            dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(partial_path, path)
+        except BaseException:
+            os.remove(partial_path)
+            raise
+
+    @classmethod
+    def load(cls, path, stamp):
+        """
+        Read an index written by save, None if the file is missing or was built from other files
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            if json.loads(str(arrays["stamp"])) != json.loads(json.dumps(stamp)):
+                return None
+            fields = arrays["fields"].tolist()
+            return cls(arrays["terms"],
+                       {field: arrays[f"pointers_{i}"] for i, field in enumerate(fields)},
+                       {field: arrays[f"rows_{i}"] for i, field in enumerate(fields)},
+                       {field: arrays[f"frequencies_{i}"] for i, field in enumerate(fields)},
+                       {field: arrays[f"lengths_{i}"] for i, field in enumerate(fields)})
+
+    def postings(self, field, term):
+        """
+        (rows, term frequencies) of a term in a field
+        """
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return self.posting_rows[field][:0], self.posting_frequencies[field][:0]
+        start, stop = self.pointers[field][i], self.pointers[field][i + 1]
+        return self.posting_rows[field][start:stop], self.posting_frequencies[field][start:stop]
+
+    def scores(self, query):
+        """
+        Return (boolean array over the rows, True where every term of the query is found,
+        BM25 score of every row). An empty query matches every row with a score of 0.
+        """
+        mask = np.ones(self.n_rows, dtype=bool)
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for fields, term in parse_query(query, self.fields):
+            found = np.zeros(self.n_rows, dtype=bool)
+            for field in fields or self.fields:
+                rows, frequencies = self.postings(field, term)
+                if len(rows) == 0:
+                    continue
+                found[rows] = True
+                idf = np.log(1 + (self.n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[field][rows] / self.average_lengths[field])
+                scores[rows] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+            mask &= found
+        return mask, scores
+
+    def rows(self, query):
+        """
+        Return a boolean array over the rows, True where every term of the query is found
+        """
+        return self.scores(query)[0]
+
+    def search(self, query, top_k=None):
+        """
+        Return the matching rows, best BM25 score first, and their scores
+        """
+        mask, scores = self.scores(query)
+        rows = np.flatnonzero(mask)
+        order = np.argsort(-scores[rows], kind="stable")[:top_k]
+        return rows[order], scores[rows[order]]
+
+def snippet(query, texts, width=30):
+    """
+    Return a Markdown extract of the texts of a row (dictionary field -> text) around the words
+    of the query, in bold, taken from the field with the most matches. None without a match.
+
+    Parameters:
+    - query: full-text query (see parse_query)
+    - texts: field -> text of the row
+    - width: number of words of the extract
+    """
+    best = None
+    for field, text in texts.items():
+        terms = {term for fields, term in parse_query(query, list(texts)) if fields is None or field in fields}
+        if not terms or text is None or (not isinstance(text, str) and pd.isna(text)):
+            continue
+        words = list(_word.finditer(str(text)))
+        matched = np.array([stem(word.group().lower()) in terms for word in words], dtype=np.int64)
+        if not matched.any():
+            continue
+        # Window of width words with the most matches
+        window = np.convolve(matched, np.ones(min(width, len(words)), dtype=np.int64), mode="valid")
+        start = int(np.argmax(window))
+        if best is None or window[start] > best[0]:
+            best = (window[start], field, str(text), words[start:start + width], matched[start:start + width])
+    if best is None:
+        return None
+
+    _, field, text, words, matched = best
+    parts = []
+    position = words[0].start()
+    for word, is_matched in zip(words, matched):
+        parts.append(text[position:word.start()])
+        parts.append(f"**{word.group()}**" if is_matched else word.group())
+        position = word.end()
+    prefix = "…" if words[0].start() > 0 else ""
+    suffix = "…" if words[-1].end() < len(text) else ""
+    return f"*{field}*: {prefix}{''.join(parts)}{suffix}"
+
+def table_stamp(table):
+    """
+    Part of source_stamp about the files of a table
+    """
+    return [entry for entry in source_stamp() if entry[0] in tables[table]]
+
+def build_text_index(dataset, table):
+    columns = list(text_fields[table].values())
+    df = dataset.table(table, columns)
+    return TextIndex.build({field: df[column] for field, column in text_fields[table].items()})
+
+def get_text_index(dataset, table):
+    """
+    Return the full-text index of a dataset table ("uniprot" or "drugbank"), read from its
+    file when it was built from the current data files, otherwise built in memory (the file
+    is only written by save_text_index, at ingest)
+    """
+    def build(dataset):
+        if dataset.sources is not None:
+            index = TextIndex.load(text_index_paths[table], table_stamp(table))
+            if index is not None:
+                return index
+        return build_text_index(dataset, table)
+    return dataset.derived(("text_index", table), build)
+
+def save_text_index(dataset, table):
+    """
+    Build the full-text index of a table of the data files and write it to text_index_paths
+    """
+    stamp = table_stamp(table)
+    build_text_index(dataset, table).save(text_index_paths[table], stamp)
+    return text_index_paths[table]